@@ -1,19 +1,168 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import Body, FastAPI, HTTPException, Depends, Request, Response, Header
+from fastapi.responses import StreamingResponse
 from fastapi.security import APIKeyHeader
 from typing import List, Optional, Union
-from pydantic import BaseModel, EmailStr
-import os
-from datetime import datetime
+from pydantic import BaseModel, EmailStr, TypeAdapter, ValidationError
+import asyncio
+import json
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 
 from models import (
     Company, EmailAddress, Notification, Alert
 )
 from service import EmailService
+from retry import PERMANENT, RetryPolicy, classify
+from outbox import Outbox, OutboxWorkers
+from idempotency import IdempotencyMiddleware, IdempotencyStore
+from coalesce import NotificationCoalescer
+from ingest import UPLOAD_FORMATS, RecipientUpload, UploadError
+from suppression import SuppressionList
+from settings import Settings
+from transports import (
+    FailoverTransport, MaildirTransport, MemoryTransport, ResendTransport, SMTPTransport, Transport
+)
 from emails.templates import (
     WelcomeEmail, PasswordResetEmail, NotificationEmail, AlertEmail
 )
 
-app = FastAPI(title="Email System API", version="1.0.0")
+def build_transport(settings: Settings) -> Transport:
+    """Crea el transporte de EMAIL_TRANSPORT; con varios, los siguientes sirven de respaldo."""
+    transports = []
+    for name in settings.transports:
+        if name == "resend":
+            transports.append(ResendTransport(settings.resend_api_key, settings.send_concurrency))
+        elif name == "smtp":
+            transports.append(SMTPTransport(
+                settings.smtp_host,
+                settings.smtp_port,
+                username=settings.smtp_username,
+                password=settings.smtp_password,
+                starttls=settings.smtp_starttls,
+                use_ssl=settings.smtp_ssl,
+                pool_size=settings.smtp_pool_size,
+                max_messages=settings.smtp_max_messages,
+                idle_timeout=settings.smtp_idle_timeout
+            ))
+        elif name == "maildir":
+            transports.append(MaildirTransport(settings.maildir_path))
+        elif name == "memory":
+            transports.append(MemoryTransport())
+        else:
+            raise ValueError(f"Transporte de email desconocido: {name}")
+    if len(transports) == 1:
+        return transports[0]
+    return FailoverTransport(transports)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Crea el servicio de email una sola vez y precompila las plantillas."""
+    settings = Settings.from_env()
+    app.state.settings = settings
+    app.state.email_service = None
+    app.state.outbox = None
+    app.state.outbox_workers = None
+    app.state.coalescer = None
+    app.state.ready = asyncio.Event()
+    
+    # Respuestas de las peticiones con Idempotency-Key (ver IdempotencyMiddleware)
+    app.state.idempotency = IdempotencyStore(
+        settings.idempotency_cache_size,
+        settings.idempotency_ttl,
+        settings.idempotency_path
+    )
+    
+    warm_up = None
+    # La API key de Resend solo es necesaria si se usa ese transporte
+    if settings.resend_api_key or "resend" not in settings.transports:
+        service = EmailService(
+            api_key=settings.resend_api_key,
+            default_from=settings.default_from,
+            bytecode_cache_dir=settings.template_cache_dir,
+            compiled_templates=settings.compiled_templates,
+            render_cache_size=settings.render_cache_size,
+            render_cache_ttl=settings.render_cache_ttl,
+            render_workers=settings.render_workers,
+            optimize_payload=settings.optimize_payload,
+            watch_templates=settings.watch_templates,
+            send_concurrency=settings.send_concurrency,
+            send_rate=settings.send_rate,
+            send_burst=settings.send_burst,
+            lane_weights=settings.lane_weights,
+            retry_policy=RetryPolicy(
+                max_attempts=settings.retry_max_attempts,
+                base_delay=settings.retry_base_delay,
+                max_delay=settings.retry_max_delay
+            ),
+            transport=build_transport(settings),
+            suppression_list=(
+                SuppressionList.from_file(settings.suppression_list)
+                if settings.suppression_list else None
+            )
+        )
+        app.state.email_service = service
+        
+        # La compilación se hace en segundo plano; /health/ready indica cuándo termina
+        async def run_warm_up():
+            try:
+                await asyncio.to_thread(service.warm_up)
+            finally:
+                app.state.ready.set()
+        warm_up = asyncio.create_task(run_warm_up())
+        
+        # Los lotes se encolan en el outbox y los envían estos workers
+        async def deliver(job_request, recipients):
+            if job_request.get("single"):
+                # Un email suelto programado: un único mensaje a todos sus destinatarios
+                email_obj, subject, to = build_single_email(job_request)
+                try:
+                    result = await service.send_async(email=email_obj, to=to, subject=subject)
+                except Exception as e:
+                    return [{
+                        "error": str(e),
+                        "email": to[0].email,
+                        "attempts": getattr(e, "attempts", 1),
+                        "retryable": classify(e) != PERMANENT
+                    }]
+                return [result]
+            email_obj, subject = build_batch_email(job_request)
+            return await service.send_batch_async(
+                email=email_obj,
+                recipients=recipients,
+                subject=subject
+            )
+        
+        app.state.outbox = Outbox(settings.outbox_path)
+        app.state.outbox_workers = OutboxWorkers(app.state.outbox, deliver, settings.outbox_workers)
+        app.state.outbox_workers.start()
+        
+        # Las ráfagas de notificaciones para un mismo usuario se agrupan en un digest
+        if settings.notification_window > 0:
+            # Las notificaciones pendientes se guardan en el outbox y sobreviven a reinicios
+            app.state.coalescer = NotificationCoalescer(
+                service,
+                settings.notification_window,
+                settings.notification_digest_size,
+                app.state.outbox
+            )
+            await app.state.coalescer.restore()
+    
+    yield
+    
+    if warm_up:
+        warm_up.cancel()
+    if app.state.coalescer is not None:
+        await app.state.coalescer.aclose()
+    if app.state.outbox_workers is not None:
+        await app.state.outbox_workers.stop()
+        app.state.outbox.close()
+    if app.state.email_service is not None:
+        await app.state.email_service.aclose()
+    app.state.idempotency.close()
+
+app = FastAPI(title="Email System API", version="1.0.0", lifespan=lifespan)
+app.add_middleware(IdempotencyMiddleware)
 
 # Configuración de seguridad
 API_KEY_NAME = "X-API-Key"
@@ -85,154 +234,325 @@ class AlertBase(BaseModel):
     contact_support: bool = True
 
 # Configuración del servicio de email
-def get_email_service():
-    api_key = os.getenv("RESEND_API_KEY")
-    if not api_key:
+def get_email_service(request: Request) -> EmailService:
+    service = request.app.state.email_service
+    if service is None:
         raise HTTPException(status_code=500, detail="RESEND_API_KEY no configurada")
-    
-    default_from = EmailAddress(
-        email=os.getenv("DEFAULT_FROM_EMAIL", "no-reply@example.com"),
-        name=os.getenv("DEFAULT_FROM_NAME", "Email System")
-    )
-    
-    return EmailService(api_key=api_key, default_from=default_from)
+    return service
+
+def get_outbox(request: Request) -> Outbox:
+    outbox = request.app.state.outbox
+    if outbox is None:
+        raise HTTPException(status_code=500, detail="RESEND_API_KEY no configurada")
+    return outbox
 
 # Middleware de autenticación
-async def verify_api_key(api_key: str = Depends(api_key_header)):
-    if api_key != os.getenv("API_KEY"):
+async def verify_api_key(request: Request, api_key: str = Depends(api_key_header)):
+    if api_key != request.app.state.settings.api_key:
         raise HTTPException(
             status_code=403,
             detail="API key inválida"
         )
     return api_key
 
-# Rutas de la API
-
-@app.post("/api/emails/batch")
-async def send_batch_emails(
-    request_data: dict,  # Recibe todos los datos en un solo objeto
-    api_key: str = Depends(verify_api_key)
-):
+def build_batch_email(request_data: dict):
     """
-    Envía emails personalizados a múltiples destinatarios en un solo llamado.
+    Crea el email de un lote a partir de los datos de la petición. Retorna el
+    email y el asunto; lanza HTTPException 400 si faltan datos.
     """
-    try:
-        # Extraer datos del cuerpo
-        email_type = request_data.get("email_type")
-        company_data = request_data.get("company")
-        recipients_data = request_data.get("recipients", [])
-        query_data = request_data.get("query", {})
-        alert_data = request_data.get("alert")
+    # Extraer datos del cuerpo
+    email_type = request_data.get("email_type")
+    company_data = request_data.get("company")
+    recipients_data = request_data.get("recipients", [])
+    query_data = request_data.get("query", {})
+    alert_data = request_data.get("alert")
+    
+    # Validar datos
+    if not email_type:
+        raise HTTPException(status_code=400, detail="email_type es requerido")
+    if not company_data:
+        raise HTTPException(status_code=400, detail="company es requerido")
+    if not recipients_data:
+        raise HTTPException(status_code=400, detail="recipients es requerido")
+    
+    # Convertir datos de diccionario a objetos
+    company = Company(
+        name=company_data.get("name", ""),
+        address=company_data.get("address", ""),
+        support_email=EmailAddress(
+            email=company_data.get("support_email", ""),
+            name=company_data.get("name", "")
+        ),
+        website=company_data.get("website", ""),
+        social_media=company_data.get("social_media", {}),
+        logo_url=company_data.get("logo_url")
+    )
+    
+    # Validar que haya destinatarios
+    if not recipients_data:
+        raise HTTPException(status_code=400, detail="No se proporcionaron destinatarios")
+    
+    # Obtener el primer destinatario como referencia para la plantilla
+    first_recipient = recipients_data[0]
+    primary_user = EmailAddress(
+        email=first_recipient.get("email", ""),
+        name=first_recipient.get("name")
+    )
+    
+    # Crear la instancia de email según el tipo
+    if email_type == "welcome":
+        if not query_data or 'dashboard_url' not in query_data:
+            raise HTTPException(status_code=400, detail="dashboard_url es requerido")
+            
+        email_obj = WelcomeEmail(
+            company=company,
+            user=primary_user,
+            dashboard_url=query_data.get("dashboard_url")
+        )
+        subject = f"¡Bienvenido a {company.name}!"
         
-        # Validar datos
-        if not email_type:
-            raise HTTPException(status_code=400, detail="email_type es requerido")
-        if not company_data:
-            raise HTTPException(status_code=400, detail="company es requerido")
-        if not recipients_data:
-            raise HTTPException(status_code=400, detail="recipients es requerido")
+    elif email_type == "password-reset":
+        if not query_data or 'reset_url' not in query_data:
+            raise HTTPException(status_code=400, detail="reset_url es requerido")
+            
+        email_obj = PasswordResetEmail(
+            company=company,
+            user=primary_user,
+            reset_url=query_data.get("reset_url"),
+            expires_in=query_data.get("expires_in", 24)
+        )
+        subject = "Restablecimiento de contraseña"
         
-        # Convertir datos de diccionario a objetos
-        company = Company(
-            name=company_data.get("name", ""),
-            address=company_data.get("address", ""),
-            support_email=EmailAddress(
-                email=company_data.get("support_email", ""),
-                name=company_data.get("name", "")
-            ),
-            website=company_data.get("website", ""),
-            social_media=company_data.get("social_media", {}),
-            logo_url=company_data.get("logo_url")
+    elif email_type == "notification":
+        if not query_data:
+            raise HTTPException(status_code=400, detail="Se requieren datos para la notificación")
+            
+        notification_obj = Notification(
+            title=query_data.get("title", ""),
+            message=query_data.get("message", ""),
+            type=query_data.get("type", "info"),
+            icon=query_data.get("icon"),
+            action_url=query_data.get("action_url"),
+            action_text=query_data.get("action_text"),
+            additional_info=query_data.get("additional_info")
         )
         
-        # Obtener el servicio de email
-        service = get_email_service()
+        email_obj = NotificationEmail(
+            company=company,
+            user=primary_user,
+            notification=notification_obj,
+            preferences_url=query_data.get("preferences_url", "")
+        )
+        subject = notification_obj.title
         
-        # Validar que haya destinatarios
-        if not recipients_data:
-            raise HTTPException(status_code=400, detail="No se proporcionaron destinatarios")
+    elif email_type == "alert":
+        if not alert_data:
+            raise HTTPException(status_code=400, detail="Se requieren datos para la alerta")
+            
+        alert_obj = Alert(
+            title=alert_data.get("title", ""),
+            message=alert_data.get("message", ""),
+            type=alert_data.get("type", "info"),
+            steps=alert_data.get("steps"),
+            action_url=alert_data.get("action_url"),
+            action_text=alert_data.get("action_text"),
+            contact_support=alert_data.get("contact_support", True)
+        )
         
-        # Obtener el primer destinatario como referencia para la plantilla
-        first_recipient = recipients_data[0]
-        primary_user = EmailAddress(
-            email=first_recipient.get("email", ""),
-            name=first_recipient.get("name")
+        email_obj = AlertEmail(
+            company=company,
+            user=primary_user,
+            alert=alert_obj
         )
+        subject = alert_data.get("title", "Alerta")
         
-        # Crear la instancia de email según el tipo
-        if email_type == "welcome":
-            if not query_data or 'dashboard_url' not in query_data:
-                raise HTTPException(status_code=400, detail="dashboard_url es requerido")
-                
-            email_obj = WelcomeEmail(
-                company=company,
-                user=primary_user,
-                dashboard_url=query_data.get("dashboard_url")
-            )
-            subject = f"¡Bienvenido a {company.name}!"
-            
-        elif email_type == "password-reset":
-            if not query_data or 'reset_url' not in query_data:
-                raise HTTPException(status_code=400, detail="reset_url es requerido")
-                
-            email_obj = PasswordResetEmail(
-                company=company,
-                user=primary_user,
-                reset_url=query_data.get("reset_url"),
-                expires_in=query_data.get("expires_in", 24)
-            )
-            subject = "Restablecimiento de contraseña"
-            
-        elif email_type == "notification":
-            if not query_data:
-                raise HTTPException(status_code=400, detail="Se requieren datos para la notificación")
-                
-            notification_obj = Notification(
-                title=query_data.get("title", ""),
-                message=query_data.get("message", ""),
-                type=query_data.get("type", "info"),
-                icon=query_data.get("icon"),
-                action_url=query_data.get("action_url"),
-                action_text=query_data.get("action_text"),
-                additional_info=query_data.get("additional_info")
-            )
-            
-            email_obj = NotificationEmail(
-                company=company,
-                user=primary_user,
-                notification=notification_obj,
-                preferences_url=query_data.get("preferences_url", "")
-            )
-            subject = notification_obj.title
-            
-        elif email_type == "alert":
-            if not alert_data:
-                raise HTTPException(status_code=400, detail="Se requieren datos para la alerta")
-                
-            alert_obj = Alert(
-                title=alert_data.get("title", ""),
-                message=alert_data.get("message", ""),
-                type=alert_data.get("type", "info"),
-                steps=alert_data.get("steps"),
-                action_url=alert_data.get("action_url"),
-                action_text=alert_data.get("action_text"),
-                contact_support=alert_data.get("contact_support", True)
-            )
-            
-            email_obj = AlertEmail(
-                company=company,
-                user=primary_user,
-                alert=alert_obj
-            )
-            subject = alert_data.get("title", "Alerta")
-            
-        else:
-            raise HTTPException(status_code=400, detail=f"Tipo de email no válido: {email_type}")
+    else:
+        raise HTTPException(status_code=400, detail=f"Tipo de email no válido: {email_type}")
+    
+    return email_obj, subject
+
+def parse_send_at(value) -> Optional[float]:
+    """
+    Timestamp de `send_at` (fecha ISO 8601 o segundos desde epoch); las
+    fechas sin zona horaria se interpretan en UTC.
+    """
+    if value is None:
+        return None
+    try:
+        moment = TypeAdapter(datetime).validate_python(value)
+    except ValidationError:
+        raise HTTPException(status_code=400, detail="send_at debe ser una fecha ISO 8601 o un timestamp")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+def batch_spread(request_data: dict, settings: Settings, total: int) -> float:
+    """Segundos en los que repartir un lote: `spread` de la petición o BATCH_SPREAD si es grande."""
+    spread = request_data.get("spread")
+    if spread is None:
+        return settings.batch_spread if total >= settings.batch_spread_min else 0
+    if isinstance(spread, bool) or not isinstance(spread, (int, float)) or spread < 0:
+        raise HTTPException(status_code=400, detail="spread debe ser un número de segundos no negativo")
+    return float(spread)
+
+def format_send_at(send_at: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(send_at, timezone.utc).isoformat() if send_at is not None else None
+
+def single_recipients(user: Union[EmailAddressBase, MultiEmailAddressBase]) -> List[dict]:
+    """Destinatarios de un email suelto, en el formato en que se guardan en el outbox."""
+    if isinstance(user, MultiEmailAddressBase):
+        recipients = user.to_email_addresses()
+    else:
+        recipients = [EmailAddress(**user.model_dump())]
+    return [{"email": recipient.email, "name": recipient.name} for recipient in recipients]
+
+def build_single_email(request_data: dict):
+    """
+    Crea un email suelto (welcome, password-reset, notification o alert) a
+    partir de los datos de la petición. Lo usan tanto los endpoints como los
+    workers del outbox para los programados, así que ambos envían el mismo
+    HTML. Retorna el email, el asunto y los destinatarios; la plantilla usa
+    el primero.
+    """
+    company = Company(**request_data["company"])
+    recipients = [EmailAddress(**recipient) for recipient in request_data["recipients"]]
+    primary_user = recipients[0]
+    query = request_data.get("query") or {}
+    email_type = request_data["email_type"]
+    
+    if email_type == "welcome":
+        email = WelcomeEmail(
+            company=company,
+            user=primary_user,
+            dashboard_url=query.get('dashboard_url')
+        )
+        subject = f"¡Bienvenido a {company.name}!"
+    elif email_type == "password-reset":
+        email = PasswordResetEmail(
+            company=company,
+            user=primary_user,
+            reset_url=query.get('reset_url'),
+            expires_in=query.get('expires_in', 24)
+        )
+        subject = "Restablecimiento de contraseña"
+    elif email_type == "notification":
+        notification = Notification(
+            title=query.get('title'),
+            message=query.get('message'),
+            type=query.get('type'),
+            icon=query.get('icon'),
+            action_url=query.get('action_url'),
+            action_text=query.get('action_text'),
+            additional_info=query.get('additional_info')
+        )
+        email = NotificationEmail(
+            company=company,
+            user=primary_user,
+            notification=notification,
+            preferences_url=query.get('preferences_url')
+        )
+        subject = notification.title
+    elif email_type == "alert":
+        alert = Alert(**request_data["alert"])
+        email = AlertEmail(
+            company=company,
+            user=primary_user,
+            alert=alert
+        )
+        subject = alert.title
+    else:
+        raise ValueError(f"Tipo de email no válido: {email_type}")
+    
+    return email, subject, recipients
+
+async def schedule_email(request: Request, job_request: dict, send_at) -> dict:
+    """
+    Programa un email suelto: se guarda en el outbox como un trabajo de un
+    solo mensaje, por el carril de la prioridad del email, y los workers lo
+    envían a partir de `send_at` igual que sin programar (un único email a
+    todos los destinatarios, ver build_single_email).
+    """
+    send_at = parse_send_at(send_at)
+    outbox = get_outbox(request)
+    job_request["single"] = True
+    email_obj, _, _ = build_single_email(job_request)
+    
+    job_id = await asyncio.to_thread(
+        outbox.enqueue, job_request, job_request["recipients"][:1], send_at, 0, email_obj.priority
+    )
+    request.app.state.outbox_workers.notify()
+    return {"status": "scheduled", "job_id": job_id, "send_at": format_send_at(send_at)}
+
+def sse_event(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    """Formatea un evento Server-Sent Events."""
+    lines = [f"event: {event}", f"data: {json.dumps(data, default=str)}"]
+    if event_id is not None:
+        lines.insert(0, f"id: {event_id}")
+    return "\n".join(lines) + "\n\n"
+
+# Destinatarios de una subida que se guardan en el outbox en cada transacción
+UPLOAD_CHUNK = 1000
+
+# Segundos entre consultas al outbox mientras no hay resultados nuevos
+SSE_POLL_INTERVAL = 0.5
+# Segundos sin eventos tras los que se envía un comentario para mantener viva la conexión
+SSE_KEEPALIVE = 15
+
+# Rutas de la API
+
+@app.get("/health/ready")
+async def readiness(request: Request):
+    """Indica si el servicio terminó de precompilar las plantillas."""
+    if not request.app.state.ready.is_set():
+        raise HTTPException(status_code=503, detail="Precompilando plantillas")
+    return {"status": "ready"}
+
+@app.get("/api/emails/stats")
+async def get_send_stats(
+    request: Request,
+    api_key: str = Depends(verify_api_key),
+    service: EmailService = Depends(get_email_service)
+):
+    """
+    Estado del límite de envío (tasa actual y, por carril, cola y tiempos de
+    espera), de las claves de idempotencia y, si están activas, de la caché
+    de renderizado, de la optimización del HTML y de la agrupación de
+    notificaciones.
+    """
+    stats = {
+        "rate_limit": service.rate_limiter.stats(),
+        "idempotency": request.app.state.idempotency.stats()
+    }
+    if service.render_cache is not None:
+        stats["render_cache"] = service.render_cache.stats()
+    if service.optimizer is not None:
+        stats["payload"] = service.payload_stats()
+    if request.app.state.coalescer is not None:
+        stats["notifications"] = request.app.state.coalescer.stats()
+    return stats
+
+@app.post("/api/emails/batch", status_code=202)
+async def send_batch_emails(
+    request_data: dict,  # Recibe todos los datos en un solo objeto
+    request: Request,
+    api_key: str = Depends(verify_api_key),
+    service: EmailService = Depends(get_email_service)
+):
+    """
+    Encola el envío de emails personalizados a múltiples destinatarios y
+    responde de inmediato con el identificador del trabajo. Los workers del
+    outbox renderizan y envían los mensajes en segundo plano, a partir de
+    `send_at` si se indica y repartidos en `spread` segundos.
+    """
+    try:
+        # Validar los datos creando el email antes de encolar
+        build_batch_email(request_data)
+        send_at = parse_send_at(request_data.get("send_at"))
         
         # Procesar cada destinatario para preparar la lista para send_batch
         processed_recipients = []
         
-        for recipient in recipients_data:
+        for recipient in request_data.get("recipients", []):
             if "email" not in recipient:
                 continue
             
@@ -242,62 +562,235 @@ async def send_batch_emails(
             }
             processed_recipients.append(processed_recipient)
         
-        # Enviar los emails personalizados en lote
-        results = service.send_batch(
-            email=email_obj,
-            recipients=processed_recipients,
-            subject=subject
+        if not processed_recipients:
+            raise HTTPException(status_code=400, detail="No se proporcionaron destinatarios")
+        
+        # Las direcciones repetidas o suprimidas no llegan a encolarse
+        processed_recipients, skipped = await asyncio.to_thread(
+            service.filter_recipients, processed_recipients
         )
+        reasons = Counter(result["skipped"] for _, result in skipped)
         
-        # Contar éxitos y errores
-        success_count = sum(1 for r in results if isinstance(r, dict) and "id" in r)
-        error_count = len(results) - success_count
+        job_id = None
+        if processed_recipients:
+            # El primer destinatario sirve de referencia para la plantilla
+            job_request = {key: value for key, value in request_data.items() if key not in ("recipients", "single")}
+            job_request["recipients"] = request_data["recipients"][:1]
+            
+            spread = batch_spread(request_data, request.app.state.settings, len(processed_recipients))
+            job_id = await asyncio.to_thread(
+                request.app.state.outbox.enqueue, job_request, processed_recipients, send_at, spread
+            )
+            request.app.state.outbox_workers.notify()
         
         return {
-            "status": "success", 
-            "sent": success_count,
-            "failed": error_count,
-            "total": len(results)
+            "status": "queued" if job_id else "skipped",
+            "job_id": job_id,
+            "send_at": format_send_at(send_at),
+            "total": len(processed_recipients),
+            "duplicates": reasons["duplicate"],
+            "suppressed": reasons["suppressed"]
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/emails/batch/stream", status_code=202)
+async def stream_batch_emails(
+    request: Request,
+    content_type: str = Header(""),
+    x_batch_request: Optional[str] = Header(None),
+    api_key: str = Depends(verify_api_key),
+    service: EmailService = Depends(get_email_service),
+    outbox: Outbox = Depends(get_outbox)
+):
+    """
+    Encola un lote cuyos destinatarios llegan como NDJSON o CSV (ver
+    RecipientUpload). El cuerpo se lee por bloques a medida que se recibe y
+    cada bloque se guarda en el outbox, cuyos workers empiezan a enviar antes
+    de que termine la subida, así que la memoria no depende del tamaño de la
+    lista. Los datos del lote (email_type, company, query, alert, send_at,
+    spread) van en la cabecera X-Batch-Request como JSON o en la primera
+    línea del cuerpo. Si el lote se reparte, nada se envía hasta terminar
+    la subida, cuando se conoce el total.
+    """
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    if media_type not in UPLOAD_FORMATS:
+        raise HTTPException(status_code=415, detail=f"Content-Type debe ser {' o '.join(UPLOAD_FORMATS)}")
+    
+    job_request = {}
+    if x_batch_request:
+        try:
+            job_request = json.loads(x_batch_request)
+        except ValueError:
+            job_request = None
+        if not isinstance(job_request, dict):
+            raise HTTPException(status_code=400, detail="X-Batch-Request debe ser un objeto JSON")
+    
+    upload = RecipientUpload(request.stream(), media_type)
+    batches = upload.batches(UPLOAD_CHUNK)
+    try:
+        batch = await anext(batches, None)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if upload.request:
+        job_request.update(upload.request)
+    # Solo schedule_email marca los trabajos de un único email
+    job_request.pop("single", None)
+    if not batch:
+        raise HTTPException(status_code=400, detail="No se proporcionaron destinatarios")
+    
+    # El primer destinatario sirve de referencia para la plantilla
+    job_request["recipients"] = batch[:1]
+    build_batch_email(job_request)
+    send_at = parse_send_at(job_request.get("send_at"))
+    settings = request.app.state.settings
+    # Con el tamaño mínimo se sabe si el lote podría repartirse antes de conocer el total
+    hold = batch_spread(job_request, settings, settings.batch_spread_min) > 0
+    
+    suppression = service.suppression_list
+    if suppression is not None:
+        await asyncio.to_thread(suppression.refresh)
+    
+    def store(recipients, position):
+        # Las direcciones suprimidas no se guardan; las repetidas las descarta el outbox
+        rows = []
+        for offset, recipient in enumerate(recipients, position):
+            if suppression is None or recipient["email"] not in suppression:
+                rows.append((offset, recipient))
+        return outbox.append(job_id, rows, hold), len(recipients) - len(rows)
+    
+    job_id = await asyncio.to_thread(outbox.open_job, job_request, send_at)
+    queued = suppressed = position = 0
+    try:
+        while batch:
+            added, dropped = await asyncio.to_thread(store, batch, position)
+            queued += added
+            suppressed += dropped
+            position += len(batch)
+            request.app.state.outbox_workers.notify()
+            batch = await anext(batches, None)
+    except BaseException as e:
+        # Subida interrumpida o mal formada: lo que aún no se envió se descarta
+        await asyncio.shield(asyncio.to_thread(outbox.seal, job_id, True))
+        if isinstance(e, UploadError):
+            raise HTTPException(status_code=400, detail=str(e))
+        raise
+    await asyncio.to_thread(outbox.seal, job_id, False, batch_spread(job_request, settings, queued))
+    request.app.state.outbox_workers.notify()
+    
+    return {
+        "status": "queued" if queued else "skipped",
+        "job_id": job_id,
+        "send_at": format_send_at(send_at),
+        "total": queued,
+        "duplicates": position - suppressed - queued,
+        "suppressed": suppressed,
+        "invalid": upload.invalid
+    }
+
+@app.get("/api/emails/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    api_key: str = Depends(verify_api_key),
+    outbox: Outbox = Depends(get_outbox)
+):
+    """Progreso de un trabajo: contadores, mensajes por segundo y tiempo estimado."""
+    job = await asyncio.to_thread(outbox.job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+@app.get("/api/emails/jobs/{job_id}/events")
+async def stream_job_events(
+    job_id: str,
+    request: Request,
+    last_event_id: Optional[int] = Header(None),
+    api_key: str = Depends(verify_api_key),
+    outbox: Outbox = Depends(get_outbox)
+):
+    """
+    Transmite el progreso de un trabajo con Server-Sent Events: un evento
+    `result` por destinatario a medida que termina (con su número de
+    secuencia como id), un evento `progress` cuando cambian los contadores y
+    un evento `done` al terminar. Con la cabecera Last-Event-ID el cliente
+    retoma la transmisión donde la dejó.
+    """
+    job = await asyncio.to_thread(outbox.job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    
+    async def events():
+        seq = last_event_id or 0
+        counters = None
+        idle = 0.0
+        while not await request.is_disconnected():
+            results = await asyncio.to_thread(outbox.results, job_id, seq)
+            for result in results:
+                seq = result["seq"]
+                yield sse_event("result", result, seq)
+            
+            job = await asyncio.to_thread(outbox.job, job_id)
+            if (job["sent"], job["failed"], job["skipped"]) != counters:
+                counters = (job["sent"], job["failed"], job["skipped"])
+                yield sse_event("progress", job)
+                idle = 0.0
+            
+            # Todos los resultados se registran antes de marcar el trabajo como terminado
+            if job["status"] == "done" and seq >= job["sent"] + job["failed"] + job["skipped"]:
+                yield sse_event("done", job)
+                return
+            
+            if not results:
+                await asyncio.sleep(SSE_POLL_INTERVAL)
+                idle += SSE_POLL_INTERVAL
+                if idle >= SSE_KEEPALIVE:
+                    yield ": keepalive\n\n"
+                    idle = 0.0
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/api/emails/welcome")
 async def send_welcome_email(
     company: CompanyBase,
     user: Union[EmailAddressBase, MultiEmailAddressBase],  # Acepta ambos tipos
     query: dict,
-    api_key: str = Depends(verify_api_key)
+    request: Request,
+    response: Response,
+    send_at: Optional[datetime] = Body(None),
+    api_key: str = Depends(verify_api_key),
+    service: EmailService = Depends(get_email_service)
 ):
+    """Envía un email de bienvenida; con `send_at`, lo programa (ver schedule_email)."""
     try:
-        service = get_email_service()
-        company_obj = Company(**company.model_dump())
-        
-        # Procesar el o los destinatarios
-        if isinstance(user, MultiEmailAddressBase):
-            recipients = user.to_email_addresses()
-            # Usamos el primer usuario para la plantilla
-            primary_user = recipients[0]
-        else:
-            recipients = [EmailAddress(**user.model_dump())]
-            primary_user = recipients[0]
-        
-        email = WelcomeEmail(
-            company=company_obj,
-            user=primary_user,  # Usamos el primer usuario para la plantilla
-            dashboard_url=query.get('dashboard_url')
-        )
+        job_request = {
+            "email_type": "welcome",
+            "company": company.model_dump(),
+            "recipients": single_recipients(user),
+            "query": query
+        }
+        if send_at is not None:
+            response.status_code = 202
+            return await schedule_email(request, job_request, send_at)
         
-        result = service.send(
+        email, subject, recipients = build_single_email(job_request)
+        result = await service.send_async(
             email=email,
             to=recipients,  # Enviar a todos los destinatarios
-            subject=f"¡Bienvenido a {company.name}!"
+            subject=subject
         )
         
         return {"status": "success", "message_id": result.get("id")}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -306,35 +799,34 @@ async def send_password_reset(
     company: CompanyBase,
     user: Union[EmailAddressBase, MultiEmailAddressBase],
     query: dict,
-    api_key: str = Depends(verify_api_key)
+    request: Request,
+    response: Response,
+    send_at: Optional[datetime] = Body(None),
+    api_key: str = Depends(verify_api_key),
+    service: EmailService = Depends(get_email_service)
 ):
+    """Envía un email de restablecimiento de contraseña; con `send_at`, lo programa."""
     try:
-        service = get_email_service()
-        company_obj = Company(**company.model_dump())
-        
-        # Procesar el o los destinatarios
-        if isinstance(user, MultiEmailAddressBase):
-            recipients = user.to_email_addresses()
-            # Usamos el primer usuario para la plantilla
-            primary_user = recipients[0]
-        else:
-            recipients = [EmailAddress(**user.model_dump())]
-            primary_user = recipients[0]
-        
-        email = PasswordResetEmail(
-            company=company_obj,
-            user=primary_user,
-            reset_url=query.get('reset_url'),
-            expires_in=query.get('expires_in', 24)
-        )
+        job_request = {
+            "email_type": "password-reset",
+            "company": company.model_dump(),
+            "recipients": single_recipients(user),
+            "query": query
+        }
+        if send_at is not None:
+            response.status_code = 202
+            return await schedule_email(request, job_request, send_at)
         
-        result = service.send(
+        email, subject, recipients = build_single_email(job_request)
+        result = await service.send_async(
             email=email,
             to=recipients,
-            subject="Restablecimiento de contraseña"
+            subject=subject
         )
         
         return {"status": "success", "message_id": result.get("id")}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -343,45 +835,46 @@ async def send_notification(
     company: CompanyBase,
     user: Union[EmailAddressBase, MultiEmailAddressBase],
     query: dict,
-    api_key: str = Depends(verify_api_key)
+    request: Request,
+    response: Response,
+    send_at: Optional[datetime] = Body(None),
+    api_key: str = Depends(verify_api_key),
+    service: EmailService = Depends(get_email_service)
 ):
+    """
+    Envía una notificación. Con `send_at` se programa; si no, con
+    NOTIFICATION_WINDOW las notificaciones a un solo destinatario se agrupan
+    durante la ventana y se responde 202 sin esperar al envío (ver
+    NotificationCoalescer).
+    """
     try:
-        service = get_email_service()
-        company_obj = Company(**company.model_dump())
-        
-        # Procesar el o los destinatarios
-        if isinstance(user, MultiEmailAddressBase):
-            recipients = user.to_email_addresses()
-            # Usamos el primer usuario para la plantilla
-            primary_user = recipients[0]
-        else:
-            recipients = [EmailAddress(**user.model_dump())]
-            primary_user = recipients[0]
+        job_request = {
+            "email_type": "notification",
+            "company": company.model_dump(),
+            "recipients": single_recipients(user),
+            "query": query
+        }
+        if send_at is not None:
+            response.status_code = 202
+            return await schedule_email(request, job_request, send_at)
         
-        notification_obj = Notification(
-            title=query.get('title'),
-            message=query.get('message'),
-            type=query.get('type'),
-            icon=query.get('icon'),
-            action_url=query.get('action_url'),
-            action_text=query.get('action_text'),
-            additional_info=query.get('additional_info')
-        )
+        email, subject, recipients = build_single_email(job_request)
         
-        email = NotificationEmail(
-            company=company_obj,
-            user=primary_user,
-            notification=notification_obj,
-            preferences_url=query.get('preferences_url')
-        )
+        coalescer = request.app.state.coalescer
+        if coalescer is not None and not isinstance(user, MultiEmailAddressBase):
+            pending = await coalescer.add(email.company, email.user, email.notification, email.preferences_url)
+            response.status_code = 202
+            return {"status": "queued", "pending": pending}
         
-        result = service.send(
+        result = await service.send_async(
             email=email,
             to=recipients,
-            subject=notification_obj.title
+            subject=subject
         )
         
         return {"status": "success", "message_id": result.get("id")}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -390,35 +883,34 @@ async def send_alert(
     company: CompanyBase,
     user: Union[EmailAddressBase, MultiEmailAddressBase],
     alert: AlertBase,
-    api_key: str = Depends(verify_api_key)
+    request: Request,
+    response: Response,
+    send_at: Optional[datetime] = Body(None),
+    api_key: str = Depends(verify_api_key),
+    service: EmailService = Depends(get_email_service)
 ):
+    """Envía una alerta; con `send_at`, la programa (ver schedule_email)."""
     try:
-        service = get_email_service()
-        company_obj = Company(**company.model_dump())
-        alert_obj = Alert(**alert.model_dump())
-        
-        # Procesar el o los destinatarios
-        if isinstance(user, MultiEmailAddressBase):
-            recipients = user.to_email_addresses()
-            # Usamos el primer usuario para la plantilla
-            primary_user = recipients[0]
-        else:
-            recipients = [EmailAddress(**user.model_dump())]
-            primary_user = recipients[0]
-        
-        email = AlertEmail(
-            company=company_obj,
-            user=primary_user,
-            alert=alert_obj
-        )
+        job_request = {
+            "email_type": "alert",
+            "company": company.model_dump(),
+            "recipients": single_recipients(user),
+            "alert": alert.model_dump()
+        }
+        if send_at is not None:
+            response.status_code = 202
+            return await schedule_email(request, job_request, send_at)
         
-        result = service.send(
+        email, subject, recipients = build_single_email(job_request)
+        result = await service.send_async(
             email=email,
             to=recipients,
-            subject=alert.title
+            subject=subject
         )
         
         return {"status": "success", "message_id": result.get("id")}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
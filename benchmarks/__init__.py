@@ -0,0 +1 @@
+"""Benchmarks del sistema de emails. Se ejecutan desde la raíz: python -m benchmarks.<nombre>"""
@@ -0,0 +1,54 @@
+"""
+Tiempo de inlining por renderizado: Premailer frente a StyleInliner.
+
+    python -m benchmarks.inliner --repeat 50
+"""
+import argparse
+import logging
+import time
+
+import cssutils
+from premailer import Premailer
+
+from inliner import StyleInliner
+from models import EmailAddress
+from service import EmailService
+from benchmarks.samples import sample_emails
+
+
+def timed(func, html: str, repeat: int) -> float:
+    """Retorna la media en ms."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(html)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Velocidad del inliner de CSS")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    cssutils.log.setLevel(logging.CRITICAL)
+
+    service = EmailService(
+        api_key="benchmark",
+        default_from=EmailAddress("no-reply@example.com"),
+        testing=True
+    )
+    inliner = StyleInliner()
+
+    def premailer(html):
+        return Premailer(html, keep_style_tags=True, remove_classes=False, strip_important=False).transform()
+
+    print(f"{'Plantilla':<22}{'Premailer (ms)':>16}{'StyleInliner (ms)':>20}{'Mejora':>10}{'Igual':>8}")
+    for email in sample_emails():
+        template = service.template_env.get_template(email.template_name)
+        html = template.render(**email.get_template_data())
+        same = premailer(html) == inliner.inline(html)
+        before = timed(premailer, html, args.repeat)
+        after = timed(inliner.inline, html, args.repeat)
+        print(f"{email.template_name:<22}{before:>16.2f}{after:>20.2f}{before / after:>9.1f}x{str(same):>8}")
+
+
+if __name__ == "__main__":
+    main()
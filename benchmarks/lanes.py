@@ -0,0 +1,78 @@
+"""
+Espera de los emails transaccionales en el límite de envío mientras un
+lote masivo ocupa toda la tasa, con y sin carriles de prioridad:
+
+    python -m benchmarks.lanes --rate 200 --bulk 500 --duration 5
+
+Los envíos masivos piden tokens sin parar desde `--bulk` corrutinas (como
+los bloques en vuelo de send_batch_async) y llega un email transaccional
+cada `--interval` segundos. Sin carriles, el transaccional espera detrás
+de toda la cola masiva; con carriles toma el siguiente token.
+"""
+import argparse
+import asyncio
+import time
+
+from rate_limit import BULK, TRANSACTIONAL, RateLimiter
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run(rate: float, burst: int, bulk: int, duration: float, interval: float, lanes: bool) -> tuple:
+    """Retorna las esperas de los transaccionales y los envíos masivos por segundo."""
+    limiter = RateLimiter(rate, burst)
+    transactional_lane = TRANSACTIONAL if lanes else BULK
+    deadline = time.monotonic() + duration
+    bulk_sent = 0
+    waits = []
+
+    async def bulk_sender():
+        nonlocal bulk_sent
+        while time.monotonic() < deadline:
+            await limiter.acquire_async(BULK)
+            if time.monotonic() < deadline:
+                bulk_sent += 1
+
+    async def transactional_sender():
+        # Se empieza a medir cuando la cola masiva ya está llena
+        await asyncio.sleep(interval)
+        while time.monotonic() < deadline:
+            start = time.monotonic()
+            await limiter.acquire_async(transactional_lane)
+            waits.append(time.monotonic() - start)
+            await asyncio.sleep(interval)
+
+    senders = [asyncio.create_task(bulk_sender()) for _ in range(bulk)]
+    await transactional_sender()
+    for task in senders:
+        task.cancel()
+    await asyncio.gather(*senders, return_exceptions=True)
+    return waits, bulk_sent / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Espera de los transaccionales bajo carga masiva")
+    parser.add_argument("--rate", type=float, default=200, help="Peticiones por segundo al proveedor")
+    parser.add_argument("--burst", type=int, default=2)
+    parser.add_argument("--bulk", type=int, default=500, help="Envíos masivos esperando a la vez")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--interval", type=float, default=0.05, help="Segundos entre transaccionales")
+    args = parser.parse_args()
+
+    print(f"{'Modo':<14}{'Transacc.':>10}{'p50 (ms)':>10}{'p99 (ms)':>10}{'Masivos/s':>11}")
+    for label, lanes in (("Sin carriles", False), ("Carriles", True)):
+        waits, bulk_rate = asyncio.run(run(args.rate, args.burst, args.bulk, args.duration, args.interval, lanes))
+        if not waits:
+            print(f"{label:<14}{0:>10}{'-':>10}{'-':>10}{bulk_rate:>11.0f}")
+            continue
+        print(
+            f"{label:<14}{len(waits):>10}"
+            f"{percentile(waits, 0.5) * 1000:>10.1f}{percentile(waits, 0.99) * 1000:>10.1f}{bulk_rate:>11.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Renderizado de un lote (destinatarios por segundo) en este proceso y
+repartido entre procesos, con y sin inline_once:
+
+    python -m benchmarks.render_pool --recipients 5000 --workers 0 2 4 8 16
+
+Con inline_once cada destinatario solo renderiza sus regiones, y serializar
+los datos y el HTML hacia y desde el pool cuesta más que eso: por eso
+EmailService solo usa el pool cuando cada destinatario necesita el
+renderizado completo de la plantilla.
+"""
+import argparse
+import os
+import time
+
+from models import EmailAddress
+from service import EmailService
+from benchmarks.samples import sample_emails, sample_recipients
+
+
+def run(workers: int, recipients: list, inline_once: bool) -> float:
+    """Retorna destinatarios por segundo."""
+    service = EmailService(
+        api_key="benchmark",
+        default_from=EmailAddress("no-reply@example.com"),
+        testing=True,
+        inline_once=inline_once,
+        render_workers=workers,
+        render_cache_size=0
+    )
+    email = sample_emails()[0]
+    context = email.get_template_data()
+    users = [dict(context["user"], **recipient) for recipient in recipients]
+
+    def render(users):
+        if service.render_pool is not None:
+            return service.render_pool.render(email.template_name, context, users)
+        renderer = service._personalized_renderer(email.template_name, context)
+        return (renderer.render(user) for user in users)
+
+    try:
+        # Arranque del pool y precalentamiento fuera de la medición
+        for _ in render(users[:max(workers, 1) * 2]):
+            pass
+        start = time.perf_counter()
+        # Sin guardar el HTML, para que la memoria no limite el tamaño del lote
+        for _ in render(users):
+            pass
+        return len(users) / (time.perf_counter() - start)
+    finally:
+        service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Renderizado de lotes con procesos")
+    parser.add_argument("--recipients", type=int, default=2000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    recipients = sample_recipients(args.recipients)
+    baseline = {}
+    print(f"{'Procesos':>8}{'inline_once':>14}{'':>7}{'Completo':>14}{'':>7}")
+    for workers in sorted(set(args.workers)):
+        row = f"{workers:>8}"
+        for inline_once in (True, False):
+            throughput = run(workers, recipients, inline_once)
+            baseline.setdefault(inline_once, throughput)
+            row += f"{throughput:>14.0f}{throughput / baseline[inline_once]:>7.2f}x"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
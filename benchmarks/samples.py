@@ -0,0 +1,40 @@
+from typing import List
+
+from models import Alert, Company, EmailAddress, Notification
+from emails.base import BaseEmail
+from emails.templates import AlertEmail, NotificationEmail, PasswordResetEmail, WelcomeEmail
+
+
+def sample_company() -> Company:
+    return Company(
+        name="Mi Empresa",
+        address="Calle Principal 123",
+        support_email=EmailAddress("soporte@miempresa.com"),
+        website="https://miempresa.com",
+        social_media={"facebook": "https://facebook.com/miempresa"},
+        logo_url="https://miempresa.com/logo.png"
+    )
+
+
+def sample_emails() -> List[BaseEmail]:
+    """Un email de ejemplo por cada plantilla."""
+    company = sample_company()
+    user = EmailAddress("usuario@example.com", "Usuario")
+    return [
+        WelcomeEmail(company, user, "https://miempresa.com/dashboard"),
+        PasswordResetEmail(company, user, "https://miempresa.com/reset"),
+        NotificationEmail(
+            company,
+            user,
+            Notification("Nueva actualización", "Hay novedades en tu cuenta", "info"),
+            "https://miempresa.com/preferencias"
+        ),
+        AlertEmail(company, user, Alert("Alerta de seguridad", "Nuevo inicio de sesión", "warning"))
+    ]
+
+
+def sample_recipients(count: int) -> List[dict]:
+    return [
+        {"email": f"usuario{i}@example.com", "name": f"Usuario {i}"}
+        for i in range(count)
+    ]
@@ -0,0 +1,197 @@
+"""
+Throughput del transporte SMTP contra un servidor local que descarta los
+mensajes, con una latencia de red simulada por cada paquete del cliente:
+
+    python -m benchmarks.smtp --messages 2000 --latency 0.005 --pool-size 4
+
+Compara una sesión nueva por mensaje, el pool de sesiones y el pool con
+PIPELINING. El servidor no usa TLS, así que el coste real de abrir una
+sesión (STARTTLS) es aún mayor que el medido.
+"""
+import argparse
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List
+
+from models import EmailAddress
+from service import EmailService
+from transports import SMTPTransport
+from benchmarks.samples import sample_emails, sample_recipients
+
+
+class _SinkProtocol(asyncio.Protocol):
+    """Sesión SMTP mínima al estilo de aiosmtpd: acepta todo y descarta los mensajes."""
+
+    def __init__(self, server: "SinkServer"):
+        self.server = server
+        self.buffer = b""
+        self.in_data = False
+        self.recipients = 0
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.sessions += 1
+        self._later(lambda: transport.write(b"220 benchmark ESMTP\r\n"))
+
+    def data_received(self, data: bytes):
+        self._later(lambda: self._process(data))
+
+    def _later(self, callback):
+        # Cada paquete del cliente llega con la latencia de red simulada
+        if self.server.latency:
+            asyncio.get_running_loop().call_later(self.server.latency, callback)
+        else:
+            callback()
+
+    def _process(self, data: bytes):
+        if self.transport.is_closing():
+            return
+        self.buffer += data
+        replies = []
+        commands = []
+        closing = False
+        while True:
+            if self.in_data:
+                end = (b"\r\n" + self.buffer).find(b"\r\n.\r\n")
+                if end < 0:
+                    break
+                self.buffer = self.buffer[end + 3:]
+                self.in_data = False
+                self.server.messages += 1
+                replies.append(b"250 OK")
+                continue
+            line, separator, rest = self.buffer.partition(b"\r\n")
+            if not separator:
+                break
+            self.buffer = rest
+            verb = line[:4].upper()
+            commands.append(verb.decode("ascii", "replace"))
+            if verb == b"QUIT":
+                replies.append(b"221 Bye")
+                closing = True
+                break
+            replies.append(self._reply(verb, line))
+        if commands:
+            self.server.packets.append(commands)
+        if replies:
+            self.transport.write(b"".join(reply + b"\r\n" for reply in replies))
+        if closing:
+            self.transport.close()
+
+    def _reply(self, verb: bytes, line: bytes) -> bytes:
+        if verb == b"EHLO":
+            extensions = [b"250-benchmark", b"250-8BITMIME", b"250-AUTH PLAIN"]
+            if self.server.pipelining:
+                extensions.insert(1, b"250-PIPELINING")
+            return b"\r\n".join(extensions) + b"\r\n250 SIZE 52428800"
+        if verb == b"AUTH":
+            return b"235 Authentication succeeded"
+        if verb == b"DATA":
+            if not self.recipients:
+                return b"503 No valid recipients"
+            self.in_data = True
+            return b"354 End data with <CR><LF>.<CR><LF>"
+        if verb in (b"MAIL", b"RSET"):
+            self.recipients = 0
+        elif verb == b"RCPT":
+            address = line.partition(b"<")[2].partition(b">")[0].decode("utf-8")
+            if address in self.server.refused:
+                return b"550 No such user"
+            self.recipients += 1
+        if verb in (b"HELO", b"MAIL", b"RCPT", b"RSET", b"NOOP"):
+            return b"250 OK"
+        return b"502 Command not implemented"
+
+
+class SinkServer:
+    """
+    Servidor SMTP de prueba en un hilo con su propio event loop. Rechaza los
+    destinatarios de `refused` y guarda en `packets` las órdenes recibidas
+    en cada paquete del cliente.
+    """
+
+    def __init__(self, latency: float = 0.0, pipelining: bool = True, refused: Iterable[str] = ()):
+        self.latency = latency
+        self.pipelining = pipelining
+        self.refused = set(refused)
+        self.port = None
+        self.sessions = 0
+        self.messages = 0
+        self.packets: List[List[str]] = []
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    def __enter__(self) -> "SinkServer":
+        self._thread.start()
+        server = asyncio.run_coroutine_threadsafe(
+            self._loop.create_server(lambda: _SinkProtocol(self), "127.0.0.1", 0),
+            self._loop
+        ).result()
+        self._server = server
+        self.port = server.sockets[0].getsockname()[1]
+        return self
+
+    def __exit__(self, *exc):
+        self._loop.call_soon_threadsafe(self._server.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+def run(messages: list, latency: float, pool_size: int, pooled: bool, pipelining: bool) -> tuple:
+    """Retorna mensajes por segundo y sesiones abiertas."""
+    with SinkServer(latency, pipelining) as server:
+        transport = SMTPTransport(
+            "127.0.0.1",
+            server.port,
+            username="benchmark",
+            password="benchmark",
+            starttls=False,
+            pool_size=pool_size,
+            max_messages=1000 if pooled else 1,
+            pipelining=pipelining
+        )
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(pool_size) as executor:
+                list(executor.map(transport.send, messages))
+            elapsed = time.perf_counter() - start
+        finally:
+            transport.close()
+        return len(messages) / elapsed, server.sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput del pool de sesiones SMTP")
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.002, help="Segundos por ida y vuelta")
+    parser.add_argument("--pool-size", type=int, default=4)
+    args = parser.parse_args()
+
+    service = EmailService(
+        api_key="benchmark",
+        default_from=EmailAddress("no-reply@example.com"),
+        testing=True
+    )
+    try:
+        messages = service.send_batch(sample_emails()[0], sample_recipients(args.messages), "Benchmark")
+    finally:
+        service.close()
+
+    scenarios = [
+        ("Sesión por mensaje", False, False),
+        ("Pool", True, False),
+        ("Pool + PIPELINING", True, True)
+    ]
+    baseline = None
+    print(f"{'Modo':<22}{'Mensajes/s':>12}{'Sesiones':>10}{'Mejora':>9}")
+    for label, pooled, pipelining in scenarios:
+        throughput, sessions = run(messages, args.latency, args.pool_size, pooled, pipelining)
+        baseline = baseline or throughput
+        print(f"{label:<22}{throughput:>12.0f}{sessions:>10}{throughput / baseline:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
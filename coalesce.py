@@ -0,0 +1,190 @@
+import asyncio
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Set
+
+from emails.templates import NotificationDigestEmail, NotificationEmail
+from models import Company, EmailAddress, Notification
+from outbox import Outbox
+from rendering import context_hash
+from service import EmailService
+from suppression import normalize_email
+
+# Notificaciones por digest; al llegar a este número se envía sin esperar al fin de la ventana
+MAX_DIGEST_SIZE = 20
+
+
+@dataclass
+class _Pending:
+    """Notificaciones de un destinatario que esperan a que se cierre su ventana."""
+    company: Company
+    user: EmailAddress
+    preferences_url: Optional[str]
+    notifications: List[Notification] = field(default_factory=list)
+    # Ids de las notificaciones guardadas en el outbox
+    held: List[int] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+def _company_from_dict(data: dict) -> Company:
+    data = dict(data)
+    if isinstance(data.get("support_email"), dict):
+        data["support_email"] = EmailAddress(**data["support_email"])
+    return Company(**data)
+
+
+class NotificationCoalescer:
+    """
+    Agrupa las notificaciones que llegan en ráfaga para un mismo destinatario.
+
+    La primera notificación de una dirección abre una ventana de `window`
+    segundos; las que llegan durante la ventana se acumulan y, al cerrarse,
+    se envían en un único email: NotificationEmail si solo hubo una y
+    NotificationDigestEmail si hubo varias. La ventana no se alarga con cada
+    notificación, así que ninguna espera más de `window` segundos. Las
+    direcciones se comparan normalizadas y solo se agrupan notificaciones de
+    la misma empresa (todos sus datos, no solo el nombre) con la misma URL
+    de preferencias.
+
+    Con `outbox`, cada notificación se guarda en SQLite antes de que `add`
+    retorne y se borra tras enviarla; `restore` recupera al arrancar las
+    que quedaron pendientes por una caída, con lo que les quedaba de
+    ventana. Sin outbox, las pendientes solo están en memoria.
+
+    Debe usarse desde el event loop; `aclose` envía lo pendiente sin esperar.
+    """
+
+    def __init__(
+        self,
+        service: EmailService,
+        window: float,
+        max_size: int = MAX_DIGEST_SIZE,
+        outbox: Optional[Outbox] = None
+    ):
+        self.service = service
+        self.window = window
+        self.max_size = max_size
+        self.outbox = outbox
+        self._pending: Dict[str, _Pending] = {}
+        self._sending: Set[asyncio.Task] = set()
+        self.received = 0
+        self.emails = 0
+        self.digests = 0
+        self.errors = 0
+
+    @staticmethod
+    def key(company: Company, user: EmailAddress, preferences_url: Optional[str]) -> str:
+        """Clave del digest: la dirección normalizada, los datos de la empresa y la URL de preferencias."""
+        return context_hash({
+            "email": normalize_email(user.email),
+            "company": asdict(company),
+            "preferences_url": preferences_url
+        })
+
+    async def add(
+        self,
+        company: Company,
+        user: EmailAddress,
+        notification: Notification,
+        preferences_url: Optional[str]
+    ) -> int:
+        """Encola una notificación. Retorna cuántas lleva ya el email de ese destinatario."""
+        key = self.key(company, user, preferences_url)
+        held = None
+        if self.outbox is not None:
+            held = await asyncio.to_thread(self.outbox.hold_notification, key, {
+                "company": asdict(company),
+                "user": asdict(user),
+                "notification": asdict(notification),
+                "preferences_url": preferences_url
+            })
+        self.received += 1
+        return self._add(key, company, user, notification, preferences_url, held, self.window)
+
+    async def restore(self) -> int:
+        """Vuelve a encolar las notificaciones guardadas en el outbox. Retorna cuántas había."""
+        if self.outbox is None:
+            return 0
+        held = await asyncio.to_thread(self.outbox.held_notifications)
+        for id_, key, payload, created_at in held:
+            self._add(
+                key,
+                _company_from_dict(payload["company"]),
+                EmailAddress(**payload["user"]),
+                Notification(**payload["notification"]),
+                payload["preferences_url"],
+                id_,
+                max(0.0, created_at + self.window - time.time())
+            )
+        return len(held)
+
+    def _add(
+        self,
+        key: str,
+        company: Company,
+        user: EmailAddress,
+        notification: Notification,
+        preferences_url: Optional[str],
+        held: Optional[int],
+        delay: float
+    ) -> int:
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = _Pending(company, user, preferences_url)
+            pending.timer = asyncio.get_running_loop().call_later(delay, self._flush, key)
+        pending.notifications.append(notification)
+        if held is not None:
+            pending.held.append(held)
+
+        count = len(pending.notifications)
+        if count >= self.max_size:
+            self._flush(key)
+        return count
+
+    def _flush(self, key: str) -> None:
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        pending.timer.cancel()
+        task = asyncio.create_task(self._send(pending))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, pending: _Pending) -> None:
+        notifications = pending.notifications
+        if len(notifications) == 1:
+            email = NotificationEmail(pending.company, pending.user, notifications[0], pending.preferences_url)
+            subject = notifications[0].title
+        else:
+            email = NotificationDigestEmail(pending.company, pending.user, notifications, pending.preferences_url)
+            subject = f"Tienes {len(notifications)} notificaciones nuevas"
+            self.digests += 1
+        try:
+            await self.service.send_async(email=email, to=[pending.user], subject=subject)
+            self.emails += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"Error enviando {len(notifications)} notificaciones a {pending.user.email}: {str(e)}")
+
+        # Como en los lotes, un envío fallido tras los reintentos no se repite
+        if pending.held:
+            try:
+                await asyncio.to_thread(self.outbox.release_notifications, pending.held)
+            except Exception as e:
+                print(f"Error liberando {len(pending.held)} notificaciones del outbox: {str(e)}")
+
+    async def aclose(self) -> None:
+        """Envía todas las notificaciones pendientes y espera a que terminen los envíos."""
+        for key in list(self._pending):
+            self._flush(key)
+        await asyncio.gather(*self._sending, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "window": self.window,
+            "received": self.received,
+            "pending": sum(len(pending.notifications) for pending in self._pending.values()),
+            "emails": self.emails,
+            "digests": self.digests,
+            "errors": self.errors
+        }
@@ -5,6 +5,8 @@ from models import Company
 class BaseEmail(ABC):
     """Clase base abstracta para todos los tipos de email."""
     template_name: str
+    # Carril del límite de envío cuando se envía suelto (ver rate_limit.RateLimiter)
+    priority: str = "default"
     
     def __init__(self, company: Company):
         self.company = company
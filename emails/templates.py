@@ -25,6 +25,7 @@ class WelcomeEmail(BaseEmail):
 class PasswordResetEmail(BaseEmail):
     """Email para restablecimiento de contraseña."""
     template_name = "password_reset.html"
+    priority = "transactional"
     
     def __init__(
         self,
@@ -86,6 +87,45 @@ class NotificationEmail(BaseEmail):
         })
         return data
 
+class NotificationDigestEmail(BaseEmail):
+    """Varias notificaciones del mismo usuario reunidas en un solo email (ver coalesce.py)."""
+    template_name = "notification_digest.html"
+
+    def __init__(
+        self,
+        company: Company,
+        user: EmailAddress,
+        notifications: List[Notification],
+        preferences_url: str
+    ):
+        super().__init__(company)
+        self.user = user
+        self.notifications = notifications
+        self.preferences_url = preferences_url
+
+    def get_template_data(self) -> dict:
+        data = super().get_template_data()
+        data.update({
+            "user": {
+                "name": self.user.name,
+                "email": self.user.email
+            },
+            "notifications": [
+                {
+                    "title": notification.title,
+                    "message": notification.message,
+                    "type": notification.type,
+                    "icon": notification.icon,
+                    "action_url": notification.action_url,
+                    "action_text": notification.action_text,
+                    "additional_info": notification.additional_info
+                }
+                for notification in self.notifications
+            ],
+            "preferences_url": self.preferences_url
+        })
+        return data
+
 class AlertEmail(BaseEmail):
     """Email para alertas y advertencias."""
     template_name = "alert.html"
@@ -100,6 +140,11 @@ class AlertEmail(BaseEmail):
         self.user = user
         self.alert = alert
     
+    @property
+    def priority(self) -> str:
+        """Las alertas de error (p. ej. de seguridad) no esperan tras los envíos masivos."""
+        return "transactional" if self.alert.type == "error" else "default"
+    
     def get_template_data(self) -> dict:
         data = super().get_template_data()
         data.update({
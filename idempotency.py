@@ -0,0 +1,302 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from cachetools import TTLCache
+
+# Longitud máxima aceptada para la cabecera Idempotency-Key
+MAX_KEY_LENGTH = 255
+
+# Cuerpos que se leen en streaming (ver ingest.py): no se guardan para calcular su hash
+STREAMING_TYPES = (b"application/x-ndjson", b"text/csv")
+
+# Cada cuántas respuestas guardadas se borran de SQLite las caducadas
+_PURGE_EVERY = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_expiry ON responses (expires_at);
+"""
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    """Respuesta de una petición idempotente, con el hash del cuerpo que la produjo."""
+    fingerprint: str
+    status: int
+    headers: List[Tuple[bytes, bytes]]
+    body: bytes
+
+
+class IdempotencyStore:
+    """
+    Respuestas ya enviadas por clave de idempotencia, en una caché acotada
+    por tamaño (LRU) y antigüedad (TTL). Con `path` las respuestas también se
+    guardan en SQLite y sobreviven a reinicios del servidor.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 86400, path: Optional[str] = None):
+        self.ttl = ttl
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        # SQLite tiene su propio lock: una escritura en otro hilo no bloquea la caché
+        self._db_lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+            self._purge()
+
+    def peek(self, key: str) -> Optional[StoredResponse]:
+        """Respuesta en memoria, sin consultar SQLite ni contar en las estadísticas."""
+        with self._lock:
+            return self._cache.get(key)
+
+    def get(self, key: str) -> Optional[StoredResponse]:
+        response = self.peek(key)
+        if response is None and self._conn is not None:
+            response = self._load(key)
+        return self._count(response)
+
+    async def get_async(self, key: str) -> Optional[StoredResponse]:
+        """Como get, con la consulta a SQLite en otro hilo para no bloquear el event loop."""
+        response = self.peek(key)
+        if response is None and self._conn is not None:
+            response = await asyncio.to_thread(self._load, key)
+        return self._count(response)
+
+    def _count(self, response: Optional[StoredResponse]) -> Optional[StoredResponse]:
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def recount_miss(self, counter: Optional[str] = None) -> None:
+        """
+        Descuenta una consulta contada como fallo y, si se indica, la cuenta
+        en `counter` ("hits" o "coalesced"): cada petición cuenta una sola vez.
+        """
+        with self._lock:
+            self.misses -= 1
+            if counter is not None:
+                setattr(self, counter, getattr(self, counter) + 1)
+
+    def _load(self, key: str) -> Optional[StoredResponse]:
+        with self._db_lock:
+            if self._conn is None:
+                return None
+            row = self._conn.execute(
+                "SELECT fingerprint, status, headers, body FROM responses WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        response = StoredResponse(
+            row[0],
+            row[1],
+            [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(row[2])],
+            row[3]
+        )
+        with self._lock:
+            self._cache[key] = response
+        return response
+
+    def set(self, key: str, response: StoredResponse) -> None:
+        with self._lock:
+            self._cache[key] = response
+        if self._conn is not None:
+            self._persist(key, response)
+
+    async def set_async(self, key: str, response: StoredResponse) -> None:
+        """Como set: la respuesta queda en memoria al momento y se guarda en SQLite en otro hilo."""
+        with self._lock:
+            self._cache[key] = response
+        if self._conn is not None:
+            await asyncio.to_thread(self._persist, key, response)
+
+    def _persist(self, key: str, response: StoredResponse) -> None:
+        with self._db_lock:
+            if self._conn is None:
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    response.fingerprint,
+                    response.status,
+                    json.dumps([(name.decode("latin-1"), value.decode("latin-1")) for name, value in response.headers]),
+                    response.body,
+                    time.time() + self.ttl
+                )
+            )
+            self._writes += 1
+            if self._writes % _PURGE_EVERY == 0:
+                self._purge()
+
+    def _purge(self) -> None:
+        self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._cache),
+                "maxsize": self._cache.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced
+            }
+
+
+def _json_response(status: int, detail: str) -> StoredResponse:
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    return StoredResponse("", status, [(b"content-type", b"application/json")], body)
+
+
+class IdempotencyMiddleware:
+    """
+    Middleware ASGI que hace idempotentes las peticiones POST con cabecera
+    Idempotency-Key, usando el IdempotencyStore de `app.state.idempotency`.
+
+    La primera petición con una clave se ejecuta y, si termina con un 2xx,
+    su respuesta se guarda; las repeticiones reciben la respuesta guardada
+    (con la cabecera Idempotent-Replayed) sin volver a renderizar ni enviar.
+    Las repeticiones que llegan mientras la primera sigue en curso esperan
+    su resultado y, si no termina con un 2xx, se ejecutan. Reutilizar una
+    clave con otro cuerpo responde 422, salvo en las subidas NDJSON o CSV,
+    que no se leen de antemano y solo se comparan por clave. La clave se
+    asocia a la API key y a la ruta de la petición.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        idempotency_key = headers.get(b"idempotency-key")
+        store = getattr(scope["app"].state, "idempotency", None)
+        if idempotency_key is None or store is None:
+            return await self.app(scope, receive, send)
+
+        idempotency_key = idempotency_key.strip()
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            return await self._respond(send, _json_response(
+                400, f"Idempotency-Key debe tener entre 1 y {MAX_KEY_LENGTH} caracteres"
+            ))
+
+        key = hashlib.sha256(b"\0".join(
+            (headers.get(b"x-api-key", b""), scope["path"].encode("utf-8"), idempotency_key)
+        )).hexdigest()
+        media_type = headers.get(b"content-type", b"").split(b";", 1)[0].strip().lower()
+        if media_type in STREAMING_TYPES:
+            body = None
+            fingerprint = ""
+        else:
+            body = await self._read_body(receive)
+            fingerprint = hashlib.sha256(body).hexdigest()
+
+        while True:
+            response = await store.get_async(key)
+            if response is None:
+                pending = self._inflight.get(key)
+                if pending is None:
+                    # La petición original pudo terminar mientras se consultaba SQLite;
+                    # su respuesta se guarda en memoria antes de dejar de estar en curso
+                    response = store.peek(key)
+                    if response is None:
+                        break
+                    store.recount_miss("hits")
+                else:
+                    response = await asyncio.shield(pending)
+                    if response is None:
+                        # La petición original falló o no terminó con 2xx: se ejecuta
+                        # esta (la siguiente consulta vuelve a contar)
+                        store.recount_miss()
+                        continue
+                    store.recount_miss("coalesced")
+            if response.fingerprint != fingerprint:
+                return await self._respond(send, _json_response(
+                    422, "Idempotency-Key ya usada con una petición distinta"
+                ))
+            return await self._respond(send, response, replayed=True)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        start = {}
+        chunks = []
+
+        async def replay_receive():
+            nonlocal body
+            if body is not None:
+                message = {"type": "http.request", "body": body, "more_body": False}
+                body = None
+                return message
+            return await receive()
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        # Solo las respuestas 2xx se guardan y se comparten con las repeticiones en espera
+        stored = None
+        try:
+            await self.app(scope, replay_receive, capture_send)
+            if start and 200 <= start["status"] < 300:
+                stored = StoredResponse(fingerprint, start["status"], list(start.get("headers", [])), b"".join(chunks))
+                await store.set_async(key, stored)
+        finally:
+            del self._inflight[key]
+            future.set_result(stored)
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    @staticmethod
+    async def _respond(send, response: StoredResponse, replayed: bool = False) -> None:
+        headers = list(response.headers)
+        if replayed:
+            headers.append((b"idempotent-replayed", b"true"))
+        if not any(name.lower() == b"content-length" for name, _ in headers):
+            headers.append((b"content-length", str(len(response.body)).encode("ascii")))
+        await send({"type": "http.response.start", "status": response.status, "headers": headers})
+        await send({"type": "http.response.body", "body": response.body})
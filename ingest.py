@@ -0,0 +1,137 @@
+import codecs
+import csv
+import json
+from itertools import chain
+from typing import AsyncIterator, Iterator, List, Optional
+
+# Tipos de contenido aceptados al subir destinatarios (ver /api/emails/batch/stream)
+UPLOAD_FORMATS = ("application/x-ndjson", "text/csv")
+
+# Longitud máxima de una línea; evita acumular en memoria un cuerpo sin saltos de línea
+MAX_LINE_LENGTH = 65536
+
+
+class UploadError(ValueError):
+    """El cuerpo subido no tiene el formato esperado."""
+
+
+def _object(line: str) -> Optional[dict]:
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+class RecipientUpload:
+    """
+    Destinatarios de un cuerpo NDJSON o CSV, leídos a medida que llegan los
+    fragmentos de la petición, sin guardar el cuerpo entero en memoria.
+
+    En NDJSON cada línea es un objeto con `email` y, opcionalmente, `name`.
+    En CSV la primera fila nombra las columnas y debe incluir `email` (y
+    puede incluir `name`); los campos entre comillas no pueden contener
+    saltos de línea. En ambos formatos la primera línea puede ser un objeto
+    JSON sin `email` con los datos del lote (email_type, company, query,
+    alert), que queda en `request`. Las líneas sin una dirección válida se
+    cuentan en `invalid` y se ignoran.
+    """
+
+    def __init__(self, chunks: AsyncIterator[bytes], media_type: str):
+        if media_type not in UPLOAD_FORMATS:
+            raise UploadError(f"Formato no soportado: {media_type}")
+        self.request: Optional[dict] = None
+        self.received = 0
+        self.invalid = 0
+        self._chunks = chunks
+        self._csv = media_type == "text/csv"
+        self._state = "preamble"
+        self._email_column = 0
+        self._name_column = None
+
+    async def batches(self, size: int) -> AsyncIterator[List[dict]]:
+        """Destinatarios en listas de hasta `size`, a medida que se reciben."""
+        batch = []
+        async for lines in self._lines():
+            for recipient in self._parse(lines):
+                batch.append(recipient)
+                if len(batch) >= size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    async def _lines(self) -> AsyncIterator[List[str]]:
+        """Líneas completas de cada fragmento recibido; la última incompleta espera al siguiente."""
+        decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        pending = ""
+        try:
+            async for chunk in self._chunks:
+                lines = (pending + decoder.decode(chunk)).split("\n")
+                pending = lines.pop()
+                if len(pending) > MAX_LINE_LENGTH:
+                    raise UploadError(f"Línea de más de {MAX_LINE_LENGTH} caracteres")
+                if lines:
+                    yield lines
+            pending += decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            raise UploadError("El cuerpo no está codificado en UTF-8")
+        if pending:
+            yield [pending]
+
+    def _parse(self, lines: List[str]) -> Iterator[dict]:
+        rows = iter(lines)
+        for line in rows:
+            if self._state == "rows" or not self._header(line.rstrip("\r")):
+                rows = chain((line,), rows)
+                break
+        else:
+            return
+
+        if self._csv:
+            for row in csv.reader(line.rstrip("\r") for line in rows):
+                if not row:
+                    continue
+                email = row[self._email_column] if len(row) > self._email_column else None
+                name = None
+                if self._name_column is not None and len(row) > self._name_column:
+                    name = row[self._name_column]
+                recipient = self._recipient(email, name)
+                if recipient is not None:
+                    yield recipient
+        else:
+            for line in rows:
+                if not line.strip():
+                    continue
+                data = _object(line) or {}
+                recipient = self._recipient(data.get("email"), data.get("name"))
+                if recipient is not None:
+                    yield recipient
+
+    def _header(self, line: str) -> bool:
+        """Procesa el preámbulo y la fila de columnas. Retorna si la línea se consumió."""
+        if not line.strip():
+            return True
+        if self._state == "preamble":
+            self._state = "columns" if self._csv else "rows"
+            if line.lstrip().startswith("{"):
+                data = _object(line)
+                if data is not None and "email" not in data:
+                    self.request = data
+                    return True
+        if self._state == "columns":
+            columns = [column.strip().lower() for column in next(csv.reader([line]))]
+            if "email" not in columns:
+                raise UploadError("El CSV debe tener una columna email")
+            self._email_column = columns.index("email")
+            self._name_column = columns.index("name") if "name" in columns else None
+            self._state = "rows"
+            return True
+        return False
+
+    def _recipient(self, email, name) -> Optional[dict]:
+        if not isinstance(email, str) or "@" not in email:
+            self.invalid += 1
+            return None
+        self.received += 1
+        return {"email": email.strip(), "name": name if isinstance(name, str) and name else None}
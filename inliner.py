@@ -0,0 +1,226 @@
+import itertools
+import re
+import threading
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+import cssutils
+from cachetools import LRUCache
+from cssselect import parse as parse_selector
+from lxml import etree
+from lxml.cssselect import CSSSelector
+from premailer import Premailer
+from premailer.merge_style import csstext_to_pairs, merge_styles
+from premailer.premailer import FILTER_PSEUDOSELECTORS, get_or_create_head
+
+# Espacios que XPath reconoce en normalize-space() al comparar clases
+_CLASS_SEPARATOR = re.compile(r"[ \t\r\n]+")
+
+# Identificador único de cada regla compilada (clave de la caché de fusión)
+_rule_ids = itertools.count()
+
+
+class _Rule:
+    """Regla CSS lista para aplicar: selector compilado y declaraciones ya separadas."""
+
+    __slots__ = ("id", "source", "selector", "pseudo", "pairs", "tag", "classes")
+
+    def __init__(self, selector: str, bulk: str):
+        self.source = selector
+        pseudo = ""
+        if ":" in selector:
+            base, pseudo = re.split(":", selector, 1)
+            pseudo = ":%s" % pseudo
+        # Los selectores de filtro (:first-child, ...) se evalúan tal cual
+        if pseudo in FILTER_PSEUDOSELECTORS or pseudo.startswith(":nth-child"):
+            pseudo = ""
+        else:
+            selector = base if pseudo else selector
+
+        self.id = next(_rule_ids)
+        self.selector = CSSSelector(selector)
+        self.pseudo = pseudo
+        self.pairs = csstext_to_pairs(bulk)
+        self.tag, self.classes = _required_keys(selector)
+
+
+def _required_keys(selector: str) -> Tuple[Optional[str], frozenset]:
+    """
+    Etiqueta y clases que debe tener un elemento para que el selector pueda
+    coincidir con él (según la parte más a la derecha del selector).
+    """
+    node = parse_selector(selector)[0].parsed_tree
+    while type(node).__name__ == "CombinedSelector":
+        node = node.subselector
+
+    tag = None
+    classes = set()
+    while node is not None:
+        kind = type(node).__name__
+        if kind == "Class":
+            classes.add(node.class_name)
+        elif kind == "Element":
+            if node.element and node.element != "*":
+                tag = node.element
+            break
+        node = getattr(node, "selector", None)
+    return tag, frozenset(classes)
+
+
+def _document_keys(page: etree._Element) -> Tuple[set, set]:
+    """Etiquetas y clases presentes en el documento."""
+    tags = set()
+    classes = set()
+    for element in page.iter():
+        tags.add(element.tag)
+        value = element.get("class") if isinstance(element.tag, str) else None
+        if value:
+            classes.update(_CLASS_SEPARATOR.split(value))
+    return tags, classes
+
+
+def _may_match(rule: _Rule, tags: set, classes: set) -> bool:
+    if rule.tag is not None and rule.tag not in tags:
+        return False
+    return rule.classes <= classes
+
+
+class StyleInliner:
+    """
+    Inliner de CSS sobre lxml equivalente a
+    Premailer(keep_style_tags=True, remove_classes=False, strip_important=False).
+
+    Cada hoja de estilos se parsea una sola vez: sus reglas quedan compiladas
+    y ordenadas por especificidad, indexadas por la etiqueta y las clases que
+    requieren para descartar sin evaluarlas las que no pueden coincidir con
+    el documento. La fusión de estilos y los atributos HTML derivados se
+    memorizan por combinación de entrada, de modo que cada elemento se
+    resuelve con un único paso sobre el árbol.
+    """
+
+    def __init__(self, cache_size: int = 4096):
+        self._premailer = Premailer(keep_style_tags=True, remove_classes=False, strip_important=False)
+        self._sheets = LRUCache(maxsize=64)
+        self._merged = LRUCache(maxsize=cache_size)
+        self._floats = LRUCache(maxsize=cache_size)
+        self._lock = threading.Lock()
+
+    def _rules(self, css_bodies: Tuple[str, ...]) -> List[_Rule]:
+        with self._lock:
+            rules = self._sheets.get(css_bodies)
+        if rules is None:
+            parsed = []
+            for index, css_body in enumerate(css_bodies):
+                these_rules, _ = self._premailer._parse_style_rules(css_body, index)
+                parsed.extend(these_rules)
+            parsed.sort(key=lambda rule: rule[0])
+            rules = [_Rule(selector, bulk) for _, selector, bulk in parsed]
+            with self._lock:
+                self._sheets[css_bodies] = rules
+        return rules
+
+    def _merge(self, inline_style: str, rules: Tuple[_Rule, ...]) -> Tuple[str, List[Tuple[str, str]]]:
+        """Estilo final del elemento y atributos HTML básicos que se derivan de él."""
+        key = (inline_style, tuple(rule.id for rule in rules))
+        with self._lock:
+            merged = self._merged.get(key)
+        if merged is None:
+            final_style = merge_styles(
+                inline_style,
+                [rule.pairs for rule in rules],
+                [rule.pseudo for rule in rules],
+                remove_unset_properties=True
+            )
+            attributes = _BasicAttributes()
+            self._premailer._style_to_basic_html_attributes(attributes, final_style, force=True)
+            merged = (final_style, list(attributes.attrib.items()))
+            with self._lock:
+                self._merged[key] = merged
+        return merged
+
+    def _float(self, style: str) -> Optional[str]:
+        with self._lock:
+            if style in self._floats:
+                return self._floats[style]
+        value = cssutils.parseStyle(style).float
+        value = value if value in ("left", "right") else None
+        with self._lock:
+            self._floats[style] = value
+        return value
+
+    def inline(self, html: str) -> str:
+        stripped = html.strip()
+        tree = etree.fromstring(stripped, etree.HTMLParser()).getroottree()
+        page = tree.getroot()
+        # lxml añade un doctype si no existe; solo se conserva si venía en el HTML
+        root = tree if stripped.startswith(tree.docinfo.doctype) else page
+
+        get_or_create_head(tree)
+
+        css_bodies = []
+        for element in page.iter("style", "link"):
+            if element.tag == "link":
+                if "stylesheet" in element.get("rel", "").split():
+                    # Hojas externas: se delega en Premailer, que sabe descargarlas
+                    return self._premailer.transform(html)
+                continue
+            media = element.get("media")
+            if media and media not in ("all", "screen"):
+                continue
+            data_attribute = element.get(Premailer.attribute_name)
+            if data_attribute == "ignore":
+                del element.attrib[Premailer.attribute_name]
+                continue
+            elif data_attribute:
+                return self._premailer.transform(html)
+            css_bodies.append(element.text)
+
+        # Etiquetas y clases presentes para descartar reglas imposibles
+        tags, classes = _document_keys(page)
+
+        matched: Dict[int, Tuple[etree._Element, List[_Rule]]] = {}
+        for rule in self._rules(tuple(css_bodies)):
+            if not _may_match(rule, tags, classes):
+                continue
+            for item in rule.selector(page):
+                entry = matched.get(id(item))
+                if entry is None:
+                    matched[id(item)] = (item, [rule])
+                else:
+                    entry[1].append(rule)
+
+        for item, rules in matched.values():
+            final_style, attributes = self._merge(item.get("style", ""), tuple(rules))
+            if final_style:
+                item.set("style", final_style)
+            for key, value in attributes:
+                item.set(key, value)
+
+        for item in page.xpath("//img[@style]"):
+            value = self._float(item.get("style"))
+            if value:
+                item.set("align", value)
+
+        return etree.tostring(root, method="html", pretty_print=True, encoding="utf-8").decode("utf-8")
+
+    def unmatched_selectors(self, page: etree._Element, css_body: str) -> FrozenSet[str]:
+        """
+        Selectores de la hoja que se aplican como estilos inline y que no
+        coinciden con ningún elemento del documento.
+        """
+        tags, classes = _document_keys(page)
+        candidates = set()
+        matched = set()
+        for rule in self._rules((css_body,)):
+            candidates.add(rule.source)
+            if rule.source in matched or not _may_match(rule, tags, classes):
+                continue
+            if rule.selector(page):
+                matched.add(rule.source)
+        return frozenset(candidates - matched)
+
+
+class _BasicAttributes:
+    """Elemento mínimo sobre el que Premailer escribe los atributos derivados del estilo."""
+
+    def __init__(self):
+        self.attrib = {}
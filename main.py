@@ -11,12 +11,14 @@ from PyQt5.QtWidgets import (
     QPushButton, QLabel, QLineEdit, QTextEdit, QComboBox, QSpinBox,
     QTabWidget, QFormLayout, QMessageBox, QGroupBox, QSplitter, QDialog, 
     QCheckBox, QTextBrowser, QFileDialog, QListWidget, QListWidgetItem,
-    QStackedWidget, QToolBar, QAction, QSizePolicy, QScrollArea, QFrame
+    QStackedWidget, QToolBar, QAction, QSizePolicy, QScrollArea, QFrame,
+    QProgressBar
 )
 from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QThread, QSize, QUrl
 from PyQt5.QtGui import QIcon, QPixmap, QFont, QColor, QPalette
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 from emails.validation import validate_email, validate_emails
+from template_watcher import TemplateWatcher
 
 class RenderPreviewWorker(QThread):
     """Worker thread para renderizar la vista previa sin bloquear la UI"""
@@ -41,6 +43,67 @@ class RenderPreviewWorker(QThread):
         except Exception as e:
             self.error_occurred.emit(f"Error al renderizar vista previa: {str(e)}")
 
+class JobProgressWorker(QThread):
+    """Worker thread que sigue un envío en lote con los eventos (SSE) de la API"""
+    progress_changed = pyqtSignal(dict)
+    recipient_failed = pyqtSignal(dict)
+    job_finished = pyqtSignal(dict)
+    error_occurred = pyqtSignal(str)
+    
+    def __init__(self, url, api_key):
+        super().__init__()
+        self.url = url
+        self.api_key = api_key
+        self.response = None
+        self.stopped = False
+        
+    def stop(self):
+        self.stopped = True
+        if self.response is not None:
+            # Cerrar la conexión desbloquea la lectura del stream
+            self.response.close()
+        
+    def dispatch(self, event, data):
+        payload = json.loads(data)
+        if event == "progress":
+            self.progress_changed.emit(payload)
+        elif event == "result" and payload.get("status") == "failed":
+            self.recipient_failed.emit(payload)
+        elif event == "done":
+            self.job_finished.emit(payload)
+        
+    def run(self):
+        try:
+            self.response = requests.get(
+                self.url,
+                headers={"X-API-Key": self.api_key, "Accept": "text/event-stream"},
+                stream=True,
+                timeout=(5, 60)
+            )
+            if self.response.status_code != 200:
+                self.error_occurred.emit(f"Error al seguir el envío (código {self.response.status_code})")
+                return
+            
+            event, data = "message", []
+            for line in self.response.iter_lines(decode_unicode=True):
+                if self.stopped:
+                    return
+                if not line:
+                    # Una línea vacía cierra el evento
+                    if data:
+                        self.dispatch(event, "\n".join(data))
+                    event, data = "message", []
+                elif line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data.append(line[5:].strip())
+        except Exception as e:
+            if not self.stopped:
+                self.error_occurred.emit(f"Error al seguir el envío: {str(e)}")
+        finally:
+            if self.response is not None:
+                self.response.close()
+
 
 class EmailPreviewDialog(QDialog):
     def __init__(self, html_content, parent=None):
@@ -217,6 +280,9 @@ class SidebarItem(QWidget):
 
 
 class ImprovedEmailTesterGUI(QMainWindow):
+    # Emitida desde el hilo del watcher cuando cambian las plantillas
+    templates_changed = pyqtSignal(object)
+    
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Sistema de Emails - Tester Mejorado")
@@ -227,7 +293,12 @@ class ImprovedEmailTesterGUI(QMainWindow):
         self.api_key = ""
         self.templates_dir_input = None
         self.template_env = None
+        self.template_watcher = None
+        self.job_progress_worker = None
+        # Seguimientos detenidos cuyo hilo aún no ha terminado
+        self.stopped_progress_workers = set()
         self.current_preview_timer = None
+        self.templates_changed.connect(self.on_templates_changed)
         self.html_preview = None
         
         # Widget central
@@ -849,6 +920,24 @@ class ImprovedEmailTesterGUI(QMainWindow):
         self.batch_params_layout = QVBoxLayout(self.batch_params_container)
         layout.addWidget(self.batch_params_container)
         
+        # Progreso del último envío (oculto hasta que se encola uno)
+        self.batch_progress_group = QGroupBox("Progreso del Envío")
+        progress_layout = QVBoxLayout(self.batch_progress_group)
+        
+        self.batch_progress_bar = QProgressBar()
+        progress_layout.addWidget(self.batch_progress_bar)
+        
+        self.batch_progress_label = QLabel()
+        progress_layout.addWidget(self.batch_progress_label)
+        
+        # Solo se listan los destinatarios fallidos
+        self.batch_failures_list = QListWidget()
+        self.batch_failures_list.setMaximumHeight(120)
+        progress_layout.addWidget(self.batch_failures_list)
+        
+        self.batch_progress_group.setVisible(False)
+        layout.addWidget(self.batch_progress_group)
+        
         # Actualizar los parámetros según el tipo seleccionado
         self.update_batch_form()
     
@@ -1435,12 +1524,20 @@ class ImprovedEmailTesterGUI(QMainWindow):
                 print("Advertencia: No se encontró un directorio de plantillas válido.")
         
         try:
+            # Las plantillas no se comprueban en cada renderizado: el watcher
+            # avisa cuando se guarda un fichero del directorio
             self.template_env = Environment(
                 loader=FileSystemLoader(templates_dir),
                 autoescape=select_autoescape(['html', 'xml']),
                 trim_blocks=True,
-                lstrip_blocks=True
+                lstrip_blocks=True,
+                auto_reload=False
             )
+            if self.template_watcher is not None:
+                self.template_watcher.stop()
+            self.template_watcher = TemplateWatcher(
+                str(templates_dir), self.templates_changed.emit
+            ).start()
             print(f"Motor de plantillas configurado con el directorio: {templates_dir}")
         except Exception as e:
             print(f"Error al configurar el motor de plantillas: {str(e)}")
@@ -1451,6 +1548,82 @@ class ImprovedEmailTesterGUI(QMainWindow):
                     f"No se pudo configurar el motor de plantillas: {str(e)}"
                 )
     
+    def on_templates_changed(self, names):
+        """Descarta las plantillas compiladas y refresca la vista previa"""
+        if self.template_env is not None:
+            self.template_env.cache.clear()
+        print(f"Plantillas modificadas: {', '.join(sorted(names))}")
+        self.schedule_preview_update()
+    
+    def stop_job_progress_worker(self):
+        """Detiene el seguimiento en curso sin que sus eventos lleguen ya a la interfaz"""
+        worker = self.job_progress_worker
+        if worker is None:
+            return
+        self.job_progress_worker = None
+        for signal in (worker.progress_changed, worker.recipient_failed, worker.job_finished, worker.error_occurred):
+            signal.disconnect()
+        worker.stop()
+        if not worker.wait(2000):
+            # Destruir un QThread en marcha aborta la aplicación: se conserva hasta que termine
+            self.stopped_progress_workers.add(worker)
+            worker.finished.connect(lambda: self.stopped_progress_workers.discard(worker))
+    
+    def follow_batch_job(self, job_id, total):
+        """Muestra en vivo el progreso de un envío en lote"""
+        self.stop_job_progress_worker()
+        
+        self.batch_progress_bar.setRange(0, max(total, 1))
+        self.batch_progress_bar.setValue(0)
+        self.batch_progress_label.setText(f"Trabajo {job_id}: en cola")
+        self.batch_failures_list.clear()
+        self.batch_progress_group.setVisible(True)
+        
+        worker = JobProgressWorker(
+            f"{self.api_url}/emails/jobs/{job_id}/events",
+            self.api_key_input.text()
+        )
+        
+        def current(slot):
+            # Un evento ya encolado de un seguimiento anterior no toca la barra de este trabajo
+            return lambda payload: slot(payload) if self.job_progress_worker is worker else None
+        
+        worker.progress_changed.connect(current(self.update_batch_progress))
+        worker.recipient_failed.connect(current(self.add_batch_failure))
+        worker.job_finished.connect(current(self.finish_batch_progress))
+        worker.error_occurred.connect(current(self.batch_progress_label.setText))
+        self.job_progress_worker = worker
+        worker.start()
+    
+    def update_batch_progress(self, job):
+        done = job["sent"] + job["failed"] + job.get("skipped", 0)
+        self.batch_progress_bar.setRange(0, max(job["total"], 1))
+        self.batch_progress_bar.setValue(done)
+        
+        text = f"{done}/{job['total']} procesados · {job['sent']} enviados · {job['failed']} fallidos"
+        if job.get("skipped"):
+            text += f" · {job['skipped']} omitidos"
+        if job.get("throughput"):
+            text += f" · {job['throughput']:.1f} emails/s"
+        if job.get("eta") and job["status"] != "done":
+            text += f" · quedan {job['eta']:.0f} s"
+        self.batch_progress_label.setText(text)
+    
+    def add_batch_failure(self, result):
+        self.batch_failures_list.addItem(f"{result.get('email')}: {result.get('error')}")
+    
+    def finish_batch_progress(self, job):
+        self.update_batch_progress(job)
+        self.batch_progress_label.setText("Completado: " + self.batch_progress_label.text())
+    
+    def closeEvent(self, event):
+        if self.template_watcher is not None:
+            self.template_watcher.stop()
+        self.stop_job_progress_worker()
+        for worker in list(self.stopped_progress_workers):
+            worker.wait(2000)
+        super().closeEvent(event)
+    
     def send_api_request(self, endpoint, data):
         """Envía una petición a la API de emails"""
         # Validar API key
@@ -1479,7 +1652,7 @@ class ImprovedEmailTesterGUI(QMainWindow):
             print(f"Código de respuesta: {response.status_code}")
             print(f"Respuesta: {response.text}")
             
-            if response.status_code == 200:
+            if response.status_code in (200, 202):
                 return response.json()
             else:
                 error_detail = "Error desconocido"
@@ -2035,12 +2208,17 @@ class ImprovedEmailTesterGUI(QMainWindow):
         result = self.send_api_request("batch", batch_data)
         
         if result:
-            QMessageBox.information(
-                self,
-                "Éxito",
-                f"Se enviaron {result.get('sent', 0)} emails correctamente.\n" +
-                (f"Fallaron {result.get('failed', 0)} envíos." if result.get('failed', 0) > 0 else "")
-            )
+            message = f"Se encolaron {result.get('total', 0)} emails para su envío.\n"
+            if result.get("duplicates") or result.get("suppressed"):
+                message += (
+                    f"Omitidos: {result.get('duplicates', 0)} repetidos, "
+                    f"{result.get('suppressed', 0)} en la lista de supresión.\n"
+                )
+            if result.get("job_id"):
+                message += f"Trabajo: {result['job_id']}"
+            QMessageBox.information(self, "Éxito", message)
+            if result.get("job_id"):
+                self.follow_batch_job(result["job_id"], result.get("total", 0))
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -0,0 +1,516 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from rate_limit import BULK, DEFAULT_LANE, TRANSACTIONAL
+from suppression import normalize_email
+
+# Mensajes que un worker toma de la cola de una vez (una llamada a la API de lotes)
+CLAIM_SIZE = 100
+
+# Hora de envío de los mensajes retenidos hasta cerrar el trabajo (ver append y seal)
+_HELD = float("inf")
+
+# Carriles en el orden en que los workers los atienden (ver claim)
+LANES = (TRANSACTIONAL, DEFAULT_LANE, BULK)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    request TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    skipped INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    send_at REAL,
+    lane TEXT NOT NULL DEFAULT 'bulk'
+);
+CREATE TABLE IF NOT EXISTS messages (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    email TEXT NOT NULL,
+    name TEXT,
+    status TEXT NOT NULL,
+    deliveries INTEGER NOT NULL DEFAULT 0,
+    lease_until REAL,
+    result TEXT,
+    done_seq INTEGER,
+    email_key TEXT,
+    due_at REAL NOT NULL DEFAULT 0,
+    lane TEXT NOT NULL DEFAULT 'bulk',
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS messages_pending ON messages (status, lease_until);
+CREATE TABLE IF NOT EXISTS notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    digest_key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class Outbox:
+    """
+    Cola persistente de envíos en SQLite (modo WAL).
+
+    Cada lote se guarda como un trabajo con un mensaje por destinatario. Los
+    workers toman bloques de mensajes pendientes con un plazo (lease); si el
+    proceso cae antes de registrar el resultado, el plazo vence y el bloque
+    vuelve a enviarse (entrega al menos una vez).
+
+    Cada mensaje tiene un carril (el de la prioridad del email, ver
+    rate_limit.py) y una hora de envío (`due_at`). Los workers atienden
+    primero el carril transaccional, luego el normal y por último el
+    masivo, y dentro de cada carril toman primero los mensajes que antes
+    vencen; el índice sobre (status, lane, due_at) hace de cola de
+    prioridad persistente, así que los envíos programados sobreviven a
+    reinicios sin otro planificador.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 300):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.executescript(_SCHEMA)
+            self._migrate()
+
+    def _migrate(self) -> None:
+        """Adapta las bases de datos creadas por versiones anteriores."""
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(messages)")}
+        if "done_seq" not in columns:
+            self._conn.execute("ALTER TABLE messages ADD COLUMN done_seq INTEGER")
+        if "email_key" not in columns:
+            self._conn.execute("ALTER TABLE messages ADD COLUMN email_key TEXT")
+        if "due_at" not in columns:
+            self._conn.execute("ALTER TABLE messages ADD COLUMN due_at REAL NOT NULL DEFAULT 0")
+        if "lane" not in columns:
+            self._conn.execute(f"ALTER TABLE messages ADD COLUMN lane TEXT NOT NULL DEFAULT '{BULK}'")
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "skipped" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN skipped INTEGER NOT NULL DEFAULT 0")
+        if "send_at" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN send_at REAL")
+        if "lane" not in columns:
+            self._conn.execute(f"ALTER TABLE jobs ADD COLUMN lane TEXT NOT NULL DEFAULT '{BULK}'")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_done ON messages (job_id, done_seq)")
+        # messages_due ordenaba solo por hora de envío; claim recorre ahora cada carril
+        self._conn.execute("DROP INDEX IF EXISTS messages_due")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_ready ON messages (status, lane, due_at)")
+        # Solo los trabajos recibidos por partes (ver append) guardan la dirección normalizada
+        self._conn.execute(
+            """CREATE UNIQUE INDEX IF NOT EXISTS messages_email ON messages (job_id, email_key)
+               WHERE email_key IS NOT NULL"""
+        )
+
+    def enqueue(
+        self,
+        request: dict,
+        recipients: List[dict],
+        send_at: Optional[float] = None,
+        spread: float = 0,
+        lane: str = BULK
+    ) -> str:
+        """
+        Guarda un lote y retorna el identificador del trabajo. Los mensajes
+        se envían a partir de `send_at` (timestamp; None para enviarlos ya)
+        y, con `spread`, repartidos de forma uniforme en esos segundos, por
+        el carril `lane`.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        start = max(send_at or now, now)
+        interval = spread / len(recipients) if recipients else 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    """INSERT INTO jobs (id, request, status, total, created_at, send_at, lane)
+                       VALUES (?, ?, 'queued', ?, ?, ?, ?)""",
+                    (job_id, json.dumps(request), len(recipients), now, send_at, lane)
+                )
+                self._conn.executemany(
+                    """INSERT INTO messages (job_id, idx, email, name, status, due_at, lane)
+                       VALUES (?, ?, ?, ?, 'pending', ?, ?)""",
+                    (
+                        (job_id, idx, recipient["email"], recipient.get("name"), start + idx * interval, lane)
+                        for idx, recipient in enumerate(recipients)
+                    )
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def open_job(self, request: dict, send_at: Optional[float] = None, lane: str = BULK) -> str:
+        """
+        Crea un trabajo vacío en estado 'receiving' para ir añadiéndole
+        mensajes con `append` mientras llegan; los workers pueden empezar a
+        enviarlos (a partir de `send_at`, si se indica, y por el carril
+        `lane`), pero el trabajo no termina hasta cerrarlo con `seal`.
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO jobs (id, request, status, total, created_at, send_at, lane)
+                   VALUES (?, ?, 'receiving', 0, ?, ?, ?)""",
+                (job_id, json.dumps(request), time.time(), send_at, lane)
+            )
+        return job_id
+
+    def append(self, job_id: str, recipients: List[Tuple[int, dict]], hold: bool = False) -> int:
+        """
+        Añade mensajes a un trabajo abierto con `open_job`, con su posición en
+        el lote. Las direcciones que ya tiene el trabajo (sin distinguir
+        mayúsculas ni espacios) se ignoran; retorna cuántos mensajes se
+        añadieron. Con `hold` no se envían hasta `seal` (para repartirlos
+        cuando se conozca el total).
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                job = self._conn.execute("SELECT send_at, lane FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                due_at = _HELD if hold else max(job["send_at"] or 0, time.time())
+                added = self._conn.executemany(
+                    """INSERT OR IGNORE INTO messages (job_id, idx, email, name, status, email_key, due_at, lane)
+                       VALUES (?, ?, ?, ?, 'pending', ?, ?, ?)""",
+                    (
+                        (
+                            job_id,
+                            idx,
+                            recipient["email"],
+                            recipient.get("name"),
+                            normalize_email(recipient["email"]),
+                            due_at,
+                            job["lane"]
+                        )
+                        for idx, recipient in recipients
+                    )
+                ).rowcount
+                self._conn.execute("UPDATE jobs SET total = total + ? WHERE id = ?", (added, job_id))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return added
+
+    def seal(self, job_id: str, discard_pending: bool = False, spread: float = 0) -> None:
+        """
+        Cierra un trabajo abierto con `open_job`. Con `discard_pending` (p. ej.
+        si la subida se interrumpió) se descartan los mensajes que aún no se
+        han tomado para enviar. Los mensajes retenidos con `hold` se liberan,
+        repartidos en `spread` segundos según su posición en el lote.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if discard_pending:
+                    self._conn.execute(
+                        "DELETE FROM messages WHERE job_id = ? AND status = 'pending'", (job_id,)
+                    )
+                    self._conn.execute(
+                        "UPDATE jobs SET total = (SELECT COUNT(*) FROM messages WHERE job_id = ?) WHERE id = ?",
+                        (job_id, job_id)
+                    )
+                else:
+                    count = self._conn.execute(
+                        "SELECT MAX(idx) + 1 AS count FROM messages WHERE job_id = ?", (job_id,)
+                    ).fetchone()["count"]
+                    job = self._conn.execute("SELECT send_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                    self._conn.execute(
+                        """UPDATE messages SET due_at = ? + idx * ?
+                           WHERE status = 'pending' AND due_at = ? AND job_id = ?""",
+                        (max(job["send_at"] or 0, time.time()), spread / (count or 1), _HELD, job_id)
+                    )
+                self._conn.execute(
+                    """UPDATE jobs SET status = CASE WHEN started_at IS NULL THEN 'queued' ELSE 'running' END
+                       WHERE id = ? AND status = 'receiving'""",
+                    (job_id,)
+                )
+                self._finish_if_done(job_id)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _finish_if_done(self, job_id: str) -> None:
+        self._conn.execute(
+            """UPDATE jobs SET status = 'done', finished_at = ?
+               WHERE id = ? AND sent + failed + skipped >= total AND status NOT IN ('done', 'receiving')""",
+            (time.time(), job_id)
+        )
+
+    def claim(self, limit: int = CLAIM_SIZE) -> Optional[Tuple[str, dict, List[Tuple[int, dict]]]]:
+        """
+        Toma hasta `limit` mensajes de un mismo trabajo, carril por carril
+        (ver LANES): dentro de un carril, primero los que tienen el plazo
+        vencido y, si no hay, los pendientes cuya hora de envío ya llegó, de
+        más antiguo a más reciente. Retorna el trabajo, sus datos y los
+        mensajes, o None si no hay nada que enviar.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                claimed = self._claim_rows(now, limit)
+                if claimed is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                job_id, rows = claimed
+                self._conn.executemany(
+                    """UPDATE messages SET status = 'sending', lease_until = ?, deliveries = deliveries + 1
+                       WHERE job_id = ? AND idx = ?""",
+                    ((now + self.lease_seconds, job_id, r["idx"]) for r in rows)
+                )
+                job = self._conn.execute(
+                    "SELECT request, started_at FROM jobs WHERE id = ?", (job_id,)
+                ).fetchone()
+                if job["started_at"] is None:
+                    # Un trabajo que aún se está recibiendo sigue en 'receiving' hasta cerrarlo
+                    self._conn.execute(
+                        """UPDATE jobs SET started_at = ?,
+                           status = CASE status WHEN 'receiving' THEN status ELSE 'running' END
+                           WHERE id = ?""",
+                        (now, job_id)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        messages = [(r["idx"], {"email": r["email"], "name": r["name"]}) for r in rows]
+        return job_id, json.loads(job["request"]), messages
+
+    def _claim_rows(self, now: float, limit: int) -> Optional[Tuple[str, list]]:
+        """Busca el bloque que toca enviar (ver claim) sin tomarlo todavía."""
+        for lane in LANES:
+            row = self._conn.execute(
+                "SELECT job_id FROM messages WHERE status = 'sending' AND lane = ? AND lease_until < ? LIMIT 1",
+                (lane, now)
+            ).fetchone()
+            if row is not None:
+                return row["job_id"], self._conn.execute(
+                    """SELECT idx, email, name FROM messages
+                       WHERE job_id = ? AND status = 'sending' AND lease_until < ?
+                       ORDER BY idx LIMIT ?""",
+                    (row["job_id"], now, limit)
+                ).fetchall()
+
+            row = self._conn.execute(
+                """SELECT job_id FROM messages WHERE status = 'pending' AND lane = ? AND due_at <= ?
+                   ORDER BY due_at LIMIT 1""",
+                (lane, now)
+            ).fetchone()
+            if row is not None:
+                # Recorre el índice por hora de envío: los mensajes del trabajo están al principio
+                return row["job_id"], self._conn.execute(
+                    """SELECT idx, email, name FROM messages
+                       WHERE status = 'pending' AND lane = ? AND due_at <= ? AND job_id = ?
+                       ORDER BY due_at LIMIT ?""",
+                    (lane, now, row["job_id"], limit)
+                ).fetchall()
+        return None
+
+    def complete(self, job_id: str, results: List[Tuple[int, dict]]) -> None:
+        """
+        Registra el resultado de cada mensaje (enviado, fallido u omitido por
+        repetido o suprimido) y cierra el trabajo si ya no queda nada. Cada
+        mensaje terminado recibe un número de secuencia consecutivo dentro del
+        trabajo (ver `results`).
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                job = self._conn.execute(
+                    "SELECT sent + failed + skipped AS done FROM jobs WHERE id = ?", (job_id,)
+                ).fetchone()
+                seq = job["done"] if job is not None else 0
+                counts = {"sent": 0, "failed": 0, "skipped": 0}
+                for idx, result in results:
+                    status = "failed" if "error" in result else "skipped" if "skipped" in result else "sent"
+                    updated = self._conn.execute(
+                        """UPDATE messages SET status = ?, result = ?, lease_until = NULL, done_seq = ?
+                           WHERE job_id = ? AND idx = ? AND status = 'sending'""",
+                        (status, json.dumps(result, default=str), seq + 1, job_id, idx)
+                    ).rowcount
+                    # Un mensaje reenviado tras vencer su plazo solo se cuenta una vez
+                    if updated:
+                        seq += 1
+                        counts[status] += 1
+                self._conn.execute(
+                    "UPDATE jobs SET sent = sent + ?, failed = failed + ?, skipped = skipped + ? WHERE id = ?",
+                    (counts["sent"], counts["failed"], counts["skipped"], job_id)
+                )
+                self._finish_if_done(job_id)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def release(self, job_id: str, indexes: List[int]) -> None:
+        """Devuelve a la cola mensajes tomados que no llegaron a enviarse."""
+        with self._lock:
+            self._conn.executemany(
+                """UPDATE messages SET status = 'pending', lease_until = NULL
+                   WHERE job_id = ? AND idx = ? AND status = 'sending'""",
+                ((job_id, idx) for idx in indexes)
+            )
+
+    def hold_notification(self, key: str, payload: dict) -> int:
+        """
+        Guarda una notificación que espera a reunirse con otras en un digest
+        (ver coalesce.NotificationCoalescer) y retorna su id.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "INSERT INTO notifications (digest_key, payload, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(payload), time.time())
+            ).lastrowid
+
+    def held_notifications(self) -> List[Tuple[int, str, dict, float]]:
+        """Notificaciones guardadas con hold_notification y aún sin liberar, por orden de llegada."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, digest_key, payload, created_at FROM notifications ORDER BY id"
+            ).fetchall()
+        return [(row["id"], row["digest_key"], json.loads(row["payload"]), row["created_at"]) for row in rows]
+
+    def release_notifications(self, ids: List[int]) -> None:
+        """Borra las notificaciones ya enviadas."""
+        with self._lock:
+            self._conn.executemany("DELETE FROM notifications WHERE id = ?", ((id_,) for id_ in ids))
+
+    def job(self, job_id: str) -> Optional[dict]:
+        """
+        Estado y progreso de un trabajo: contadores, mensajes por segundo
+        desde que empezó y tiempo estimado hasta terminar. Solo lee la fila
+        del trabajo, así que se puede consultar a menudo.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT id, status, lane, total, sent, failed, skipped, created_at, send_at, started_at,
+                   finished_at FROM jobs WHERE id = ?""",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        done = job["sent"] + job["failed"] + job["skipped"]
+        job["pending"] = job["total"] - done
+        job["progress"] = done / job["total"] if job["total"] else 1.0
+        job["elapsed"] = job["throughput"] = job["eta"] = None
+        if job["started_at"] is not None:
+            job["elapsed"] = (job["finished_at"] or time.time()) - job["started_at"]
+            if job["elapsed"] > 0:
+                job["throughput"] = done / job["elapsed"]
+            if job["throughput"]:
+                job["eta"] = job["pending"] / job["throughput"]
+        return job
+
+    def results(self, job_id: str, after: int = 0, limit: int = 500) -> List[dict]:
+        """
+        Resultados de los mensajes terminados con número de secuencia mayor
+        que `after`, en el orden en que terminaron.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT done_seq, idx, status, result FROM messages
+                   WHERE job_id = ? AND done_seq > ?
+                   ORDER BY done_seq LIMIT ?""",
+                (job_id, after, limit)
+            ).fetchall()
+        results = []
+        for row in rows:
+            result = json.loads(row["result"])
+            result.update(seq=row["done_seq"], index=row["idx"], status=row["status"])
+            results.append(result)
+        return results
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class OutboxWorkers:
+    """
+    Tareas asíncronas que vacían el outbox. Cada worker toma un bloque de
+    mensajes, lo entrega con `handler(request, recipients)` (que retorna un
+    resultado por destinatario, en orden) y registra los resultados. El
+    número de workers regula cuántos bloques se envían a la vez.
+    """
+
+    def __init__(
+        self,
+        outbox: Outbox,
+        handler: Callable[[dict, List[dict]], Awaitable[List[dict]]],
+        workers: int = 4,
+        poll_interval: float = 1.0
+    ):
+        self.outbox = outbox
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._tasks: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+
+    def start(self) -> None:
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    def notify(self) -> None:
+        """Despierta a los workers tras encolar un trabajo."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self) -> None:
+        while True:
+            claimed = await asyncio.to_thread(self.outbox.claim)
+            if claimed is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, request, messages = claimed
+            try:
+                results = await self.handler(request, [recipient for _, recipient in messages])
+            except asyncio.CancelledError:
+                await asyncio.to_thread(self.outbox.release, job_id, [idx for idx, _ in messages])
+                raise
+            except Exception as e:
+                print(f"Error procesando el trabajo {job_id}: {str(e)}")
+                results = [
+                    {"error": str(e), "email": recipient["email"], "attempts": 0, "retryable": False}
+                    for _, recipient in messages
+                ]
+            await asyncio.to_thread(
+                self.outbox.complete,
+                job_id,
+                [(idx, result) for (idx, _), result in zip(messages, results)]
+            )
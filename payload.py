@@ -0,0 +1,224 @@
+import re
+import threading
+from typing import FrozenSet, Optional
+
+from cachetools import LRUCache
+from lxml import etree
+from premailer.premailer import _cache_parse_css_string
+
+from inliner import StyleInliner
+
+# Espacios que no alteran el renderizado al colapsarse (sin &nbsp;)
+_SPACES = " \t\r\n\f"
+
+# Elementos cuyo contenido se respeta tal cual
+_PRESERVE = {"pre", "textarea", "script", "style"}
+
+# Separa declaraciones por ';' fuera de comillas y paréntesis
+_DECLARATION = re.compile(r"""((?:[^;"'(]|"[^"]*"|'[^']*'|\([^)]*\))+)""")
+_IMPORTANT = re.compile(r"\s*!\s*important\s*$", re.IGNORECASE)
+
+# Propiedades abreviadas y las longhand que anulan cuando aparecen después
+_SHORTHANDS = {
+    "margin": ("margin-top", "margin-right", "margin-bottom", "margin-left"),
+    "padding": ("padding-top", "padding-right", "padding-bottom", "padding-left"),
+    "background": ("background-color", "background-image", "background-repeat", "background-position"),
+    "border-top": ("border-top-width", "border-top-style", "border-top-color"),
+    "border-right": ("border-right-width", "border-right-style", "border-right-color"),
+    "border-bottom": ("border-bottom-width", "border-bottom-style", "border-bottom-color"),
+    "border-left": ("border-left-width", "border-left-style", "border-left-color"),
+}
+
+
+def _collapse(text: Optional[str]) -> Optional[str]:
+    if text and not text.strip(_SPACES):
+        return "\n" if "\n" in text else " "
+    return text
+
+
+class OptimizedHTML(str):
+    """HTML ya optimizado que recuerda cuántos bytes se ahorraron al optimizarlo."""
+    saved = 0
+
+
+def _is_conditional(comment: etree._Comment) -> bool:
+    """Comentarios condicionales de Outlook (<!--[if mso]> ... <![endif]-->)."""
+    text = (comment.text or "").strip()
+    return text.startswith("[if") or text.startswith("<![endif")
+
+
+class PayloadOptimizer:
+    """
+    Etapa opcional posterior al renderizado que reduce el tamaño del HTML
+    antes de entregarlo al proveedor: elimina comentarios, colapsa los
+    espacios entre etiquetas, deduplica las declaraciones de cada atributo
+    style y quita de los bloques <style> las reglas ya inlineadas que no
+    coinciden con ningún elemento del documento.
+
+    El texto visible no se modifica. `optimize` cuenta los documentos
+    optimizados y `count` los bytes de cada mensaje enviado antes y después
+    de optimizar: un mismo documento puede enviarse muchas veces (caché de
+    renderizado, esqueleto de un lote).
+    """
+
+    def __init__(self, inliner: StyleInliner, cache_size: int = 4096):
+        self.inliner = inliner
+        self._styles = LRUCache(maxsize=cache_size)
+        self._sheets = LRUCache(maxsize=64)
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.messages = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    def optimize(self, html: str) -> OptimizedHTML:
+        stripped = html.strip()
+        tree = etree.fromstring(stripped, etree.HTMLParser()).getroottree()
+        page = tree.getroot()
+        root = tree if stripped.startswith(tree.docinfo.doctype) else page
+
+        self._strip_comments(page)
+        self._collapse_whitespace(page)
+        for element in page.iter():
+            style = element.get("style") if isinstance(element.tag, str) else None
+            if style is not None:
+                element.set("style", self._dedupe(style))
+        for element in page.iter("style"):
+            if element.text:
+                prunable = self.inliner.unmatched_selectors(page, element.text)
+                element.text = self._minify_css(element.text, prunable)
+
+        optimized = OptimizedHTML(etree.tostring(root, method="html", encoding="utf-8").decode("utf-8"))
+        optimized.saved = len(html.encode("utf-8")) - len(optimized.encode("utf-8"))
+
+        with self._lock:
+            self.documents += 1
+        return optimized
+
+    def count(self, html: str, saved: int) -> None:
+        """Suma un mensaje enviado con este HTML, que ahorró `saved` bytes al optimizarse."""
+        size = len(html.encode("utf-8"))
+        with self._lock:
+            self.messages += 1
+            self.bytes_before += size + saved
+            self.bytes_after += size
+
+    def stats(self) -> dict:
+        with self._lock:
+            saved = self.bytes_before - self.bytes_after
+            return {
+                "documents": self.documents,
+                "messages": self.messages,
+                "bytes_before": self.bytes_before,
+                "bytes_after": self.bytes_after,
+                "saved_ratio": saved / self.bytes_before if self.bytes_before else 0.0
+            }
+
+    def _strip_comments(self, page: etree._Element) -> None:
+        for comment in list(page.iter(etree.Comment)):
+            if _is_conditional(comment):
+                continue
+            parent = comment.getparent()
+            if parent is None:
+                continue
+            # Al quitar el comentario su texto posterior pasa al nodo anterior
+            if comment.tail:
+                previous = comment.getprevious()
+                if previous is not None:
+                    previous.tail = (previous.tail or "") + comment.tail
+                else:
+                    parent.text = (parent.text or "") + comment.tail
+            parent.remove(comment)
+
+    def _collapse_whitespace(self, page: etree._Element) -> None:
+        for element in page.iter():
+            if not isinstance(element.tag, str):
+                element.tail = _collapse(element.tail)
+                continue
+            preserved = element.tag in _PRESERVE or any(
+                ancestor.tag in _PRESERVE for ancestor in element.iterancestors()
+            )
+            if not preserved:
+                element.text = _collapse(element.text)
+            parent = element.getparent()
+            if parent is None or not (parent.tag in _PRESERVE or any(
+                ancestor.tag in _PRESERVE for ancestor in parent.iterancestors()
+            )):
+                element.tail = _collapse(element.tail)
+
+    def _dedupe(self, style: str) -> str:
+        """
+        Deja una sola declaración por propiedad, y quita las longhand que una
+        abreviada posterior anula, respetando la cascada y los !important.
+        """
+        with self._lock:
+            cached = self._styles.get(style)
+        if cached is not None:
+            return cached
+
+        declarations = {}
+        for match in _DECLARATION.finditer(style):
+            name, sep, value = match.group(1).partition(":")
+            name = name.strip().lower()
+            value = value.strip()
+            if not sep or not name or not value:
+                continue
+            important = bool(_IMPORTANT.search(value))
+            if important:
+                value = _IMPORTANT.sub("", value) + "!important"
+            previous = declarations.get(name)
+            if previous is not None and previous[1] and not important:
+                continue
+            declarations.pop(name, None)
+            # Una abreviada posterior anula las longhand anteriores no !important
+            for longhand in _SHORTHANDS.get(name, ()):
+                if longhand in declarations and not declarations[longhand][1]:
+                    del declarations[longhand]
+            declarations[name] = (value, important)
+
+        deduped = ";".join(f"{name}:{value}" for name, (value, _) in declarations.items())
+        with self._lock:
+            self._styles[style] = deduped
+        return deduped
+
+    def _minify_css(self, css_body: str, prunable: FrozenSet[str]) -> str:
+        key = (css_body, prunable)
+        with self._lock:
+            cached = self._sheets.get(key)
+        if cached is not None:
+            return cached
+
+        parts = []
+        for rule in _cache_parse_css_string(css_body, validate=True):
+            if rule.type == rule.STYLE_RULE:
+                minified = self._minify_rule(rule, prunable)
+                if minified:
+                    parts.append(minified)
+            elif rule.type == rule.MEDIA_RULE:
+                inner = [self._minify_rule(child, frozenset()) for child in rule.cssRules
+                         if child.type == child.STYLE_RULE]
+                inner = [child for child in inner if child]
+                if inner:
+                    parts.append("@media %s{%s}" % (rule.media.mediaText, "".join(inner)))
+            elif rule.type != rule.COMMENT:
+                parts.append(rule.cssText)
+
+        minified = "".join(parts)
+        with self._lock:
+            self._sheets[key] = minified
+        return minified
+
+    @staticmethod
+    def _minify_rule(rule, prunable: FrozenSet[str]) -> Optional[str]:
+        selectors = [
+            selector.strip()
+            for selector in rule.selectorText.split(",")
+            if selector.strip() and selector.strip() not in prunable
+        ]
+        declarations = [
+            "%s:%s%s" % (prop.name, prop.value, "!important" if prop.priority else "")
+            for prop in rule.style.getProperties()
+        ]
+        if not selectors or not declarations:
+            return None
+        return "%s{%s}" % (",".join(selectors), ";".join(declarations))
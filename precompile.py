@@ -0,0 +1,201 @@
+"""
+Compilación anticipada de las plantillas de email.
+
+Genera un zip con el código Python de todas las plantillas de `templates/`
+para que un worker recién arrancado no tenga que parsear el código fuente:
+
+    python precompile.py --output build/templates.zip --benchmark
+"""
+import argparse
+import json
+import statistics
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from jinja2 import BaseLoader, ChoiceLoader, Environment, ModuleLoader
+
+# Fichero del paquete compilado con el análisis de cada plantilla (ver rendering.TemplateAnalysis)
+ANALYSIS_FILE = "analysis.json"
+
+
+def _read_analyses(compiled_path: str) -> Dict[str, dict]:
+    """Análisis guardados en el paquete compilado; los paquetes anteriores no los tienen."""
+    path = Path(compiled_path)
+    try:
+        if path.is_dir():
+            data = (path / ANALYSIS_FILE).read_text(encoding="utf-8")
+        else:
+            with zipfile.ZipFile(path) as archive:
+                data = archive.read(ANALYSIS_FILE).decode("utf-8")
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return {}
+    return json.loads(data)
+
+
+class PrecompiledLoader(ChoiceLoader):
+    """
+    Carga las plantillas precompiladas y recurre al loader de código fuente
+    para las que no estén en el paquete compilado. El análisis de cada
+    plantilla también viene del paquete (ver analysis); el código fuente
+    solo se lee para las plantillas que no están o que han cambiado.
+    """
+
+    def __init__(self, compiled_path: str, source_loader: BaseLoader):
+        super().__init__([ModuleLoader(compiled_path), source_loader])
+        self.source_loader = source_loader
+        self.analyses = _read_analyses(compiled_path)
+        # Plantillas modificadas desde la precompilación (ver mark_stale)
+        self.stale = set()
+
+    def analysis(self, name: str) -> Optional[dict]:
+        """Análisis precompilado de la plantilla, salvo que haya cambiado alguna de su cadena."""
+        data = self.analyses.get(name)
+        if data is None or self.stale.intersection(data["names"]):
+            return None
+        return data
+
+    def mark_stale(self, names) -> None:
+        """Las plantillas indicadas se cargan en adelante desde el código fuente."""
+        self.stale.update(names)
+
+    def load(self, environment, name, globals=None):
+        if name in self.stale:
+            return self.source_loader.load(environment, name, globals)
+        return super().load(environment, name, globals)
+
+    def get_source(self, environment, template):
+        return self.source_loader.get_source(environment, template)
+
+    def list_templates(self):
+        return self.source_loader.list_templates()
+
+
+def compile_templates(
+    template_env: Environment,
+    output: str,
+    zip: Optional[str] = "deflated"
+) -> List[str]:
+    """
+    Compila las plantillas HTML del entorno en `output` (zip o directorio),
+    junto con su análisis de dependencias.
+    """
+    from rendering import TemplateAnalysis
+
+    compiled = []
+
+    def log(message):
+        compiled.append(message)
+
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    template_env.compile_templates(
+        output,
+        extensions=['html'],
+        zip=zip,
+        log_function=log,
+        ignore_errors=False
+    )
+
+    analyses = {
+        name: TemplateAnalysis.from_source(template_env, name).to_dict()
+        for name in template_env.list_templates(extensions=['html'])
+    }
+    data = json.dumps(analyses)
+    if zip is None:
+        (Path(output) / ANALYSIS_FILE).write_text(data, encoding="utf-8")
+    else:
+        compression = zipfile.ZIP_DEFLATED if zip == "deflated" else zipfile.ZIP_STORED
+        with zipfile.ZipFile(output, "a", compression) as archive:
+            archive.writestr(ANALYSIS_FILE, data)
+    log(f"Análisis de {len(analyses)} plantillas guardado en {ANALYSIS_FILE}")
+    return compiled
+
+
+def _new_service(compiled_path: Optional[str], templates_dir: Optional[str]):
+    from models import EmailAddress
+    from service import EmailService
+
+    # Sin caché de renderizados: en caliente se mide el renderizado, no un acierto de caché
+    return EmailService(
+        api_key="benchmark",
+        default_from=EmailAddress("no-reply@example.com"),
+        templates_dir=templates_dir,
+        compiled_templates=compiled_path,
+        render_cache_size=0,
+        testing=True
+    )
+
+
+def benchmark(
+    compiled_path: Optional[str],
+    templates_dir: Optional[str] = None,
+    repeat: int = 20
+) -> Dict[str, Tuple[float, float]]:
+    """
+    Mide la latencia (en ms, mediana) de EmailService.send para cada email
+    de ejemplo, en modo testing: carga y análisis de la plantilla,
+    renderizado, inlining de estilos y construcción del mensaje. Retorna,
+    por plantilla, la del primer envío con un servicio recién creado (en
+    frío) y la de los envíos siguientes con el mismo servicio (en caliente).
+    """
+    from benchmarks.samples import sample_emails
+    from models import EmailAddress
+
+    to = [EmailAddress("usuario@example.com", "Usuario")]
+    timings = {}
+    for email in sample_emails():
+        cold = []
+        warm = []
+        for _ in range(repeat):
+            service = _new_service(compiled_path, templates_dir)
+            try:
+                start = time.perf_counter()
+                service.send(email, to, "Benchmark")
+                cold.append((time.perf_counter() - start) * 1000)
+
+                start = time.perf_counter()
+                service.send(email, to, "Benchmark")
+                warm.append((time.perf_counter() - start) * 1000)
+            finally:
+                service.close()
+        timings[email.template_name] = (statistics.median(cold), statistics.median(warm))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompila las plantillas de email")
+    parser.add_argument("--output", default="build/templates.zip", help="Zip o directorio de salida")
+    parser.add_argument("--templates-dir", default=None, help="Directorio de plantillas")
+    parser.add_argument("--no-zip", action="store_true", help="Generar un directorio de módulos en lugar de un zip")
+    parser.add_argument("--benchmark", action="store_true", help="Comparar la latencia de envío, en frío y en caliente, con y sin precompilación")
+    parser.add_argument("--repeat", type=int, default=20, help="Servicios nuevos por plantilla en el benchmark")
+    args = parser.parse_args()
+
+    from models import EmailAddress
+    from service import EmailService
+
+    service = EmailService(
+        api_key="build",
+        default_from=EmailAddress("no-reply@example.com"),
+        templates_dir=args.templates_dir,
+        testing=True
+    )
+    compiled = compile_templates(
+        service.template_env,
+        args.output,
+        zip=None if args.no_zip else "deflated"
+    )
+    for message in compiled:
+        print(message)
+
+    if args.benchmark:
+        source = benchmark(None, args.templates_dir, args.repeat)
+        precompiled = benchmark(args.output, args.templates_dir, args.repeat)
+        print(f"\n{'Plantilla':<22}{'':>8}{'Fuente (ms)':>14}{'Precompilada (ms)':>20}{'Mejora':>10}")
+        for template_name, timings in source.items():
+            for label, elapsed, fast in zip(("frío", "caliente"), timings, precompiled[template_name]):
+                print(f"{template_name:<22}{label:>8}{elapsed:>14.2f}{fast:>20.2f}{elapsed / fast:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
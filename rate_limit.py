@@ -0,0 +1,262 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Deque, Dict, Optional
+
+# Pausa cuando el proveedor responde 429 sin cabecera Retry-After
+DEFAULT_RETRY_AFTER = 1.0
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Segundos de espera de una cabecera Retry-After (en segundos o como fecha HTTP)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """Indica si la excepción corresponde a una respuesta 429 del proveedor."""
+    return str(getattr(error, "code", "")) == "429"
+
+
+# Carriles de envío y su peso por defecto en el reparto de la tasa (ver RateLimiter)
+TRANSACTIONAL = "transactional"
+DEFAULT_LANE = "default"
+BULK = "bulk"
+DEFAULT_LANE_WEIGHTS = {TRANSACTIONAL: 16, DEFAULT_LANE: 4, BULK: 1}
+
+# Esperas recientes que se guardan por carril para calcular percentiles
+LANE_SAMPLES = 1000
+
+
+def parse_lane_weights(value: str) -> Dict[str, float]:
+    """Pesos de los carriles en formato "transactional=16,default=4,bulk=1"."""
+    weights = dict(DEFAULT_LANE_WEIGHTS)
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        lane, _, weight = item.partition("=")
+        weights[lane.strip().lower()] = float(weight)
+    return weights
+
+
+class _Waiter:
+    """Petición en espera de un token: un hilo (event) o una corrutina (future)."""
+
+    __slots__ = ("lane", "since", "granted", "event", "loop", "future")
+
+    def __init__(self, lane: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.lane = lane
+        self.since = time.monotonic()
+        self.granted = False
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def wake(self) -> None:
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+    def rearm(self) -> None:
+        """Prepara una nueva espera tras despertar sin token."""
+        if self.event is not None:
+            self.event.clear()
+        elif self.future.done():
+            self.future = self.loop.create_future()
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class RateLimiter:
+    """
+    Token bucket compartido por todos los envíos al proveedor, válido tanto
+    para hilos (acquire) como para corrutinas (acquire_async).
+
+    Admite ráfagas de hasta `burst` peticiones y después `rate` peticiones
+    por segundo (rate=0 no limita). Cuando el proveedor responde 429 el
+    bucket se detiene el tiempo indicado en Retry-After y la tasa se reduce
+    a la mitad; con cada envío correcto se recupera poco a poco hasta la
+    tasa configurada, de modo que el ritmo se mantiene cerca del límite real
+    del proveedor sin ráfagas de errores.
+
+    Cada petición espera en un carril (transaccional, por defecto o masivo)
+    y los tokens se reparten entre los carriles con espera en proporción a
+    su peso (stride scheduling). Un carril que estaba vacío entra en el
+    turno actual sin acumular crédito, así que un email transaccional toma
+    el siguiente token aunque haya miles de envíos masivos esperando, y los
+    masivos siguen avanzando con su parte.
+    """
+
+    def __init__(
+        self,
+        rate: float = 0,
+        burst: int = 1,
+        min_rate: Optional[float] = None,
+        weights: Optional[Dict[str, float]] = None
+    ):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 10
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        # Instante hasta el que están contabilizados los tokens (en el futuro si está en pausa)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.throttled = 0
+        
+        self.weights = dict(weights or DEFAULT_LANE_WEIGHTS)
+        self._queues: Dict[str, Deque[_Waiter]] = {lane: deque() for lane in self.weights}
+        # Posición de cada carril en el turno; se atiende el carril con espera más atrasado
+        self._passes = {lane: 0.0 for lane in self.weights}
+        self._virtual = 0.0
+        self._granted = {lane: 0 for lane in self.weights}
+        self._waits: Dict[str, Deque[float]] = {lane: deque(maxlen=LANE_SAMPLES) for lane in self.weights}
+        # Solo una petición en espera despierta a su hora para repartir el
+        # siguiente token; las demás duermen hasta recibir el suyo
+        self._timer: Optional[_Waiter] = None
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        if waiter.lane not in self._queues:
+            raise ValueError(f"Carril de envío desconocido: {waiter.lane}")
+        with self._lock:
+            queue = self._queues[waiter.lane]
+            if not queue:
+                self._passes[waiter.lane] = max(self._passes[waiter.lane], self._virtual)
+            queue.append(waiter)
+
+    def _poll(self, waiter: _Waiter) -> Optional[float]:
+        """
+        Reparte los tokens disponibles entre los carriles. Retorna 0 si
+        `waiter` ya tiene el suyo, los segundos hasta el siguiente token si le
+        toca vigilarlo o None si debe dormir hasta que lo despierten. La
+        espera se vuelve a evaluar al despertar, así que los cambios de tasa
+        afectan también a quien ya estaba esperando.
+        """
+        with self._lock:
+            now = time.monotonic()
+            paused = now < self._updated
+            if not paused and self.rate > 0:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+            while not paused and (self.rate <= 0 or self._tokens >= 1):
+                lanes = [lane for lane, queue in self._queues.items() if queue]
+                if not lanes:
+                    break
+                lane = min(lanes, key=lambda name: (self._passes[name], -self.weights[name]))
+                self._virtual = self._passes[lane]
+                self._passes[lane] += 1 / self.weights[lane]
+                if self.rate > 0:
+                    self._tokens -= 1
+                granted = self._queues[lane].popleft()
+                granted.granted = True
+                self._granted[lane] += 1
+                self._waits[lane].append(now - granted.since)
+                if granted is not waiter:
+                    granted.wake()
+            
+            if waiter.granted:
+                if self._timer is waiter:
+                    self._timer = None
+                    self._hand_over_timer()
+                return 0.0
+            waiter.rearm()
+            if self._timer is not None and self._timer is not waiter:
+                return None
+            self._timer = waiter
+            return self._updated - now if paused else (1 - self._tokens) / self.rate
+
+    def _hand_over_timer(self) -> None:
+        """Despierta a otra petición en espera para que vigile el siguiente token."""
+        for queue in self._queues.values():
+            if queue:
+                queue[0].wake()
+                return
+
+    def _withdraw(self, waiter: _Waiter) -> None:
+        """Retira a quien deja de esperar (p. ej. una corrutina cancelada) y devuelve su token."""
+        with self._lock:
+            if waiter.granted:
+                self._tokens = min(self.burst, self._tokens + 1)
+            else:
+                self._queues[waiter.lane].remove(waiter)
+            if self._timer is waiter:
+                self._timer = None
+                self._hand_over_timer()
+
+    def acquire(self, lane: str = DEFAULT_LANE) -> None:
+        waiter = _Waiter(lane)
+        self._enqueue(waiter)
+        wait = self._poll(waiter)
+        while wait != 0:
+            waiter.event.wait(wait)
+            wait = self._poll(waiter)
+
+    async def acquire_async(self, lane: str = DEFAULT_LANE) -> None:
+        waiter = _Waiter(lane, asyncio.get_running_loop())
+        self._enqueue(waiter)
+        try:
+            wait = self._poll(waiter)
+            while wait != 0:
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future), wait)
+                except asyncio.TimeoutError:
+                    pass
+                wait = self._poll(waiter)
+        except BaseException:
+            self._withdraw(waiter)
+            raise
+
+    def throttle(self, retry_after: Optional[float] = None) -> None:
+        """Detiene los envíos tras un 429 y reduce la tasa."""
+        pause = retry_after if retry_after is not None else DEFAULT_RETRY_AFTER
+        with self._lock:
+            self.throttled += 1
+            now = time.monotonic()
+            # Los 429 de peticiones que salieron juntas cuentan como uno solo
+            if self.rate > 0 and now >= self._updated:
+                self.rate = max(self.min_rate, self.rate / 2)
+            self._updated = max(self._updated, now + pause)
+            self._tokens = 0.0
+
+    def success(self) -> None:
+        """Recupera la tasa de forma gradual tras una respuesta correcta."""
+        if self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def stats(self) -> dict:
+        """Tasa actual y, por carril, peticiones en espera y tiempo de espera (segundos)."""
+        with self._lock:
+            lanes = {}
+            for lane, waits in self._waits.items():
+                ordered = sorted(waits)
+                lanes[lane] = {
+                    "weight": self.weights[lane],
+                    "waiting": len(self._queues[lane]),
+                    "granted": self._granted[lane],
+                    "wait_p50": ordered[len(ordered) // 2] if ordered else None,
+                    "wait_p99": ordered[int(len(ordered) * 0.99)] if ordered else None,
+                    "wait_max": ordered[-1] if ordered else None
+                }
+            return {
+                "rate": self.rate,
+                "max_rate": self.max_rate,
+                "burst": self.burst,
+                "throttled": self.throttled,
+                "lanes": lanes
+            }
@@ -0,0 +1,84 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional
+
+# Servicio de renderizado propio de cada proceso del pool
+_worker_service = None
+
+
+def _init_worker(config: dict) -> None:
+    """Crea y precalienta el servicio de renderizado del proceso."""
+    global _worker_service
+    from models import EmailAddress
+    from service import EmailService
+
+    _worker_service = EmailService(
+        api_key="",
+        default_from=EmailAddress("render@localhost"),
+        testing=True,
+        render_workers=0,
+        **config
+    )
+    _worker_service.warm_up()
+
+
+def _render_chunk(template_name: str, context: dict, users: List[dict]) -> List[str]:
+    renderer = _worker_service._personalized_renderer(template_name, context)
+    return [renderer.render(user) for user in users]
+
+
+class RenderPool:
+    """
+    Pool de procesos para renderizar lotes grandes usando todos los núcleos.
+
+    Los destinatarios se reparten en bloques entre los procesos; cada proceso
+    mantiene su propio entorno de Jinja ya compilado y su inliner, y los
+    resultados se devuelven en el orden original a medida que se completan.
+    """
+
+    def __init__(self, workers: int, config: dict, chunk_size: int = 250):
+        self.workers = workers
+        self.config = config
+        self.chunk_size = chunk_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.config,)
+            )
+        return self._executor
+
+    def render(self, template_name: str, context: dict, users: Iterable[dict]) -> Iterator[str]:
+        """
+        Renderiza el HTML de cada usuario. Como mucho hay dos bloques por
+        proceso en vuelo, así que la memoria no crece con el tamaño del lote.
+        """
+        executor = self._get_executor()
+        task = partial(_render_chunk, template_name, context)
+        users = iter(users)
+        pending = deque()
+
+        def submit():
+            chunk = list(islice(users, self.chunk_size))
+            if chunk:
+                pending.append(executor.submit(task, chunk))
+            return bool(chunk)
+
+        for _ in range(self.workers * 2):
+            if not submit():
+                break
+
+        while pending:
+            htmls = pending.popleft().result()
+            submit()
+            yield from htmls
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
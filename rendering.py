@@ -0,0 +1,490 @@
+import hashlib
+import html as html_lib
+import json
+import re
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cachetools import LRUCache, TTLCache
+from jinja2 import Environment, Template, nodes
+
+# Variable de la plantilla que cambia por destinatario
+PERSONAL_KEY = "user"
+
+# Nombres especiales de Jinja que un fragmento aislado no puede resolver
+_SCOPED_NAMES = {"self", "super", "caller", "varargs", "kwargs", "loop"}
+
+# Caracteres que lxml reescribe o descarta al serializar texto
+_CONTROL = re.compile(r"[\x00-\x08\x0b-\x1f\x7f]")
+
+# Con auto_reload, segundos entre comprobaciones de si Jinja ha recargado
+# alguna plantilla de un análisis
+RELOAD_CHECK_INTERVAL = 1.0
+
+
+def _template_chain(template_env: Environment, template_name: str) -> List[Tuple[str, str, nodes.Template]]:
+    """
+    Retorna nombre, código fuente y AST de la plantilla y de todas las
+    plantillas que extiende.
+    """
+    chain = []
+    seen = set()
+    name = template_name
+    while name and name not in seen:
+        seen.add(name)
+        source, _, _ = template_env.loader.get_source(template_env, name)
+        ast = template_env.parse(source)
+        chain.append((name, source, ast))
+        name = None
+        for extends in ast.find_all(nodes.Extends):
+            if isinstance(extends.template, nodes.Const):
+                name = extends.template.value
+    return chain
+
+
+def _references(node: nodes.Node, name: str = PERSONAL_KEY) -> bool:
+    """Indica si el nodo (o alguno de sus hijos) lee la variable `name`."""
+    if isinstance(node, nodes.Name):
+        return node.name == name
+    return any(found.name == name for found in node.find_all(nodes.Name))
+
+
+def _loaded_names(node: nodes.Node) -> set:
+    found = {n.name for n in node.find_all(nodes.Name) if n.ctx == "load"}
+    if isinstance(node, nodes.Name) and node.ctx == "load":
+        found.add(node.name)
+    return found
+
+
+def _stored_names(node: nodes.Node) -> set:
+    found = {n.name for n in node.find_all(nodes.Name) if n.ctx in ("store", "param")}
+    found.update(macro.name for macro in node.find_all(nodes.Macro))
+    return found
+
+
+def _generate(template_env: Environment, ast: nodes.Template, name: str) -> str:
+    """Código Python de una plantilla, el mismo que Jinja compila o guarda precompilado."""
+    ast.set_environment(template_env)
+    return template_env.compile(ast, name=name, raw=True)
+
+
+def _from_code(template_env: Environment, code: str) -> Template:
+    return template_env.template_class.from_code(
+        template_env,
+        compile(code, "<template>", "exec"),
+        template_env.make_globals(None)
+    )
+
+
+def _load_code(template_env: Environment, code: Dict[str, Any]) -> Dict[str, Any]:
+    """Compila el código del esqueleto y las regiones de un análisis (ver TemplateAnalysis)."""
+    loaded = {}
+    for key, value in code.items():
+        if isinstance(value, str):
+            value = _from_code(template_env, value)
+        elif isinstance(value, list):
+            value = [_from_code(template_env, item) for item in value]
+        loaded[key] = value
+    return loaded
+
+
+def _serialize_text(fragment: str) -> Optional[str]:
+    """
+    Reproduce cómo queda un fragmento de texto tras pasar por lxml (parseo y
+    serialización). Retorna None si el fragmento contiene marcado o
+    caracteres cuyo tratamiento depende de la posición en el documento.
+    """
+    if "<" in fragment or "\r" in fragment or _CONTROL.search(fragment):
+        return None
+    # Un fragmento vacío o solo de espacios puede dejar un nodo de texto en
+    # blanco, que el serializador o la optimización del HTML tratan aparte
+    if not fragment.strip():
+        return None
+    return html_lib.escape(html_lib.unescape(fragment), quote=False)
+
+
+class TemplateAnalysis:
+    """
+    Resultado del análisis de dependencias de una plantilla.
+
+    Las regiones que dependen de `user` se extraen como fragmentos
+    compilados por separado y en su lugar queda un marcador; el resto de la
+    plantilla (el esqueleto) solo depende de los datos compartidos.
+
+    Al crear el análisis solo se obtienen las plantillas de la cadena y el
+    hash de su contenido. El esqueleto y las regiones compiladas se generan
+    la primera vez que se usan, o vienen ya generados del paquete de
+    plantillas precompiladas (from_dict), en cuyo caso nunca se lee el
+    código fuente.
+    """
+
+    def __init__(
+        self,
+        template_env: Environment,
+        template_name: str,
+        names: tuple,
+        digest: str,
+        token: Optional[str] = None,
+        code: Optional[Dict[str, Any]] = None,
+        chain: Optional[list] = None
+    ):
+        self.template_env = template_env
+        self.template_name = template_name
+        self.names = names
+        self.digest = digest
+        self.precompiled = code is not None
+        self._token = token or uuid.uuid4().hex
+        # Código Python del esqueleto y las regiones, y su versión compilada
+        self._code = code
+        self._compiled: Optional[Dict[str, Any]] = None
+        self._chain = chain
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_source(cls, template_env: Environment, template_name: str) -> "TemplateAnalysis":
+        chain = _template_chain(template_env, template_name)
+        sha = hashlib.sha256()
+        for name, source, _ in chain:
+            sha.update(name.encode("utf-8"))
+            sha.update(source.encode("utf-8"))
+        names = tuple(name for name, _, _ in chain)
+        return cls(template_env, template_name, names, sha.hexdigest(), chain=chain)
+
+    @classmethod
+    def from_dict(cls, template_env: Environment, data: dict) -> "TemplateAnalysis":
+        """Análisis guardado con to_dict (ver precompile.compile_templates)."""
+        return cls(
+            template_env,
+            data["template"],
+            tuple(data["names"]),
+            data["digest"],
+            data["token"],
+            data["code"]
+        )
+
+    def to_dict(self) -> dict:
+        """Análisis completo, con el código del esqueleto y las regiones, serializable como JSON."""
+        self._load()
+        return {
+            "template": self.template_name,
+            "names": list(self.names),
+            "digest": self.digest,
+            "token": self._token,
+            "code": self._code
+        }
+
+    def _load(self) -> Dict[str, Any]:
+        compiled = self._compiled
+        if compiled is None:
+            with self._lock:
+                compiled = self._compiled
+                if compiled is None:
+                    if self._code is None:
+                        self._code = self._generate()
+                    compiled = self._compiled = _load_code(self.template_env, self._code)
+        return compiled
+
+    def _generate(self) -> dict:
+        if self._chain is None:
+            self._chain = _template_chain(self.template_env, self.template_name)
+        chain = self._chain
+        _, _, ast = chain[0]
+
+        code = {"personal": any(_references(ast) for _, _, ast in chain), "skeleton": None, "regions": []}
+        if code["personal"] and not any(_references(parent) for _, _, parent in chain[1:]):
+            # El AST de la plantilla se modifica: se parsea de nuevo si hiciera falta
+            self._chain = None
+            self._split(ast, code)
+        return code
+
+    @property
+    def personal(self) -> bool:
+        return self._load()["personal"]
+
+    @property
+    def skeleton(self) -> Optional[Template]:
+        return self._load()["skeleton"]
+
+    @property
+    def regions(self) -> List[Template]:
+        return self._load()["regions"]
+
+    def marker(self, index: int) -> str:
+        return f"x{self._token}r{index}x"
+
+    @property
+    def marker_pattern(self):
+        return re.compile(f"x{self._token}r(\\d+)x")
+
+    def _split(self, ast: nodes.Template, code: dict) -> None:
+        regions = []
+        ast.body = self._extract(ast.body, regions)
+
+        # Cada región debe poder renderizarse sola con los datos compartidos
+        stored = _stored_names(ast)
+        for region in regions:
+            loaded = _loaded_names(region)
+            outer = stored - _stored_names(region)
+            if loaded & outer or loaded & (_SCOPED_NAMES - {"loop"}):
+                return
+            if "loop" in loaded and not any(True for _ in region.find_all(nodes.For)):
+                return
+
+        code["regions"] = [
+            _generate(self.template_env, nodes.Template([region]), self.template_name)
+            for region in regions
+        ]
+        code["skeleton"] = _generate(self.template_env, ast, self.template_name)
+
+    def _extract(self, body: List[nodes.Node], regions: list) -> List[nodes.Node]:
+        """Sustituye en `body` cada región dependiente de `user` por un marcador."""
+        result = []
+        for node in body:
+            if not _references(node):
+                result.append(node)
+            elif isinstance(node, nodes.Output):
+                children = []
+                for child in node.nodes:
+                    if _references(child):
+                        children.append(nodes.TemplateData(self.marker(len(regions)), lineno=child.lineno))
+                        regions.append(nodes.Output([child], lineno=child.lineno))
+                    else:
+                        children.append(child)
+                node.nodes = children
+                result.append(node)
+            elif isinstance(node, (nodes.Block, nodes.Scope)):
+                node.body = self._extract(node.body, regions)
+                result.append(node)
+            elif isinstance(node, nodes.If) and not any(
+                _references(branch.test) for branch in [node] + node.elif_
+            ):
+                node.body = self._extract(node.body, regions)
+                for branch in node.elif_:
+                    branch.body = self._extract(branch.body, regions)
+                node.else_ = self._extract(node.else_, regions)
+                result.append(node)
+            else:
+                result.append(nodes.Output(
+                    [nodes.TemplateData(self.marker(len(regions)), lineno=node.lineno)],
+                    lineno=node.lineno
+                ))
+                regions.append(node)
+        return result
+
+
+class _AnalyzerEntry:
+    """Análisis vigente de una plantilla y las plantillas cargadas con las que se comprobó."""
+
+    __slots__ = ("analysis", "templates", "checked")
+
+    def __init__(self, analysis: TemplateAnalysis, templates: tuple, checked: float):
+        self.analysis = analysis
+        self.templates = templates
+        self.checked = checked
+
+
+class TemplateAnalyzer:
+    """
+    Mantiene el análisis de dependencias de cada plantilla, cacheado por el
+    hash de su contenido: si Jinja recarga una plantilla sin cambios, se
+    reutiliza el análisis que ya había.
+
+    `precompiled` retorna el análisis guardado en el paquete de plantillas
+    precompiladas (o None); esos análisis no cambian hasta que se llama a
+    clear(). Con auto_reload, el resto se comprueba contra las plantillas
+    que tiene cargadas Jinja como mucho cada `check_interval` segundos, no
+    en cada llamada; sin auto_reload solo se descartan con clear().
+    """
+
+    def __init__(
+        self,
+        template_env: Environment,
+        precompiled: Optional[Callable[[str], Optional[dict]]] = None,
+        check_interval: float = RELOAD_CHECK_INTERVAL,
+        maxsize: int = 256
+    ):
+        self.template_env = template_env
+        self.precompiled = precompiled
+        self.check_interval = check_interval
+        self._entries: Dict[str, _AnalyzerEntry] = {}
+        self._by_digest = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def _loaded(self, names: tuple) -> tuple:
+        return tuple(self.template_env.get_template(name) for name in names)
+
+    def _fresh(self, entry: _AnalyzerEntry) -> bool:
+        if not entry.templates:
+            return True
+        now = time.monotonic()
+        if now - entry.checked < self.check_interval:
+            return True
+        if self._loaded(entry.analysis.names) != entry.templates:
+            return False
+        entry.checked = now
+        return True
+
+    def _load(self, template_name: str) -> TemplateAnalysis:
+        data = self.precompiled(template_name) if self.precompiled is not None else None
+        if data is not None:
+            return TemplateAnalysis.from_dict(self.template_env, data)
+        return TemplateAnalysis.from_source(self.template_env, template_name)
+
+    def analyze(self, template_name: str) -> TemplateAnalysis:
+        entry = self._entries.get(template_name)
+        if entry is not None and self._fresh(entry):
+            return entry.analysis
+
+        with self._lock:
+            analysis = self._load(template_name)
+            analysis = self._by_digest.setdefault(analysis.digest, analysis)
+            templates = ()
+            if self.template_env.auto_reload and not analysis.precompiled:
+                templates = self._loaded(analysis.names)
+            self._entries[template_name] = _AnalyzerEntry(analysis, templates, time.monotonic())
+        return analysis
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_digest.clear()
+
+
+class PersonalizedRenderer:
+    """
+    Renderiza e inlinea el esqueleto compartido de una plantilla una sola
+    vez y genera el HTML de cada destinatario renderizando únicamente las
+    regiones que dependen de `user`.
+
+    El resultado es idéntico byte a byte al de renderizar la plantilla
+    completa: el primer destinatario que admite sustitución se renderiza
+    también de forma completa para verificarlo, y si un fragmento no puede
+    sustituirse de forma segura se recurre al renderizado completo.
+    """
+
+    def __init__(
+        self,
+        render: Callable[[str, dict], str],
+        inline: Callable[[str], str],
+        analysis: TemplateAnalysis,
+        context: dict,
+        enabled: bool = True
+    ):
+        self.render_full = render
+        self.inline = inline
+        self.analysis = analysis
+        self.context = context
+        self.enabled = enabled and PERSONAL_KEY in context
+        # Esqueleto ya inlineado, con los marcadores de las regiones
+        self.skeleton: Optional[str] = None
+        self._parts: Optional[List[str]] = None
+        self._verified = False
+        self._calls = 0
+
+    def _build_skeleton(self) -> None:
+        if self.analysis.skeleton is None:
+            self.enabled = False
+            return
+        skeleton = self.skeleton = self.inline(self.analysis.skeleton.render(**self.context))
+
+        # Los marcadores deben quedar en nodos de texto: dentro de atributos
+        # lxml podría reescribir el valor (p. ej. escapado de URLs)
+        pattern = self.analysis.marker_pattern
+        for match in pattern.finditer(skeleton):
+            if skeleton.rfind("<", 0, match.start()) > skeleton.rfind(">", 0, match.start()):
+                self.enabled = False
+                return
+
+        # Lista alterna de fragmentos literales e índices de región
+        self._parts = pattern.split(skeleton)
+
+    def _substitute(self, user: Dict[str, str]) -> Optional[str]:
+        context = dict(self.context)
+        context[PERSONAL_KEY] = user
+        rendered = []
+        for region in self.analysis.regions:
+            text = _serialize_text(region.render(context))
+            if text is None:
+                return None
+            rendered.append(text)
+
+        parts = list(self._parts)
+        for i in range(1, len(parts), 2):
+            parts[i] = rendered[int(parts[i])]
+        return "".join(parts)
+
+    def render(self, user: Dict[str, str]) -> str:
+        """Genera el HTML para los datos de usuario indicados."""
+        self._calls += 1
+
+        # Con un único destinatario no compensa preparar el esqueleto
+        if self.enabled and self._parts is None and self._calls > 1:
+            self._build_skeleton()
+
+        html = None
+        if self.enabled and self._parts is not None:
+            html = self._substitute(user)
+            if html is not None and self._verified:
+                return html
+
+        context = dict(self.context)
+        context[PERSONAL_KEY] = user
+        full = self.render_full(self.analysis.template_name, context)
+
+        if html is not None:
+            self._verified = html == full
+            self.enabled = self._verified
+        return full
+
+
+def context_hash(context: dict) -> str:
+    """Hash canónico de los datos de una plantilla (independiente del orden de claves)."""
+    canonical = json.dumps(context, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """
+    Caché acotada de HTML ya renderizado e inlineado para envíos no
+    personalizados. La clave combina el nombre de la plantilla, un hash de
+    su contenido (incluidas las plantillas que extiende) y un hash canónico
+    de los datos, con expulsión por tamaño (LRU) y por antigüedad (TTL).
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 300):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, template_name: str, template_hash: str, context: dict) -> tuple:
+        return (template_name, template_hash, context_hash(context))
+
+    def get(self, key: tuple) -> Optional[str]:
+        with self._lock:
+            html = self._cache.get(key)
+            if html is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return html
+
+    def set(self, key: tuple, html: str) -> None:
+        with self._lock:
+            self._cache[key] = html
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._cache),
+                "maxsize": self._cache.maxsize,
+                "ttl": self._cache.ttl,
+                "hits": self.hits,
+                "misses": self.misses
+            }
@@ -0,0 +1,132 @@
+import asyncio
+import threading
+from typing import List, Optional
+
+import httpx
+import resend
+from resend.exceptions import ResendError, raise_for_code_and_type
+
+from rate_limit import parse_retry_after
+
+
+def _client_options(api_key: str, max_connections: int, timeout: float) -> dict:
+    return {
+        "base_url": resend.api_url,
+        "headers": {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "User-Agent": f"resend-python:{resend.__version__}"
+        },
+        "limits": httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections
+        ),
+        "timeout": timeout
+    }
+
+
+def _parse_response(response: httpx.Response) -> dict:
+    """Mismo tratamiento de la respuesta que resend.request.Request."""
+    if "application/json" not in response.headers.get("content-type", ""):
+        raise_for_code_and_type(
+            code=500,
+            message="Failed to parse Resend API response. Please try again.",
+            error_type="InternalServerError"
+        )
+    data = response.json()
+    if response.status_code != 200 and data.get("statusCode"):
+        try:
+            raise_for_code_and_type(
+                code=data.get("statusCode"),
+                message=data.get("message"),
+                error_type=data.get("name")
+            )
+        except ResendError as e:
+            # A diferencia del SDK, se conserva la espera que pide el proveedor
+            e.retry_after = parse_retry_after(response.headers.get("retry-after"))
+            raise
+    return data
+
+
+class ResendClient:
+    """
+    Cliente síncrono de la API de Resend con su propia API key (sin usar la
+    variable global del SDK) y conexiones keep-alive reutilizables. Se puede
+    usar desde varios hilos a la vez.
+    """
+
+    def __init__(self, api_key: str, max_connections: int = 10, timeout: float = 30):
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._client: Optional[httpx.Client] = None
+        self._lock = threading.Lock()
+
+    def _get_client(self) -> httpx.Client:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(
+                        **_client_options(self.api_key, self.max_connections, self.timeout)
+                    )
+        return self._client
+
+    def send(self, params: dict) -> dict:
+        """Equivalente a resend.Emails.send."""
+        return _parse_response(self._get_client().post("/emails", json=params))
+
+    def send_batch(self, params: List[dict]) -> dict:
+        """Equivalente a resend.Batch.send (hasta 100 mensajes)."""
+        return _parse_response(self._get_client().post("/emails/batch", json=params))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+class AsyncResendClient:
+    """
+    Cliente asíncrono de la API de Resend sobre un pool de conexiones
+    keep-alive de httpx.
+
+    Como mucho hay `max_concurrency` peticiones en vuelo; el resto espera su
+    turno sin bloquear el event loop. Los errores se lanzan con las mismas
+    excepciones que el SDK síncrono.
+    """
+
+    def __init__(self, api_key: str, max_concurrency: int = 100, timeout: float = 30):
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                **_client_options(self.api_key, self.max_concurrency, self.timeout)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def _post(self, path: str, payload) -> dict:
+        client = self._get_client()
+        async with self._semaphore:
+            response = await client.post(path, json=payload)
+        return _parse_response(response)
+
+    async def send(self, params: dict) -> dict:
+        """Equivalente asíncrono de resend.Emails.send."""
+        return await self._post("/emails", params)
+
+    async def send_batch(self, params: List[dict]) -> dict:
+        """Equivalente asíncrono de resend.Batch.send (hasta 100 mensajes)."""
+        return await self._post("/emails/batch", params)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
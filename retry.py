@@ -0,0 +1,146 @@
+import heapq
+import itertools
+import random
+import smtplib
+import time
+from typing import Callable, Optional
+
+import httpx
+import requests
+
+from rate_limit import is_rate_limited
+
+# Clasificación de los errores de envío
+RATE_LIMITED = "rate_limited"
+RETRYABLE = "retryable"
+PERMANENT = "permanent"
+
+# Códigos HTTP que indican un fallo transitorio del proveedor
+_RETRYABLE_STATUS = {408, 409, 425}
+
+# Códigos HTTP con los que el proveedor rechaza el contenido de un mensaje
+_MESSAGE_ERROR_STATUS = {400, 422}
+
+# Errores de red o de tiempo de espera de los clientes HTTP
+_TRANSIENT_ERRORS = (
+    httpx.TimeoutException,
+    httpx.TransportError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ConnectionError,
+    TimeoutError,
+    ConnectionError
+)
+
+
+def _classify_smtp(error: smtplib.SMTPException) -> str:
+    """Las respuestas 4xx de SMTP y las desconexiones son transitorias; las 5xx, permanentes."""
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return RETRYABLE
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+    else:
+        codes = [getattr(error, "smtp_code", None)]
+    if any(isinstance(code, int) and 400 <= code < 500 for code in codes):
+        return RETRYABLE
+    return PERMANENT
+
+
+def classify(error: Exception) -> str:
+    """
+    Clasifica un error de envío: límite de peticiones (429), transitorio
+    (timeouts, errores de red, 5xx) o permanente (validación y demás 4xx).
+    Los errores de SMTP se clasifican por su código de respuesta.
+    """
+    if is_rate_limited(error):
+        return RATE_LIMITED
+    if isinstance(error, smtplib.SMTPException):
+        return _classify_smtp(error)
+    if isinstance(error, _TRANSIENT_ERRORS):
+        return RETRYABLE
+    try:
+        status = int(getattr(error, "code", None))
+    except (TypeError, ValueError):
+        return PERMANENT
+    if status >= 500 or status in _RETRYABLE_STATUS:
+        return RETRYABLE
+    return PERMANENT
+
+
+def is_message_error(error: Exception) -> bool:
+    """
+    Indica si el proveedor rechazó la petición por el contenido de los
+    mensajes (400, 422), es decir, si otros mensajes podrían enviarse. Los
+    demás errores permanentes, como los de autenticación (401, 403) o de
+    dominio y remitente, afectan por igual a todos los mensajes.
+    """
+    try:
+        return int(getattr(error, "code", None)) in _MESSAGE_ERROR_STATUS
+    except (TypeError, ValueError):
+        return False
+
+
+class RetryPolicy:
+    """
+    Política de reintentos: como mucho `max_attempts` intentos por petición,
+    con espera exponencial y jitter completo (un valor aleatorio entre 0 y
+    base_delay * 2^(intento - 1), acotado por max_delay). Tras un 429 se
+    espera lo que indique Retry-After, si viene, y si pide esperar más de
+    max_delay no se reintenta: reintentar antes solo traería otro 429.
+    """
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 30.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, error: Exception, attempt: int) -> bool:
+        if attempt >= self.max_attempts or classify(error) == PERMANENT:
+            return False
+        retry_after = getattr(error, "retry_after", None)
+        return retry_after is None or retry_after <= self.max_delay
+
+    def delay(self, error: Exception, attempt: int) -> float:
+        """Segundos de espera antes del intento `attempt + 1`."""
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class RetryQueue:
+    """
+    Reintentos pendientes de un envío síncrono, ordenados por el instante en
+    que vencen. El envío sigue con los demás destinatarios y ejecuta los
+    reintentos vencidos entre un bloque y el siguiente.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def schedule(self, delay: float, callback: Callable, *args) -> None:
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), callback, args))
+
+    def next_due(self) -> Optional[float]:
+        return self._heap[0][0] if self._heap else None
+
+    def run_due(self) -> None:
+        """Ejecuta los reintentos vencidos (que pueden programar otros nuevos)."""
+        while self._heap and self._heap[0][0] <= time.monotonic():
+            _, _, callback, args = heapq.heappop(self._heap)
+            callback(*args)
+
+    def run_next(self) -> None:
+        """Espera a que venza el siguiente reintento y ejecuta los vencidos."""
+        wait = self._heap[0][0] - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self.run_due()
+
+    def drain(self) -> None:
+        """Espera y ejecuta todos los reintentos pendientes."""
+        while self._heap:
+            self.run_next()
@@ -1,24 +1,80 @@
+import asyncio
+import time
+from collections import deque
+from collections.abc import Sized
+from itertools import islice, repeat, tee
 from pathlib import Path
-from typing import List, Optional, Union, Dict, Any
-import resend
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Optional, Set, Tuple, Union, Dict, Any
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, select_autoescape
 from models import EmailAddress
 from emails.base import BaseEmail
-from premailer import Premailer  # Nuevo import
+from inliner import StyleInliner
+from payload import PayloadOptimizer
+from rendering import PersonalizedRenderer, RenderCache, TemplateAnalyzer
+from precompile import PrecompiledLoader
+from render_pool import RenderPool
+from rate_limit import BULK, DEFAULT_LANE, RateLimiter, is_rate_limited
+from retry import PERMANENT, RetryPolicy, RetryQueue, classify, is_message_error
+from suppression import SuppressionList, normalize_email
+from template_watcher import TemplateWatcher
+from transports import ResendTransport, Transport
+
+# Máximo de mensajes que Resend acepta en una llamada a la API de lotes
+BATCH_SIZE = 100
+
+# Máximo de mensajes enviados en iter_batch cuyo resultado aún no se ha entregado
+BATCH_LOOKAHEAD = 10 * BATCH_SIZE
 
 class EmailService:
-    """Servicio para envío de emails utilizando Resend."""
+    """Servicio para envío de emails utilizando Resend (u otro transporte)."""
     def __init__(
         self,
-        api_key: str,
+        api_key: Optional[str],
         default_from: EmailAddress,
         templates_dir: Optional[str] = None,
-        testing: bool = False
+        testing: bool = False,
+        inline_once: bool = True,
+        bytecode_cache_dir: Optional[str] = None,
+        compiled_templates: Optional[str] = None,
+        render_cache_size: int = 256,
+        render_cache_ttl: float = 300,
+        render_workers: int = 0,
+        render_pool_threshold: int = 1000,
+        optimize_payload: bool = False,
+        watch_templates: bool = False,
+        send_concurrency: int = 100,
+        send_rate: float = 2,
+        send_burst: int = 2,
+        lane_weights: Optional[Dict[str, float]] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        transport: Optional[Transport] = None,
+        suppression_list: Optional[SuppressionList] = None
     ):
         self.api_key = api_key
-        resend.api_key = api_key
         self.default_from = default_from
         self.testing = testing
+        self.inline_once = inline_once
+        
+        # Transporte de los mensajes; por defecto la API de Resend con
+        # conexiones reutilizables (como mucho send_concurrency peticiones a la vez)
+        self.send_concurrency = send_concurrency
+        self.transport = transport or ResendTransport(api_key, send_concurrency)
+        
+        # Límite de peticiones por segundo al proveedor, compartido por todos los
+        # envíos y repartido entre carriles: los lotes van por el masivo y los
+        # emails sueltos por el de su prioridad (BaseEmail.priority)
+        self.rate_limiter = RateLimiter(send_rate, send_burst, weights=lane_weights)
+        
+        # Reintentos de los errores transitorios (timeouts, 5xx, 429)
+        self.retry_policy = retry_policy or RetryPolicy()
+        
+        # Direcciones a las que no se envía en los lotes (rebotes, bajas)
+        self.suppression_list = suppression_list
+        
+        # Caché de renderizados no personalizados (render_cache_size=0 la desactiva)
+        self.render_cache = None
+        if render_cache_size > 0:
+            self.render_cache = RenderCache(render_cache_size, render_cache_ttl)
         
         # Configurar directorio de templates
         if templates_dir is None:
@@ -30,31 +86,207 @@ class EmailService:
             raise ValueError(f"El directorio de templates no existe: {templates_dir}")
             
         self.templates_dir = templates_dir  # Guardar para referencia
+        
+        # Plantillas precompiladas con `python precompile.py` (zip o directorio)
+        loader = FileSystemLoader(templates_dir)
+        if compiled_templates is not None:
+            loader = PrecompiledLoader(compiled_templates, loader)
+        
+        # Caché persistente del bytecode compilado, compartida entre procesos
+        bytecode_cache = None
+        if bytecode_cache_dir is not None:
+            Path(bytecode_cache_dir).mkdir(parents=True, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(str(bytecode_cache_dir))
+        
+        # Con watch_templates Jinja no consulta los ficheros en cada get_template:
+        # las plantillas se invalidan solo cuando el watcher detecta un cambio
         self.template_env = Environment(
-            loader=FileSystemLoader(templates_dir),
+            loader=loader,
+            bytecode_cache=bytecode_cache,
             autoescape=select_autoescape(['html', 'xml']),
             trim_blocks=True,
-            lstrip_blocks=True
+            lstrip_blocks=True,
+            auto_reload=not watch_templates
         )
+        
+        # Análisis de qué regiones de cada plantilla dependen del destinatario
+        # (con plantillas precompiladas, el guardado en el paquete compilado)
+        self.analyzer = TemplateAnalyzer(
+            self.template_env,
+            loader.analysis if isinstance(loader, PrecompiledLoader) else None
+        )
+        self.inliner = StyleInliner()
+        
+        # Minificación opcional del HTML final (ver payload_stats())
+        self.optimizer = PayloadOptimizer(self.inliner) if optimize_payload else None
+        
+        # Pool de procesos para lotes grandes (render_workers=0 renderiza en este proceso)
+        self.render_pool = None
+        self.render_pool_threshold = render_pool_threshold
+        if render_workers > 0:
+            self.render_pool = RenderPool(render_workers, {
+                "templates_dir": str(templates_dir),
+                "inline_once": inline_once,
+                "bytecode_cache_dir": bytecode_cache_dir,
+                "compiled_templates": compiled_templates,
+                "render_cache_size": 0,
+                "optimize_payload": optimize_payload
+            })
+        
+        # Vigilancia del directorio de plantillas (ver invalidate_templates)
+        self.template_listeners: List[Callable[[Optional[Set[str]]], None]] = []
+        self.watcher = None
+        if watch_templates:
+            self.watcher = TemplateWatcher(str(templates_dir), self.invalidate_templates).start()
+    
+    def close(self) -> None:
+        """Libera el transporte, los procesos de renderizado y el watcher de plantillas."""
+        self.transport.close()
+        if self.render_pool is not None:
+            self.render_pool.close()
+        if self.watcher is not None:
+            self.watcher.stop()
+    
+    async def aclose(self) -> None:
+        """Cierra las conexiones asíncronas del transporte y libera el resto de recursos."""
+        await self.transport.aclose()
+        self.close()
+    
+    def add_template_listener(self, listener: Callable[[Optional[Set[str]]], None]) -> None:
+        """Registra una función que se llama cada vez que se invalidan las plantillas."""
+        self.template_listeners.append(listener)
+    
+    def invalidate_templates(self, names: Optional[Set[str]] = None) -> None:
+        """
+        Descarta las plantillas compiladas, su análisis y los renderizados en
+        caché. `names` son las plantillas modificadas (None si se desconocen);
+        como una plantilla puede extender a otra, se invalida todo.
+        """
+        if names and isinstance(self.template_env.loader, PrecompiledLoader):
+            self.template_env.loader.mark_stale(names)
+        if self.template_env.cache is not None:
+            self.template_env.cache.clear()
+        self.analyzer.clear()
+        if self.render_cache is not None:
+            self.render_cache.clear()
+        
+        for listener in list(self.template_listeners):
+            try:
+                listener(names)
+            except Exception as e:
+                print(f"Error al notificar la invalidación de plantillas: {str(e)}")
+    
+    def warm_up(self) -> List[str]:
+        """
+        Compila (o carga, si están precompiladas) todas las plantillas HTML
+        del directorio de templates para que queden en la caché del entorno
+        de Jinja antes del primer envío, junto con su análisis.
+        """
+        compiled = []
+        for template_name in self.template_env.list_templates(extensions=['html']):
+            self.template_env.get_template(template_name)
+            self.analyzer.analyze(template_name)
+            compiled.append(template_name)
+        return compiled
     
     def _render_with_inline_styles(self, template_name, context):
         """Renderiza una plantilla y convierte sus estilos a inline."""
         template = self.template_env.get_template(template_name)
-        html = template.render(**context)
-        
-        # Usar premailer para convertir estilos a inline
+        return self._inline_styles(template.render(**context))
+    
+    def _inline_styles(self, html):
+        """Convierte a inline los estilos de un HTML ya renderizado."""
+        # Inliner con las hojas de estilo ya compiladas (equivalente a premailer)
         try:
-            premailer = Premailer(
-                html,
-                keep_style_tags=True,
-                remove_classes=False,
-                strip_important=False
-            )
-            return premailer.transform()
+            html = self.inliner.inline(html)
         except Exception as e:
             print(f"Error al convertir estilos a inline: {str(e)}")
             # Fallback al HTML original si hay error
             return html
+        return self._optimize(html)
+    
+    def _optimize(self, html):
+        if self.optimizer is None:
+            return html
+        try:
+            return self.optimizer.optimize(html)
+        except Exception as e:
+            print(f"Error al optimizar el HTML: {str(e)}")
+            return html
+    
+    def payload_stats(self) -> Optional[dict]:
+        """
+        Bytes de los mensajes preparados antes y después de la optimización
+        del HTML, si está activa, por cualquier camino: renderizado completo,
+        caché, sustitución en el esqueleto o pool de procesos.
+        """
+        if self.optimizer is None:
+            return None
+        return self.optimizer.stats()
+    
+    def _count_payload(self, html, renderer: Optional[PersonalizedRenderer] = None):
+        """Suma a payload_stats() un mensaje con este HTML. Retorna el HTML."""
+        if self.optimizer is not None:
+            saved = getattr(html, "saved", None)
+            if saved is None and renderer is not None:
+                # Sustituido en el esqueleto: el texto de las regiones no se
+                # optimiza, así que se ahorra lo mismo que en el esqueleto
+                saved = getattr(renderer.skeleton, "saved", None)
+            self.optimizer.count(html, saved or 0)
+        return html
+    
+    def _render_cached(self, template_name, context):
+        """Como _render_with_inline_styles, reutilizando renderizados idénticos."""
+        if self.render_cache is None:
+            return self._render_with_inline_styles(template_name, context)
+        
+        key = self.render_cache.key(
+            template_name,
+            self.analyzer.analyze(template_name).digest,
+            context
+        )
+        html = self.render_cache.get(key)
+        if html is None:
+            html = self._render_with_inline_styles(template_name, context)
+            self.render_cache.set(key, html)
+        return html
+    
+    def _personalized_renderer(self, template_name, context):
+        """
+        Prepara el renderizado por destinatario. Con inline_once las regiones
+        compartidas de la plantilla se renderizan e inlinean una sola vez y
+        solo las regiones que dependen del usuario se renderizan por destinatario.
+        """
+        return PersonalizedRenderer(
+            self._render_with_inline_styles,
+            self._inline_styles,
+            self.analyzer.analyze(template_name),
+            context,
+            enabled=self.inline_once
+        )
+    
+    def _render_batch(self, template_name, context, users, count: Optional[int] = None):
+        """
+        Renderiza el HTML de cada usuario de un lote, en orden y a medida que
+        se consume. Los lotes grandes (o de tamaño desconocido, `count` None)
+        se reparten entre los procesos del pool si está configurado y cada
+        destinatario necesita el renderizado completo de la plantilla.
+        """
+        renderer = self._personalized_renderer(template_name, context)
+        
+        # Con inline_once cada destinatario solo renderiza sus regiones, que
+        # se sustituyen en el esqueleto: en este proceso es varias veces más
+        # rápido que enviar los datos y el HTML al pool y de vuelta
+        # (python -m benchmarks.render_pool)
+        substitutes = renderer.enabled and renderer.analysis.skeleton is not None
+        if (
+            self.render_pool is not None
+            and not substitutes
+            and (count is None or count >= self.render_pool_threshold)
+        ):
+            return (self._count_payload(html) for html in self.render_pool.render(template_name, context, users))
+        
+        return (self._count_payload(renderer.render(user), renderer) for user in users)
     
     def send(
         self,
@@ -67,7 +299,7 @@ class EmailService:
         personalize: bool = False
     ) -> Union[dict, List[dict]]:
         """
-        Envía un email utilizando Resend.
+        Envía un email con el transporte configurado (Resend por defecto).
         
         Args:
             email: Instancia de BaseEmail con los datos del email
@@ -79,8 +311,64 @@ class EmailService:
             personalize: Si es True, se generará un email personalizado para cada destinatario
             
         Returns:
-            dict o List[dict]: Respuesta(s) de la API de Resend
+            dict o List[dict]: Respuesta(s) del transporte
         """
+        messages = self._prepare_send(email, to, subject, from_email, cc, bcc, personalize)
+        
+        if self.testing:
+            return messages if personalize else messages[0]
+        
+        # Si no se requiere personalización, enviar email tradicional
+        if not personalize:
+            return self._deliver_retrying(self.transport.send, messages[0], email.priority)
+        
+        # Si se requiere personalización, enviar emails separados a cada destinatario;
+        # los reintentos se programan sin detener el envío a los demás
+        results = {}
+        retries = RetryQueue()
+        for index, params in enumerate(messages):
+            self._send_retrying(params, results, index, retries, email.priority)
+            retries.run_due()
+        retries.drain()
+        
+        # Como send_async, si algún envío falla tras los reintentos se lanza su error
+        for index in range(len(messages)):
+            if isinstance(results[index], Exception):
+                raise results[index]
+        return [results[index] for index in range(len(messages))]
+    
+    async def send_async(
+        self,
+        email: BaseEmail,
+        to: Union[EmailAddress, List[EmailAddress]],
+        subject: str,
+        from_email: Optional[EmailAddress] = None,
+        cc: Optional[List[EmailAddress]] = None,
+        bcc: Optional[List[EmailAddress]] = None,
+        personalize: bool = False
+    ) -> Union[dict, List[dict]]:
+        """
+        Como send, sin bloquear el event loop: el renderizado se hace en un
+        hilo y los envíos se hacen con la variante asíncrona del transporte.
+        """
+        messages = await asyncio.to_thread(
+            self._prepare_send, email, to, subject, from_email, cc, bcc, personalize
+        )
+        
+        if self.testing:
+            return messages if personalize else messages[0]
+        
+        if not personalize:
+            result, _ = await self._deliver_retrying_async(self.transport.send_async, messages[0], email.priority)
+            return result
+        
+        sent = await asyncio.gather(
+            *(self._deliver_retrying_async(self.transport.send_async, params, email.priority) for params in messages)
+        )
+        return [result for result, _ in sent]
+    
+    def _prepare_send(self, email, to, subject, from_email, cc, bcc, personalize) -> List[dict]:
+        """Renderiza los mensajes de send: uno solo o uno por destinatario."""
         email.validate()
         
         if not from_email:
@@ -90,13 +378,13 @@ class EmailService:
         if not isinstance(to, list):
             to = [to]
             
-        # Si no se requiere personalización, enviar email tradicional
+        # Si no se requiere personalización, un único email para todos
         if not personalize:
             # Usar la nueva función que incluye estilos inline
-            html_content = self._render_with_inline_styles(
+            html_content = self._count_payload(self._render_cached(
                 email.template_name, 
                 email.get_template_data()
-            )
+            ))
             
             params = {
                 "from": str(from_email),
@@ -110,47 +398,36 @@ class EmailService:
             if bcc:
                 params["bcc"] = [str(addr) for addr in bcc]
                 
-            if self.testing:
-                return params
-                
-            return resend.Emails.send(params)
+            return [params]
             
-        # Si se requiere personalización, enviar emails separados a cada destinatario
-        results = []
+        messages = []
+        
+        # Los datos compartidos se calculan una vez para todos los destinatarios
+        template_data = email.get_template_data()
+        renderer = self._personalized_renderer(email.template_name, template_data)
         
         for recipient in to:
-            # Modificar los datos de la plantilla para este destinatario
-            template_data = email.get_template_data()
-            
             # Actualizar el usuario en los datos de la plantilla con este destinatario
             if 'user' in template_data:
-                template_data['user'] = {
+                html_content = self._count_payload(renderer.render({
                     'name': recipient.name or template_data['user'].get('name', 'Usuario'),
                     'email': recipient.email
-                }
-                
-            # Renderizar con estilos inline
-            html_content = self._render_with_inline_styles(
-                email.template_name,
-                template_data
-            )
+                }), renderer)
+            else:
+                html_content = self._count_payload(self._render_cached(
+                    email.template_name,
+                    template_data
+                ))
             
             # Preparar los parámetros para esta persona
-            params = {
+            messages.append({
                 "from": str(from_email),
                 "to": str(recipient),
                 "subject": subject,
                 "html": html_content
-            }
-            
-            # Enviar el email personalizado
-            if self.testing:
-                results.append(params)
-            else:
-                result = resend.Emails.send(params)
-                results.append(result)
+            })
                 
-        return results
+        return messages
     
     def send_batch(
         self,
@@ -161,6 +438,213 @@ class EmailService:
     ) -> List[dict]:
         """
         Envía emails personalizados a múltiples destinatarios en un lote.
+        Las direcciones repetidas y las de la lista de supresión no se
+        renderizan ni se envían (ver filter_recipients). Para lotes grandes
+        conviene iter_batch o send_batch_summary, que no guardan todos los
+        resultados.
+        """
+        return list(self.iter_batch(email, recipients, subject, from_email))
+    
+    def send_batch_summary(
+        self,
+        email: BaseEmail,
+        recipients: Iterable[Dict[str, Any]],
+        subject: str,
+        from_email: Optional[EmailAddress] = None
+    ) -> Dict[str, int]:
+        """Como send_batch, pero solo retorna los contadores (ver count_results)."""
+        return self.count_results(self.iter_batch(email, recipients, subject, from_email))
+    
+    def iter_batch(
+        self,
+        email: BaseEmail,
+        recipients: Iterable[Dict[str, Any]],
+        subject: str,
+        from_email: Optional[EmailAddress] = None
+    ) -> Iterator[dict]:
+        """
+        Como send_batch, pero retorna los resultados de uno en uno, en el
+        orden del lote, a medida que se conocen. Los destinatarios se leen y
+        cada mensaje se renderiza justo antes de enviarse, y como mucho hay
+        BATCH_LOOKAHEAD mensajes enviados cuyo resultado no se ha entregado
+        aún (p. ej. porque otro anterior espera un reintento). La memoria
+        solo crece con el conjunto de direcciones ya vistas para descartar
+        las repetidas (ver _screen). El lote se valida al llamar.
+        """
+        order = deque()
+        messages = self._prepare_batch(email, recipients, subject, from_email, order)
+        return self._iter_results(messages, order)
+    
+    async def send_batch_async(
+        self,
+        email: BaseEmail,
+        recipients: List[Dict[str, Any]],
+        subject: str,
+        from_email: Optional[EmailAddress] = None
+    ) -> List[dict]:
+        """
+        Como send_batch, sin bloquear el event loop. Cada bloque se renderiza
+        en un hilo mientras los anteriores se envían; como mucho hay
+        send_concurrency bloques renderizados pendientes de envío.
+        """
+        results = await self.iter_batch_async(email, recipients, subject, from_email)
+        return [result async for result in results]
+    
+    async def iter_batch_async(
+        self,
+        email: BaseEmail,
+        recipients: Iterable[Dict[str, Any]],
+        subject: str,
+        from_email: Optional[EmailAddress] = None
+    ) -> AsyncIterator[dict]:
+        """
+        Como iter_batch, sin bloquear el event loop (ver send_batch_async).
+        Valida el lote y retorna el iterador asíncrono de resultados.
+        """
+        order = deque()
+        messages = await asyncio.to_thread(self._prepare_batch, email, recipients, subject, from_email, order)
+        return self._iter_results_async(messages, order)
+    
+    @staticmethod
+    def count_results(results: Iterable[dict]) -> Dict[str, int]:
+        """Cuenta los resultados de un lote: enviados, fallidos y omitidos por motivo."""
+        counts = {"total": 0, "sent": 0, "failed": 0, "duplicate": 0, "suppressed": 0}
+        for result in results:
+            counts["total"] += 1
+            if "error" in result:
+                counts["failed"] += 1
+            elif "skipped" in result:
+                counts[result["skipped"]] += 1
+            else:
+                counts["sent"] += 1
+        return counts
+    
+    def _iter_results(self, messages: Iterator[tuple], order: deque) -> Iterator[dict]:
+        """
+        Envía los mensajes por bloques y entrega los resultados en el orden
+        del lote. `order` tiene, por destinatario ya leído, el resultado de
+        los omitidos o None para los que se envían.
+        """
+        results: Dict[int, dict] = {}
+        retries = RetryQueue()
+        sent = 0
+        delivered = 0
+        exhausted = False
+        while True:
+            # Entregar todo lo que ya se conoce, sin saltarse ningún pendiente
+            while order and (order[0] is not None or delivered in results):
+                skipped = order.popleft()
+                if skipped is None:
+                    skipped = results.pop(delivered)
+                    delivered += 1
+                yield skipped
+            
+            if not exhausted and sent - delivered < BATCH_LOOKAHEAD:
+                # Enviar en llamadas de hasta BATCH_SIZE mensajes a medida que se renderizan
+                chunk = list(islice(messages, BATCH_SIZE))
+                if chunk:
+                    if self.testing:
+                        results.update(enumerate((params for _, params in chunk), sent))
+                    else:
+                        self._send_chunk(chunk, results, sent, retries)
+                    sent += len(chunk)
+                    # Los reintentos vencidos se intercalan con los bloques nuevos
+                    retries.run_due()
+                    continue
+                # Leer el último bloque puede haber anotado más omitidos
+                exhausted = True
+                continue
+            
+            if not order:
+                return
+            # El siguiente resultado depende de un reintento pendiente
+            retries.run_next()
+    
+    async def _iter_results_async(self, messages: Iterator[tuple], order: deque) -> AsyncIterator[dict]:
+        """Como _iter_results, con como mucho send_concurrency bloques enviándose a la vez."""
+        pending = deque()
+        ready = deque()
+        exhausted = False
+        try:
+            while True:
+                while order and (order[0] is not None or ready):
+                    skipped = order.popleft()
+                    yield skipped if skipped is not None else ready.popleft()
+                
+                if not exhausted and len(pending) < self.send_concurrency:
+                    chunk = await asyncio.to_thread(list, islice(messages, BATCH_SIZE))
+                    if chunk:
+                        if self.testing:
+                            ready.extend(params for _, params in chunk)
+                        else:
+                            pending.append(asyncio.create_task(self._send_chunk_async(chunk)))
+                        continue
+                    exhausted = True
+                    continue
+                
+                if not pending:
+                    return
+                ready.extend(await pending.popleft())
+        finally:
+            # Si se deja de consumir a mitad, no se envía nada más
+            for task in pending:
+                task.cancel()
+    
+    def filter_recipients(self, recipients: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Tuple[int, dict]]]:
+        """
+        Descarta, en una sola pasada, las direcciones repetidas (sin
+        distinguir mayúsculas ni espacios) y las de la lista de supresión.
+        Retorna los destinatarios que se envían y, con su posición en el
+        lote, el resultado de cada descartado.
+        """
+        accepted = []
+        skipped = []
+        for position, (recipient, result) in enumerate(self._screen(recipients)):
+            if result is None:
+                accepted.append(recipient)
+            else:
+                skipped.append((position, result))
+        return accepted, skipped
+    
+    def _screen(self, recipients: Iterable[Dict[str, Any]]) -> Iterator[Tuple[Dict[str, Any], Optional[dict]]]:
+        """
+        Recorre los destinatarios con email (igual que _prepare_batch, los
+        demás no cuentan) y retorna cada uno con el resultado de omitirlo, o
+        None si se envía.
+        
+        Las direcciones ya vistas se guardan en memoria hasta el final del
+        lote: unos 115 bytes por destinatario (11 MB por cada 100.000). Las
+        listas sin tamaño acotado deben subirse a /batch/stream, que
+        deduplica en el outbox de SQLite (ver Outbox.append).
+        """
+        if self.suppression_list is not None:
+            self.suppression_list.refresh()
+        
+        seen = set()
+        for recipient in recipients:
+            if 'email' not in recipient:
+                continue
+            address = normalize_email(recipient['email'])
+            if address in seen:
+                yield recipient, {"email": recipient['email'], "skipped": "duplicate"}
+            elif self.suppression_list is not None and address in self.suppression_list:
+                yield recipient, {"email": recipient['email'], "skipped": "suppressed"}
+            else:
+                seen.add(address)
+                yield recipient, None
+    
+    def _screen_into(self, recipients: Iterable[Dict[str, Any]], order: deque) -> Iterator[Dict[str, Any]]:
+        """Como _screen, anotando cada destinatario en `order` y retornando solo los que se envían."""
+        for recipient, skipped in self._screen(recipients):
+            order.append(skipped)
+            if skipped is None:
+                yield recipient
+    
+    def _prepare_batch(self, email, recipients, subject, from_email, order: deque) -> Iterator[tuple]:
+        """
+        Valida el lote y retorna un iterador de (destinatario, parámetros) que
+        lee los destinatarios y renderiza cada mensaje a medida que se consume.
+        Los omitidos no se renderizan; se anotan en `order` (ver _screen_into).
         """
         email.validate()
         
@@ -171,57 +655,254 @@ class EmailService:
         if not recipients:
             raise ValueError("No se proporcionaron destinatarios")
         
-        # Enviar emails personalizados a cada destinatario
-        results = []
+        # Los datos compartidos se calculan una vez para todo el lote
+        template_data = email.get_template_data()
+        personalized = 'user' in template_data
+        count = len(recipients) if isinstance(recipients, Sized) else None
         
-        for recipient_data in recipients:
-            # Validar que el destinatario tenga email
-            if 'email' not in recipient_data:
-                continue
+        def read_recipients():
+            # Solo los destinatarios con email que no se omiten
+            for recipient_data in self._screen_into(recipients, order):
+                # Crear objeto EmailAddress para este destinatario
+                recipient = EmailAddress(
+                    email=recipient_data['email'],
+                    name=recipient_data.get('name', '')
+                )
                 
-            # Crear objeto EmailAddress para este destinatario
-            recipient = EmailAddress(
-                email=recipient_data['email'],
-                name=recipient_data.get('name', '')
-            )
-            
-            # Obtener los datos base de la plantilla
-            template_data = email.get_template_data()
-            
-            # Crear una copia de los datos de usuario para no modificar el original
-            if 'user' in template_data:
-                # Crear una copia del usuario
-                user_data = dict(template_data['user'])
-                # Actualizar con los datos de este destinatario
-                user_data['name'] = recipient.name or user_data.get('name', 'Usuario')
-                user_data['email'] = recipient.email
-                # Reemplazar en los datos de la plantilla
-                template_data['user'] = user_data
-            
-            # Renderizar con estilos inline
-            html_content = self._render_with_inline_styles(
-                email.template_name, 
-                template_data
+                # Crear una copia de los datos de usuario para no modificar el original
+                user_data = None
+                if personalized:
+                    # Crear una copia del usuario
+                    user_data = dict(template_data['user'])
+                    # Actualizar con los datos de este destinatario
+                    user_data['name'] = recipient.name or user_data.get('name', 'Usuario')
+                    user_data['email'] = recipient.email
+                yield recipient, user_data
+        
+        batch = read_recipients()
+        
+        # Renderizar con estilos inline
+        if personalized:
+            # tee solo guarda los destinatarios que el renderizado lleva de adelanto
+            batch, users = tee(batch)
+            htmls = self._render_batch(
+                email.template_name,
+                template_data,
+                (user_data for _, user_data in users),
+                count
             )
-            
-            # Preparar los parámetros para esta persona
-            params = {
+        else:
+            html = self._render_cached(email.template_name, template_data)
+            htmls = (self._count_payload(html) for _ in repeat(None))
+        
+        # Preparar los parámetros de cada persona
+        return (
+            (recipient, {
                 "from": str(from_email),
                 "to": str(recipient),
                 "subject": subject,
                 "html": html_content
-            }
-            
-            # Enviar el email personalizado
-            if self.testing:
-                results.append(params)
+            })
+            for (recipient, _), html_content in zip(batch, htmls)
+        )
+    
+    def _deliver(self, call, payload, lane: str = DEFAULT_LANE):
+        """
+        Hace una petición al proveedor respetando el límite de peticiones del
+        carril `lane`. Un 429 detiene el limitador el tiempo que indique el
+        proveedor.
+        """
+        self.rate_limiter.acquire(lane)
+        try:
+            result = call(payload)
+        except Exception as e:
+            if is_rate_limited(e):
+                self.rate_limiter.throttle(getattr(e, "retry_after", None))
+            raise
+        self.rate_limiter.success()
+        return result
+    
+    async def _deliver_async(self, call, payload, lane: str = DEFAULT_LANE):
+        """Como _deliver, para las llamadas asíncronas del transporte."""
+        await self.rate_limiter.acquire_async(lane)
+        try:
+            result = await call(payload)
+        except Exception as e:
+            if is_rate_limited(e):
+                self.rate_limiter.throttle(getattr(e, "retry_after", None))
+            raise
+        self.rate_limiter.success()
+        return result
+    
+    def _deliver_retrying(self, call, payload, lane: str = DEFAULT_LANE):
+        """Como _deliver, reintentando los errores transitorios según retry_policy."""
+        attempt = 1
+        while True:
+            try:
+                return self._deliver(call, payload, lane)
+            except Exception as e:
+                if not self.retry_policy.should_retry(e, attempt):
+                    raise
+                time.sleep(self.retry_policy.delay(e, attempt))
+                attempt += 1
+    
+    def _send_retrying(
+        self,
+        params: dict,
+        results: Dict[int, Any],
+        index: int,
+        retries: RetryQueue,
+        lane: str,
+        attempt: int = 1
+    ) -> None:
+        """
+        Como _deliver_retrying, programando los reintentos en `retries` en
+        lugar de esperar. Deja en results[index] la respuesta o, si falla
+        tras los reintentos, la excepción.
+        """
+        try:
+            results[index] = self._deliver(self.transport.send, params, lane)
+        except Exception as e:
+            if self.retry_policy.should_retry(e, attempt):
+                retries.schedule(
+                    self.retry_policy.delay(e, attempt),
+                    self._send_retrying, params, results, index, retries, lane, attempt + 1
+                )
+                return
+            results[index] = e
+    
+    async def _deliver_retrying_async(self, call, payload, lane: str = DEFAULT_LANE) -> tuple:
+        """
+        Como _deliver_async, reintentando los errores transitorios. Retorna el
+        resultado y el número de intentos; si falla, la excepción lleva el
+        número de intentos en `attempts`.
+        """
+        attempt = 1
+        while True:
+            try:
+                return await self._deliver_async(call, payload, lane), attempt
+            except Exception as e:
+                if not self.retry_policy.should_retry(e, attempt):
+                    e.attempts = attempt
+                    raise
+                # Solo espera esta petición; el resto de envíos sigue su curso
+                await asyncio.sleep(self.retry_policy.delay(e, attempt))
+                attempt += 1
+    
+    def _send_chunk(
+        self,
+        chunk: List[tuple],
+        results: Dict[int, dict],
+        offset: int,
+        retries: RetryQueue,
+        attempt: int = 1
+    ) -> None:
+        """
+        Envía un bloque de mensajes con la API de lotes del transporte y deja
+        los resultados en results[offset], results[offset + 1], etc. Los
+        errores transitorios se reintentan más tarde a través de `retries`. Si
+        el proveedor rechaza el contenido del bloque (400, 422), o el
+        transporte no admite lotes (SMTP), cada mensaje se envía por separado
+        para que un destinatario inválido no impida el envío a los demás; con
+        cualquier otro error (autenticación, dominio, remitente) fallan todos
+        los mensajes del bloque sin más peticiones.
+        """
+        if len(chunk) > 1 and self.transport.supports_batch:
+            try:
+                response = self._deliver(self.transport.send_batch, [params for _, params in chunk], BULK)
+            except Exception as e:
+                if self.retry_policy.should_retry(e, attempt):
+                    retries.schedule(
+                        self.retry_policy.delay(e, attempt),
+                        self._send_chunk, chunk, results, offset, retries, attempt + 1
+                    )
+                    return
+                if not is_message_error(e):
+                    print(f"Error en el envío por lotes tras {attempt} intentos: {str(e)}")
+                    for i, (recipient, _) in enumerate(chunk, offset):
+                        results[i] = self._failure(recipient, e, attempt)
+                    return
+                print(f"Error en el envío por lotes, se envía por separado: {str(e)}")
             else:
-                try:
-                    result = resend.Emails.send(params)
-                    results.append(result)
-                except Exception as e:
-                    # Registrar el error pero continuar con los demás destinatarios
-                    print(f"Error enviando a {recipient.email}: {str(e)}")
-                    results.append({"error": str(e), "email": recipient.email})
-                
-        return results
\ No newline at end of file
+                for i, result in enumerate(self._batch_results(chunk, response, attempt), offset):
+                    results[i] = result
+                return
+        
+        for i, (recipient, params) in enumerate(chunk):
+            self._send_one(recipient, params, results, offset + i, retries)
+    
+    def _send_one(
+        self,
+        recipient: EmailAddress,
+        params: dict,
+        results: Dict[int, dict],
+        index: int,
+        retries: RetryQueue,
+        attempt: int = 1
+    ) -> None:
+        try:
+            result = self._deliver(self.transport.send, params, BULK)
+        except Exception as e:
+            if self.retry_policy.should_retry(e, attempt):
+                retries.schedule(
+                    self.retry_policy.delay(e, attempt),
+                    self._send_one, recipient, params, results, index, retries, attempt + 1
+                )
+                return
+            # Registrar el error pero continuar con los demás destinatarios
+            print(f"Error enviando a {recipient.email}: {str(e)}")
+            results[index] = self._failure(recipient, e, attempt)
+            return
+        results[index] = dict(result, attempts=attempt)
+    
+    async def _send_chunk_async(self, chunk: List[tuple]) -> List[dict]:
+        """Como _send_chunk, con la variante asíncrona del transporte."""
+        if len(chunk) > 1 and self.transport.supports_batch:
+            try:
+                response, attempts = await self._deliver_retrying_async(
+                    self.transport.send_batch_async, [params for _, params in chunk], BULK
+                )
+                return self._batch_results(chunk, response, attempts)
+            except Exception as e:
+                if not is_message_error(e):
+                    print(f"Error en el envío por lotes tras {e.attempts} intentos: {str(e)}")
+                    return [self._failure(recipient, e, e.attempts) for recipient, _ in chunk]
+                print(f"Error en el envío por lotes, se envía por separado: {str(e)}")
+        
+        return list(await asyncio.gather(
+            *(self._send_one_async(recipient, params) for recipient, params in chunk)
+        ))
+    
+    async def _send_one_async(self, recipient, params) -> dict:
+        try:
+            result, attempts = await self._deliver_retrying_async(self.transport.send_async, params, BULK)
+        except Exception as e:
+            print(f"Error enviando a {recipient.email}: {str(e)}")
+            return self._failure(recipient, e, e.attempts)
+        return dict(result, attempts=attempts)
+    
+    @staticmethod
+    def _failure(recipient: EmailAddress, error: Exception, attempts: int) -> dict:
+        return {
+            "error": str(error),
+            "email": recipient.email,
+            "attempts": attempts,
+            "retryable": classify(error) != PERMANENT
+        }
+    
+    @staticmethod
+    def _batch_results(chunk: List[tuple], response: dict, attempts: int = 1) -> List[dict]:
+        """Asocia a cada destinatario del bloque su resultado en la respuesta del lote."""
+        sent = [dict(result, attempts=attempts) for result in response.get("data") or []]
+        if len(sent) == len(chunk):
+            return sent
+        print(f"Respuesta de lote incompleta: {len(sent)} de {len(chunk)} mensajes")
+        return sent + [
+            {
+                "error": "Sin respuesta del proveedor en el envío por lotes",
+                "email": recipient.email,
+                "attempts": attempts,
+                "retryable": False
+            }
+            for recipient, _ in chunk[len(sent):]
+        ]
@@ -0,0 +1,107 @@
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from models import EmailAddress
+from rate_limit import parse_lane_weights
+
+@dataclass(frozen=True)
+class Settings:
+    """Configuración de la aplicación, leída una sola vez del entorno."""
+    resend_api_key: Optional[str]
+    api_key: Optional[str]
+    from_email: str = "no-reply@example.com"
+    from_name: str = "Email System"
+    template_cache_dir: Optional[str] = None
+    compiled_templates: Optional[str] = None
+    render_cache_size: int = 256
+    render_cache_ttl: float = 300
+    render_workers: int = 0
+    optimize_payload: bool = False
+    watch_templates: bool = False
+    send_concurrency: int = 100
+    send_rate: float = 2
+    send_burst: int = 2
+    send_lane_weights: str = ""
+    retry_max_attempts: int = 4
+    retry_base_delay: float = 0.5
+    retry_max_delay: float = 30
+    outbox_path: str = "data/outbox.db"
+    outbox_workers: int = 4
+    email_transport: str = "resend"
+    smtp_host: str = "localhost"
+    smtp_port: int = 587
+    smtp_username: Optional[str] = None
+    smtp_password: Optional[str] = None
+    smtp_starttls: bool = True
+    smtp_ssl: bool = False
+    smtp_pool_size: int = 4
+    smtp_max_messages: int = 1000
+    smtp_idle_timeout: float = 30
+    maildir_path: str = "data/maildir"
+    idempotency_ttl: float = 86400
+    idempotency_cache_size: int = 10000
+    idempotency_path: Optional[str] = None
+    suppression_list: Optional[str] = None
+    notification_window: float = 0
+    notification_digest_size: int = 20
+    batch_spread: float = 0
+    batch_spread_min: int = 1000
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        return cls(
+            resend_api_key=os.getenv("RESEND_API_KEY"),
+            api_key=os.getenv("API_KEY"),
+            from_email=os.getenv("DEFAULT_FROM_EMAIL", cls.from_email),
+            from_name=os.getenv("DEFAULT_FROM_NAME", cls.from_name),
+            template_cache_dir=os.getenv("TEMPLATE_CACHE_DIR"),
+            compiled_templates=os.getenv("COMPILED_TEMPLATES"),
+            render_cache_size=int(os.getenv("RENDER_CACHE_SIZE", cls.render_cache_size)),
+            render_cache_ttl=float(os.getenv("RENDER_CACHE_TTL", cls.render_cache_ttl)),
+            render_workers=int(os.getenv("RENDER_WORKERS", cls.render_workers)),
+            optimize_payload=os.getenv("PAYLOAD_OPTIMIZE", "").lower() in ("1", "true", "yes"),
+            watch_templates=os.getenv("TEMPLATE_WATCH", "").lower() in ("1", "true", "yes"),
+            send_concurrency=int(os.getenv("SEND_CONCURRENCY", cls.send_concurrency)),
+            send_rate=float(os.getenv("SEND_RATE", cls.send_rate)),
+            send_burst=int(os.getenv("SEND_BURST", cls.send_burst)),
+            send_lane_weights=os.getenv("SEND_LANE_WEIGHTS", cls.send_lane_weights),
+            retry_max_attempts=int(os.getenv("RETRY_MAX_ATTEMPTS", cls.retry_max_attempts)),
+            retry_base_delay=float(os.getenv("RETRY_BASE_DELAY", cls.retry_base_delay)),
+            retry_max_delay=float(os.getenv("RETRY_MAX_DELAY", cls.retry_max_delay)),
+            outbox_path=os.getenv("OUTBOX_PATH", cls.outbox_path),
+            outbox_workers=int(os.getenv("OUTBOX_WORKERS", cls.outbox_workers)),
+            email_transport=os.getenv("EMAIL_TRANSPORT", cls.email_transport),
+            smtp_host=os.getenv("SMTP_HOST", cls.smtp_host),
+            smtp_port=int(os.getenv("SMTP_PORT", cls.smtp_port)),
+            smtp_username=os.getenv("SMTP_USERNAME"),
+            smtp_password=os.getenv("SMTP_PASSWORD"),
+            smtp_starttls=os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes"),
+            smtp_ssl=os.getenv("SMTP_SSL", "").lower() in ("1", "true", "yes"),
+            smtp_pool_size=int(os.getenv("SMTP_POOL_SIZE", cls.smtp_pool_size)),
+            smtp_max_messages=int(os.getenv("SMTP_MAX_MESSAGES", cls.smtp_max_messages)),
+            smtp_idle_timeout=float(os.getenv("SMTP_IDLE_TIMEOUT", cls.smtp_idle_timeout)),
+            maildir_path=os.getenv("MAILDIR_PATH", cls.maildir_path),
+            idempotency_ttl=float(os.getenv("IDEMPOTENCY_TTL", cls.idempotency_ttl)),
+            idempotency_cache_size=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", cls.idempotency_cache_size)),
+            idempotency_path=os.getenv("IDEMPOTENCY_DB"),
+            suppression_list=os.getenv("SUPPRESSION_LIST"),
+            notification_window=float(os.getenv("NOTIFICATION_WINDOW", cls.notification_window)),
+            notification_digest_size=int(os.getenv("NOTIFICATION_DIGEST_SIZE", cls.notification_digest_size)),
+            batch_spread=float(os.getenv("BATCH_SPREAD", cls.batch_spread)),
+            batch_spread_min=int(os.getenv("BATCH_SPREAD_MIN", cls.batch_spread_min))
+        )
+
+    @property
+    def transports(self) -> List[str]:
+        """Transportes de EMAIL_TRANSPORT, en orden de preferencia."""
+        return [name.strip().lower() for name in self.email_transport.split(",") if name.strip()]
+
+    @property
+    def lane_weights(self) -> Dict[str, float]:
+        """Pesos de los carriles de envío de SEND_LANE_WEIGHTS ("bulk=1,transactional=16")."""
+        return parse_lane_weights(self.send_lane_weights)
+
+    @property
+    def default_from(self) -> EmailAddress:
+        return EmailAddress(email=self.from_email, name=self.from_name)
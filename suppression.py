@@ -0,0 +1,138 @@
+import array
+import bisect
+import hashlib
+import math
+import os
+import threading
+from typing import Iterable, Optional, Tuple
+
+
+def normalize_email(address: str) -> str:
+    """Forma canónica de una dirección para compararla: sin espacios y en minúsculas."""
+    return address.strip().lower()
+
+
+def _hashes(address: str) -> Tuple[int, int]:
+    """Dos hashes de 64 bits de una dirección ya normalizada."""
+    digest = hashlib.blake2b(address.encode("utf-8"), digest_size=16).digest()
+    # El segundo hash es impar para que recorra todas las posiciones del filtro
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+class SuppressionList:
+    """
+    Direcciones a las que no se envía (rebotes, bajas), leídas de un fichero
+    con una dirección por línea (se ignoran las líneas vacías, las que
+    empiezan por # y lo que siga a una coma).
+
+    Se guarda un filtro de Bloom y, para descartar casi todos sus falsos
+    positivos, un array ordenado con un hash de 64 bits de cada dirección.
+    Con el 1 % de falsos positivos son unos 10 bits más 8 bytes por
+    dirección (unos 9 MB por millón), frente a más de 100 MB de un set de
+    cadenas. Las direcciones que no están en la lista, la gran mayoría, se
+    resuelven con el filtro en O(1); solo los positivos consultan el array.
+
+    Como se comparan hashes y no direcciones, una dirección que no está en
+    la lista se da por suprimida si pasa el filtro y su hash coincide con el
+    de alguna de las n de la lista: una probabilidad de
+    false_positive_rate * n / 2^64 por consulta (unos 5e-16 con un millón
+    de direcciones y el 1 %), despreciable frente a la de perder un envío
+    por cualquier otro motivo.
+    """
+
+    def __init__(self, addresses: Iterable[str] = (), false_positive_rate: float = 0.01, path: Optional[str] = None):
+        self.false_positive_rate = false_positive_rate
+        self.path = path
+        self._signature = None
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.suppressed = 0
+        self._state = self._build(addresses)
+
+    @classmethod
+    def from_file(cls, path: str, false_positive_rate: float = 0.01) -> "SuppressionList":
+        """Carga la lista de un fichero; si aún no existe, empieza vacía (ver refresh)."""
+        suppression = cls(false_positive_rate=false_positive_rate, path=path)
+        suppression.refresh()
+        return suppression
+
+    def _build(self, addresses: Iterable[str]) -> tuple:
+        # Cargar la lista cuesta unos 7 s por millón de direcciones, casi todo en estos bucles
+        first = array.array("Q")
+        second = array.array("Q")
+        hashes = _hashes
+        for address in addresses:
+            h1, h2 = hashes(address.strip().lower())
+            first.append(h1)
+            second.append(h2)
+
+        count = len(first)
+        if count == 0:
+            return bytearray(), 0, 0, array.array("Q")
+        size = max(8, int(-count * math.log(self.false_positive_rate) / math.log(2) ** 2))
+        hash_count = max(1, round(size / count * math.log(2)))
+        bits = bytearray((size + 7) // 8)
+        offsets = range(hash_count)
+        for h1, h2 in zip(first, second):
+            for i in offsets:
+                position = (h1 + i * h2) % size
+                bits[position >> 3] |= 1 << (position & 7)
+        keys = array.array("Q", sorted(set(first)))
+        return bits, size, hash_count, keys
+
+    @staticmethod
+    def _read(path: str) -> Iterable[str]:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                address = line.split(",", 1)[0].strip()
+                if address and not address.startswith("#") and "@" in address:
+                    yield address
+
+    def refresh(self) -> bool:
+        """Vuelve a cargar el fichero si cambió desde la última carga. Retorna si se recargó."""
+        if self.path is None:
+            return False
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            signature = None
+        if signature == self._signature:
+            return False
+
+        with self._lock:
+            if signature == self._signature:
+                return False
+            state = self._build(self._read(self.path)) if signature is not None else self._build(())
+            # Se sustituye de una vez para que las consultas en curso vean un estado coherente
+            self._state = state
+            self._signature = signature
+        return True
+
+    def __contains__(self, address: str) -> bool:
+        bits, size, hash_count, keys = self._state
+        self.checks += 1
+        if not size:
+            return False
+        h1, h2 = _hashes(normalize_email(address))
+        for i in range(hash_count):
+            position = (h1 + i * h2) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        index = bisect.bisect_left(keys, h1)
+        found = index < len(keys) and keys[index] == h1
+        self.suppressed += found
+        return found
+
+    def __len__(self) -> int:
+        return len(self._state[3])
+
+    def stats(self) -> dict:
+        bits, size, hash_count, keys = self._state
+        return {
+            "size": len(keys),
+            "bytes": len(bits) + keys.itemsize * len(keys),
+            "hash_count": hash_count,
+            "checks": self.checks,
+            "suppressed": self.suppressed
+        }
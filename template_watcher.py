@@ -0,0 +1,140 @@
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set, Tuple
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # watchdog es opcional: sin él se sondea el directorio
+    FileSystemEventHandler = object
+    Observer = None
+
+
+def _snapshot(directory: Path) -> Dict[str, Tuple[int, int]]:
+    """Fecha de modificación y tamaño de cada fichero del directorio."""
+    files = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = Path(root) / name
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files[path.relative_to(directory).as_posix()] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+class _EventHandler(FileSystemEventHandler):
+    """Traslada los eventos de watchdog (inotify, FSEvents, ...) al watcher."""
+
+    def __init__(self, watcher: "TemplateWatcher"):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        for path in (event.src_path, getattr(event, "dest_path", "")):
+            if path:
+                self.watcher._notify(path)
+
+
+class TemplateWatcher:
+    """
+    Vigila el directorio de plantillas y llama a `callback` con los nombres
+    (relativos al directorio) de las plantillas creadas, modificadas o
+    eliminadas.
+
+    Usa los eventos del sistema de ficheros si watchdog está instalado y, si
+    no, compara periódicamente la fecha y el tamaño de los ficheros. Los
+    cambios que llegan juntos (p. ej. un editor que guarda en varios pasos)
+    se agrupan en una sola notificación.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        callback: Callable[[Set[str]], None],
+        interval: float = 1.0,
+        debounce: float = 0.2
+    ):
+        self.directory = Path(directory).resolve()
+        self.callback = callback
+        self.interval = interval
+        self.debounce = debounce
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._observer = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> "TemplateWatcher":
+        if self._thread is not None:
+            return self
+        self._stopped.clear()
+        if Observer is not None:
+            self._observer = Observer()
+            self._observer.schedule(_EventHandler(self), str(self.directory), recursive=True)
+            self._observer.daemon = True
+            self._observer.start()
+        self._thread = threading.Thread(target=self._run, name="template-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._changed.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        self._thread.join()
+        self._thread = None
+
+    def _notify(self, path: str) -> None:
+        try:
+            name = Path(path).resolve().relative_to(self.directory).as_posix()
+        except ValueError:
+            return
+        with self._lock:
+            self._pending.add(name)
+        self._changed.set()
+
+    def _poll(self, previous: Dict[str, Tuple[int, int]]) -> Dict[str, Tuple[int, int]]:
+        current = _snapshot(self.directory)
+        changed = {
+            name for name in previous.keys() | current.keys()
+            if previous.get(name) != current.get(name)
+        }
+        if changed:
+            with self._lock:
+                self._pending.update(changed)
+        return current
+
+    def _run(self) -> None:
+        snapshot = _snapshot(self.directory) if self._observer is None else None
+        while not self._stopped.is_set():
+            if self._observer is None:
+                self._stopped.wait(self.interval)
+                snapshot = self._poll(snapshot)
+            else:
+                self._changed.wait()
+                self._changed.clear()
+                # Se espera a que el editor termine de escribir antes de notificar
+                self._stopped.wait(self.debounce)
+
+            with self._lock:
+                changed, self._pending = self._pending, set()
+            if changed and not self._stopped.is_set():
+                try:
+                    self.callback(changed)
+                except Exception as e:
+                    print(f"Error al notificar cambios en las plantillas: {str(e)}")
@@ -0,0 +1,13 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Los módulos del servicio están en la raíz del repositorio
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def anyio_backend():
+    # El servicio solo usa asyncio
+    return "asyncio"
@@ -0,0 +1,142 @@
+import asyncio
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+
+import api
+
+API_KEY = "clave-de-prueba"
+HEADERS = {"X-API-Key": API_KEY}
+
+COMPANY = {
+    "name": "ACME",
+    "address": "Calle Principal 123",
+    "support_email": "soporte@acme.com",
+    "website": "https://acme.com",
+    "social_media": {"twitter": "https://twitter.com/acme"},
+    "logo_url": "https://acme.com/logo.png"
+}
+
+
+@pytest.fixture
+def settings_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("API_KEY", API_KEY)
+    monkeypatch.setenv("EMAIL_TRANSPORT", "memory")
+    monkeypatch.setenv("SEND_RATE", "0")
+    monkeypatch.setenv("OUTBOX_PATH", str(tmp_path / "outbox.db"))
+    monkeypatch.delenv("COMPILED_TEMPLATES", raising=False)
+    monkeypatch.delenv("NOTIFICATION_WINDOW", raising=False)
+    return monkeypatch
+
+
+@pytest.fixture
+async def client(settings_env):
+    async with api.lifespan(api.app):
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", headers=HEADERS) as http:
+            yield http
+
+
+def sent_messages():
+    return api.app.state.email_service.transport.messages
+
+
+@pytest.mark.anyio
+async def test_stats_show_render_cache_hits(client):
+    body = {
+        "company": COMPANY,
+        "user": {"email": "ana@example.com", "name": "Ana"},
+        "query": {"dashboard_url": "https://acme.com/panel"}
+    }
+    for _ in range(2):
+        response = await client.post("/api/emails/welcome", json=body)
+        assert response.status_code == 200
+
+    stats = (await client.get("/api/emails/stats")).json()
+    assert stats["render_cache"]["misses"] == 1
+    assert stats["render_cache"]["hits"] == 1
+    assert len(sent_messages()) == 2
+
+
+@pytest.mark.anyio
+async def test_stats_show_payload_bytes(settings_env):
+    settings_env.setenv("PAYLOAD_OPTIMIZE", "1")
+    async with api.lifespan(api.app):
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", headers=HEADERS) as http:
+            body = {
+                "company": COMPANY,
+                "user": {"email": "ana@example.com", "name": "Ana"},
+                "query": {"dashboard_url": "https://acme.com/panel"}
+            }
+            assert (await http.post("/api/emails/welcome", json=body)).status_code == 200
+            stats = (await http.get("/api/emails/stats")).json()
+
+    sent = sum(len(message["html"].encode()) for message in sent_messages())
+    assert stats["payload"]["messages"] == 1
+    assert stats["payload"]["bytes_after"] == sent
+    assert stats["payload"]["bytes_before"] > sent
+
+
+@pytest.mark.anyio
+async def test_stats_show_idempotent_replays(client):
+    body = {
+        "company": COMPANY,
+        "user": {"email": "ana@example.com", "name": "Ana"},
+        "query": {"dashboard_url": "https://acme.com/panel"}
+    }
+    for _ in range(2):
+        response = await client.post("/api/emails/welcome", json=body, headers={"Idempotency-Key": "alta-ana"})
+        assert response.status_code == 200
+
+    stats = (await client.get("/api/emails/stats")).json()
+    assert (stats["idempotency"]["hits"], stats["idempotency"]["misses"]) == (1, 1)
+    assert len(sent_messages()) == 1
+
+
+SINGLE_EMAILS = [
+    ("welcome", {"query": {"dashboard_url": "https://acme.com/panel"}}),
+    ("password-reset", {"query": {"reset_url": "https://acme.com/reset", "expires_in": 2}}),
+    ("notification", {
+        "query": {
+            "title": "Pedido enviado",
+            "message": "Tu pedido está en camino",
+            "type": "success",
+            "action_url": "https://acme.com/pedidos/1",
+            "action_text": "Ver pedido",
+            "preferences_url": "https://acme.com/preferencias"
+        }
+    }),
+    # Sin tipo ni URL de preferencias
+    ("notification", {"query": {"title": "Aviso", "message": "Mensaje"}}),
+    ("alert", {"alert": {"title": "Nuevo acceso", "message": "Desde otro dispositivo", "type": "warning"}})
+]
+
+
+async def wait_for_job(client, job_id):
+    for _ in range(100):
+        job = (await client.get(f"/api/emails/jobs/{job_id}")).json()
+        if job["status"] == "done":
+            return job
+        await asyncio.sleep(0.05)
+    raise AssertionError(f"El trabajo {job_id} no terminó: {job}")
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("endpoint, data", SINGLE_EMAILS)
+async def test_scheduled_email_matches_the_immediate_one(client, endpoint, data):
+    body = {"company": COMPANY, "user": {"email": "ana@example.com", "name": "Ana <Admin>"}, **data}
+    response = await client.post(f"/api/emails/{endpoint}", json=body)
+    assert response.status_code == 200
+
+    response = await client.post(
+        f"/api/emails/{endpoint}",
+        json={**body, "send_at": datetime.now(timezone.utc).isoformat()}
+    )
+    assert response.status_code == 202
+    job = await wait_for_job(client, response.json()["job_id"])
+    assert job["sent"] == 1
+
+    immediate, scheduled = sent_messages()
+    assert scheduled == immediate
@@ -0,0 +1,118 @@
+import asyncio
+from dataclasses import replace
+
+import pytest
+
+from benchmarks.samples import sample_company
+from coalesce import NotificationCoalescer
+from models import EmailAddress, Notification
+from outbox import Outbox
+from service import EmailService
+from transports import MemoryTransport
+
+USER = EmailAddress("ana@example.com", "Ana")
+PREFERENCES_URL = "https://miempresa.com/preferencias"
+
+
+def notification(i):
+    return Notification(f"Aviso {i}", f"Mensaje {i}", "info")
+
+
+@pytest.fixture
+def transport():
+    return MemoryTransport()
+
+
+@pytest.fixture
+def service(transport):
+    service = EmailService(
+        None,
+        EmailAddress("noreply@example.com"),
+        transport=transport,
+        render_cache_size=0,
+        send_rate=0
+    )
+    yield service
+    service.close()
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.db"))
+    yield outbox
+    outbox.close()
+
+
+@pytest.mark.anyio
+async def test_notifications_in_a_window_are_sent_as_one_digest(service, transport):
+    coalescer = NotificationCoalescer(service, window=0.05)
+    counts = [await coalescer.add(sample_company(), USER, notification(i), PREFERENCES_URL) for i in range(3)]
+    assert counts == [1, 2, 3]
+    assert transport.messages == []
+    assert coalescer.stats()["pending"] == 3
+
+    # Al cerrarse la ventana el envío sale sin llamar a aclose
+    await asyncio.sleep(0.1)
+    await asyncio.gather(*coalescer._sending)
+    assert [message["subject"] for message in transport.messages] == ["Tienes 3 notificaciones nuevas"]
+    assert all(f"Aviso {i}" in transport.messages[0]["html"] for i in range(3))
+    stats = coalescer.stats()
+    assert (stats["received"], stats["pending"], stats["emails"], stats["digests"]) == (3, 0, 1, 1)
+
+
+@pytest.mark.anyio
+async def test_single_notification_is_sent_as_is(service, transport):
+    coalescer = NotificationCoalescer(service, window=60)
+    await coalescer.add(sample_company(), USER, notification(1), PREFERENCES_URL)
+    await coalescer.aclose()
+    assert [message["subject"] for message in transport.messages] == ["Aviso 1"]
+    assert coalescer.stats()["digests"] == 0
+
+
+@pytest.mark.anyio
+async def test_full_digest_is_sent_before_the_window_ends(service, transport):
+    coalescer = NotificationCoalescer(service, window=60, max_size=2)
+    for i in range(3):
+        await coalescer.add(sample_company(), USER, notification(i), PREFERENCES_URL)
+    await asyncio.gather(*coalescer._sending)
+
+    assert [message["subject"] for message in transport.messages] == ["Tienes 2 notificaciones nuevas"]
+    assert coalescer.stats()["pending"] == 1
+    await coalescer.aclose()
+    assert len(transport.messages) == 2
+
+
+@pytest.mark.anyio
+async def test_digests_are_kept_apart_by_company_and_preferences(service, transport):
+    coalescer = NotificationCoalescer(service, window=60)
+    company = sample_company()
+    # Misma dirección con otras mayúsculas: mismo digest
+    await coalescer.add(company, USER, notification(1), PREFERENCES_URL)
+    await coalescer.add(company, EmailAddress(" ANA@example.com"), notification(2), PREFERENCES_URL)
+    # Misma empresa por nombre pero con otros datos, u otra URL de preferencias: otro email
+    await coalescer.add(replace(company, address="Otra calle 1"), USER, notification(3), PREFERENCES_URL)
+    await coalescer.add(company, USER, notification(4), None)
+    await coalescer.aclose()
+
+    assert sorted(message["subject"] for message in transport.messages) == [
+        "Aviso 3", "Aviso 4", "Tienes 2 notificaciones nuevas"
+    ]
+
+
+@pytest.mark.anyio
+async def test_pending_notifications_are_restored_after_a_crash(service, transport, outbox):
+    crashed = NotificationCoalescer(service, window=60, outbox=outbox)
+    for i in range(2):
+        await crashed.add(sample_company(), USER, notification(i), PREFERENCES_URL)
+    # El proceso se detiene sin enviar lo pendiente
+    for pending in crashed._pending.values():
+        pending.timer.cancel()
+    assert len(outbox.held_notifications()) == 2
+
+    coalescer = NotificationCoalescer(service, window=60, outbox=outbox)
+    assert await coalescer.restore() == 2
+    assert coalescer.stats()["pending"] == 2
+    await coalescer.aclose()
+
+    assert [message["subject"] for message in transport.messages] == ["Tienes 2 notificaciones nuevas"]
+    assert outbox.held_notifications() == []
@@ -0,0 +1,124 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+
+from idempotency import IdempotencyMiddleware, IdempotencyStore
+
+
+def make_app(store):
+    app = FastAPI()
+    app.state.idempotency = store
+    app.state.calls = 0
+    app.state.fail = False
+    app.add_middleware(IdempotencyMiddleware)
+
+    @app.post("/send")
+    async def send(data: dict):
+        app.state.calls += 1
+        await asyncio.sleep(0.05)
+        if app.state.fail:
+            raise HTTPException(status_code=503, detail="Proveedor no disponible")
+        return {"call": app.state.calls, "data": data}
+
+    return app
+
+
+def client(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+@pytest.mark.anyio
+async def test_repeated_request_is_replayed():
+    app = make_app(IdempotencyStore())
+    async with client(app) as http:
+        headers = {"Idempotency-Key": "abc", "X-API-Key": "k"}
+        first = await http.post("/send", json={"to": "a@example.com"}, headers=headers)
+        second = await http.post("/send", json={"to": "a@example.com"}, headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json() == {"call": 1, "data": {"to": "a@example.com"}}
+    assert "idempotent-replayed" not in first.headers
+    assert second.headers["idempotent-replayed"] == "true"
+    assert app.state.calls == 1
+
+
+@pytest.mark.anyio
+async def test_key_reused_with_another_body_is_rejected():
+    app = make_app(IdempotencyStore())
+    async with client(app) as http:
+        await http.post("/send", json={"to": "a@example.com"}, headers={"Idempotency-Key": "abc"})
+        response = await http.post("/send", json={"to": "b@example.com"}, headers={"Idempotency-Key": "abc"})
+
+    assert response.status_code == 422
+    assert app.state.calls == 1
+
+
+@pytest.mark.anyio
+async def test_key_is_scoped_to_api_key_and_path():
+    app = make_app(IdempotencyStore())
+    async with client(app) as http:
+        await http.post("/send", json={}, headers={"Idempotency-Key": "abc", "X-API-Key": "uno"})
+        response = await http.post("/send", json={}, headers={"Idempotency-Key": "abc", "X-API-Key": "dos"})
+
+    assert response.json()["call"] == 2
+
+
+@pytest.mark.anyio
+async def test_invalid_key_is_rejected():
+    app = make_app(IdempotencyStore())
+    async with client(app) as http:
+        response = await http.post("/send", json={}, headers={"Idempotency-Key": "x" * 256})
+    assert response.status_code == 400
+    assert app.state.calls == 0
+
+
+@pytest.mark.anyio
+async def test_concurrent_repeats_share_the_original_response():
+    app = make_app(IdempotencyStore())
+    async with client(app) as http:
+        responses = await asyncio.gather(*(
+            http.post("/send", json={}, headers={"Idempotency-Key": "abc"}) for _ in range(3)
+        ))
+
+    assert [r.json()["call"] for r in responses] == [1, 1, 1]
+    assert app.state.calls == 1
+    stats = app.state.idempotency.stats()
+    assert (stats["size"], stats["misses"], stats["coalesced"]) == (1, 1, 2)
+
+
+@pytest.mark.anyio
+async def test_failed_original_is_not_stored():
+    app = make_app(IdempotencyStore())
+    app.state.fail = True
+    async with client(app) as http:
+        responses = await asyncio.gather(*(
+            http.post("/send", json={}, headers={"Idempotency-Key": "abc"}) for _ in range(2)
+        ))
+        # Quien esperaba a la original fallida la vuelve a ejecutar
+        assert [r.status_code for r in responses] == [503, 503]
+        assert app.state.calls == 2
+        assert app.state.idempotency.stats()["misses"] == 2
+
+        app.state.fail = False
+        response = await http.post("/send", json={}, headers={"Idempotency-Key": "abc"})
+    assert response.status_code == 200
+    assert "idempotent-replayed" not in response.headers
+
+
+@pytest.mark.anyio
+async def test_responses_survive_a_restart(tmp_path):
+    path = str(tmp_path / "idempotency.db")
+    async with client(make_app(IdempotencyStore(path=path))) as http:
+        first = await http.post("/send", json={}, headers={"Idempotency-Key": "abc"})
+
+    app = make_app(IdempotencyStore(path=path))
+    async with client(app) as http:
+        second = await http.post("/send", json={}, headers={"Idempotency-Key": "abc"})
+        mismatch = await http.post("/send", json={"otro": 1}, headers={"Idempotency-Key": "abc"})
+
+    assert second.json() == first.json()
+    assert second.headers["idempotent-replayed"] == "true"
+    assert mismatch.status_code == 422
+    assert app.state.calls == 0
@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+from ingest import MAX_LINE_LENGTH, RecipientUpload, UploadError
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part.encode("utf-8") if isinstance(part, str) else part
+
+
+async def read(upload, size=1000):
+    return [recipient async for batch in upload.batches(size) for recipient in batch]
+
+
+@pytest.mark.anyio
+async def test_ndjson_preamble_holds_the_batch_request():
+    preamble = json.dumps({"email_type": "welcome", "company": {"name": "Acme"}})
+    upload = RecipientUpload(chunks(
+        preamble + "\n",
+        '{"email": "a@example.com", "name": "Ana"}\n{"email": "b@exa',
+        'mple.com"}\n'
+    ), "application/x-ndjson")
+
+    assert await read(upload) == [
+        {"email": "a@example.com", "name": "Ana"},
+        {"email": "b@example.com", "name": None}
+    ]
+    assert upload.request == {"email_type": "welcome", "company": {"name": "Acme"}}
+
+
+@pytest.mark.anyio
+async def test_ndjson_first_recipient_is_not_a_preamble():
+    upload = RecipientUpload(chunks('{"email": "a@example.com"}\n'), "application/x-ndjson")
+    assert await read(upload) == [{"email": "a@example.com", "name": None}]
+    assert upload.request is None
+
+
+@pytest.mark.anyio
+async def test_ndjson_invalid_rows_are_counted_and_skipped():
+    upload = RecipientUpload(chunks(
+        '{"email": "a@example.com"}\n',
+        "no es json\n",
+        '{"name": "Sin email"}\n',
+        '["a@example.com"]\n',
+        '{"email": "sin-arroba"}\n',
+        "\n",
+        '{"email": "b@example.com"}'
+    ), "application/x-ndjson")
+
+    assert [r["email"] for r in await read(upload)] == ["a@example.com", "b@example.com"]
+    assert (upload.received, upload.invalid) == (2, 4)
+
+
+@pytest.mark.anyio
+async def test_csv_columns_and_quoting():
+    upload = RecipientUpload(chunks(
+        '{"email_type": "welcome"}\r\n',
+        "Name,EMAIL\r\n",
+        '"Pérez, Ana",ana@example.com\r\n',
+        '"Luis ""Lucho""",luis@example.com\r\n',
+        ",sin-nombre@example.com\r\n",
+        "Solo nombre\r\n"
+    ), "text/csv")
+
+    assert await read(upload) == [
+        {"email": "ana@example.com", "name": "Pérez, Ana"},
+        {"email": "luis@example.com", "name": 'Luis "Lucho"'},
+        {"email": "sin-nombre@example.com", "name": None}
+    ]
+    assert upload.request == {"email_type": "welcome"}
+    assert upload.invalid == 1
+
+
+@pytest.mark.anyio
+async def test_csv_requires_email_column():
+    upload = RecipientUpload(chunks("name,address\nAna,ana@example.com\n"), "text/csv")
+    with pytest.raises(UploadError):
+        await read(upload)
+
+
+@pytest.mark.anyio
+async def test_utf8_bom_and_split_multibyte_characters():
+    data = "﻿email,name\nana@example.com,Añá\n".encode("utf-8")
+    split = data.index("ñ".encode("utf-8")) + 1
+    upload = RecipientUpload(chunks(data[:split], data[split:]), "text/csv")
+    assert await read(upload) == [{"email": "ana@example.com", "name": "Añá"}]
+
+
+@pytest.mark.anyio
+async def test_over_long_line_is_rejected():
+    upload = RecipientUpload(chunks("x" * (MAX_LINE_LENGTH + 1)), "application/x-ndjson")
+    with pytest.raises(UploadError):
+        await read(upload)
+
+
+@pytest.mark.anyio
+async def test_invalid_utf8_is_rejected():
+    upload = RecipientUpload(chunks(b'{"email": "\xff@example.com"}\n'), "application/x-ndjson")
+    with pytest.raises(UploadError):
+        await read(upload)
+
+
+@pytest.mark.anyio
+async def test_batches_are_split_by_size():
+    lines = "".join(f'{{"email": "user{i}@example.com"}}\n' for i in range(5))
+    upload = RecipientUpload(chunks(lines), "application/x-ndjson")
+    sizes = [len(batch) async for batch in upload.batches(2)]
+    assert sizes == [2, 2, 1]
+
+
+def test_unsupported_media_type():
+    with pytest.raises(UploadError):
+        RecipientUpload(chunks(), "application/json")
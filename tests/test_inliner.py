@@ -0,0 +1,69 @@
+import pytest
+from premailer import Premailer
+
+from benchmarks.samples import sample_emails
+from inliner import StyleInliner
+from models import EmailAddress
+from service import EmailService
+
+
+def premailer(html):
+    return Premailer(html, keep_style_tags=True, remove_classes=False, strip_important=False).transform()
+
+
+def page(css, body):
+    return f"<!DOCTYPE html><html><head><style>{css}</style></head><body>{body}</body></html>"
+
+
+CASES = {
+    "specificity": page(
+        "p { color: red; } .note { color: blue; } #main .note { color: green; }",
+        '<div id="main"><p class="note">a</p></div><p>b</p><p class="note">c</p>'
+    ),
+    "important": page(
+        "p { color: red !important; } .note { color: blue; }",
+        '<p class="note" style="font-weight: bold">a</p>'
+    ),
+    "existing_inline_style": page(
+        "td { padding: 4px; color: red; }",
+        '<table><tr><td style="color: blue">a</td></tr></table>'
+    ),
+    "multiple_classes": page(
+        ".a { margin: 0; } .a.b { margin: 2px; } .b { padding: 1px; }",
+        '<div class="a\tb">x</div><div class="b">y</div>'
+    ),
+    "pseudo_classes": page(
+        "a { color: red; } a:hover { color: blue; } li:first-child { font-weight: bold; }",
+        '<a href="#">a</a><ul><li>1</li><li>2</li></ul>'
+    ),
+    "media_queries": page(
+        "p { font-size: 14px; } @media (max-width: 600px) { p { font-size: 12px; } }",
+        "<p>a</p>"
+    ),
+    "html_attributes": page(
+        "table { background-color: #fff; width: 100%; } img { float: left; width: 50px; }",
+        '<table><tr><td><img src="x.png"></td></tr></table>'
+    ),
+    "no_doctype": "<html><head><style>p { color: red; }</style></head><body><p>a</p></body></html>",
+    "unmatched_rules": page(".missing { color: red; } span { color: blue; }", "<p>a</p>")
+}
+
+
+@pytest.mark.parametrize("html", CASES.values(), ids=CASES.keys())
+def test_matches_premailer(html):
+    assert StyleInliner().inline(html) == premailer(html)
+
+
+@pytest.mark.parametrize("email", sample_emails(), ids=lambda email: email.template_name)
+def test_matches_premailer_on_templates(email):
+    service = EmailService(None, EmailAddress("noreply@example.com"), testing=True)
+    html = service.template_env.get_template(email.template_name).render(**email.get_template_data())
+    assert service.inliner.inline(html) == premailer(html)
+
+
+def test_cached_rules_give_the_same_result():
+    inliner = StyleInliner()
+    html = CASES["specificity"]
+    first = inliner.inline(html)
+    assert inliner.inline(html) == first
+    assert inliner.inline(CASES["important"]) == premailer(CASES["important"])
@@ -0,0 +1,134 @@
+import time
+
+import pytest
+
+from outbox import Outbox
+from rate_limit import BULK, DEFAULT_LANE, TRANSACTIONAL
+
+
+def recipients(count, prefix="user"):
+    return [{"email": f"{prefix}{i}@example.com", "name": None} for i in range(count)]
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.db"))
+    yield outbox
+    outbox.close()
+
+
+def test_claim_leases_messages_until_released(outbox):
+    job_id = outbox.enqueue({"email_type": "welcome"}, recipients(3))
+
+    claimed_job, request, messages = outbox.claim()
+    assert claimed_job == job_id
+    assert request == {"email_type": "welcome"}
+    assert [idx for idx, _ in messages] == [0, 1, 2]
+    assert messages[0][1] == {"email": "user0@example.com", "name": None}
+    # Los mensajes tomados no se vuelven a entregar mientras dure el plazo
+    assert outbox.claim() is None
+
+    outbox.release(job_id, [1, 2])
+    _, _, messages = outbox.claim()
+    assert [idx for idx, _ in messages] == [1, 2]
+
+
+def test_claim_respects_limit(outbox):
+    outbox.enqueue({}, recipients(5))
+    _, _, first = outbox.claim(limit=2)
+    _, _, second = outbox.claim(limit=2)
+    _, _, third = outbox.claim(limit=2)
+    assert [idx for idx, _ in first + second + third] == [0, 1, 2, 3, 4]
+    assert outbox.claim() is None
+
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.db"), lease_seconds=0)
+    job_id = outbox.enqueue({}, recipients(2))
+    outbox.claim()
+    time.sleep(0.01)
+
+    claimed_job, _, messages = outbox.claim()
+    assert claimed_job == job_id
+    assert [idx for idx, _ in messages] == [0, 1]
+    outbox.close()
+
+
+def test_complete_counts_each_message_once(outbox):
+    job_id = outbox.enqueue({}, recipients(3))
+    outbox.claim()
+    outbox.complete(job_id, [
+        (0, {"id": "a"}),
+        (1, {"error": "rechazado", "email": "user1@example.com"}),
+        (2, {"skipped": "suppressed", "email": "user2@example.com"})
+    ])
+    # Un resultado repetido (p. ej. tras vencer el plazo) no se vuelve a contar
+    outbox.complete(job_id, [(0, {"id": "a"})])
+
+    job = outbox.job(job_id)
+    assert (job["status"], job["sent"], job["failed"], job["skipped"]) == ("done", 1, 1, 1)
+    assert [(r["seq"], r["index"], r["status"]) for r in outbox.results(job_id)] == [
+        (1, 0, "sent"), (2, 1, "failed"), (3, 2, "skipped")
+    ]
+    assert [r["index"] for r in outbox.results(job_id, after=2)] == [2]
+
+
+
+def test_held_messages_are_released_on_seal(outbox):
+    job_id = outbox.open_job({"email_type": "welcome"})
+    assert outbox.append(job_id, list(enumerate(recipients(2))), hold=True) == 2
+    # Las direcciones repetidas dentro del trabajo se ignoran
+    assert outbox.append(job_id, [(2, {"email": " USER0@example.com "})], hold=True) == 0
+    assert outbox.claim() is None
+    assert outbox.job(job_id)["status"] == "receiving"
+
+    outbox.seal(job_id)
+    claimed_job, _, messages = outbox.claim()
+    assert claimed_job == job_id
+    assert [idx for idx, _ in messages] == [0, 1]
+    assert outbox.job(job_id)["status"] == "running"
+
+
+def test_seal_discards_pending_messages(outbox):
+    job_id = outbox.open_job({})
+    outbox.append(job_id, list(enumerate(recipients(2))))
+    outbox.seal(job_id, discard_pending=True)
+
+    job = outbox.job(job_id)
+    assert (job["status"], job["total"]) == ("done", 0)
+    assert outbox.claim() is None
+
+
+def test_claim_serves_lanes_in_priority_order(outbox):
+    now = time.time()
+    bulk = outbox.enqueue({"lane": BULK}, recipients(2), send_at=now - 60)
+    default = outbox.enqueue({"lane": DEFAULT_LANE}, recipients(1), send_at=now - 30, lane=DEFAULT_LANE)
+    transactional = outbox.enqueue({"lane": TRANSACTIONAL}, recipients(1), lane=TRANSACTIONAL)
+
+    # El carril manda sobre la hora de envío
+    assert [outbox.claim()[0] for _ in range(3)] == [transactional, default, bulk]
+    assert outbox.job(transactional)["lane"] == TRANSACTIONAL
+
+
+def test_claim_orders_by_due_time_within_a_lane(outbox):
+    # Una hora de envío pasada cuenta como el momento de encolar
+    first = outbox.enqueue({}, recipients(2), send_at=time.time() - 60, spread=60)
+    second = outbox.enqueue({}, recipients(1))
+
+    claimed_job, _, messages = outbox.claim()
+    assert (claimed_job, [idx for idx, _ in messages]) == (first, [0])
+    assert outbox.claim()[0] == second
+    assert outbox.claim() is None
+
+
+def test_held_notifications_survive_reopening(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    outbox = Outbox(path)
+    first = outbox.hold_notification("key", {"n": 1})
+    outbox.hold_notification("key", {"n": 2})
+    outbox.release_notifications([first])
+    outbox.close()
+
+    outbox = Outbox(path)
+    assert [(key, payload) for _, key, payload, _ in outbox.held_notifications()] == [("key", {"n": 2})]
+    outbox.close()
@@ -0,0 +1,67 @@
+from benchmarks.samples import sample_emails
+from models import EmailAddress
+from payload import PayloadOptimizer
+from service import EmailService
+
+SENDER = EmailAddress("noreply@example.com")
+RECIPIENTS = [{"email": f"usuario{i}@example.com", "name": f"Usuario {i}"} for i in range(5)]
+
+
+def make_service(**options):
+    return EmailService(None, SENDER, testing=True, optimize_payload=True, **options)
+
+
+def test_optimized_html_is_smaller_and_keeps_text():
+    service = make_service()
+    email = sample_emails()[0]
+    plain = EmailService(None, SENDER, testing=True).send(email, EmailAddress("ana@example.com"), "Asunto")
+    optimized = service.send(email, EmailAddress("ana@example.com"), "Asunto")
+    assert len(optimized["html"]) < len(plain["html"])
+    assert optimized["html"].saved == len(plain["html"].encode()) - len(optimized["html"].encode())
+
+
+def test_every_prepared_message_is_counted():
+    service = make_service()
+    email = sample_emails()[0]
+    full = EmailService(None, SENDER, testing=True, inline_once=False, render_cache_size=0)
+
+    # Lote: el primero y el segundo se renderizan completos, el resto se sustituye en el esqueleto
+    sent = service.send_batch(email, RECIPIENTS, "Asunto")
+    stats = service.payload_stats()
+    assert stats["messages"] == len(RECIPIENTS)
+    assert stats["bytes_after"] == sum(len(params["html"].encode()) for params in sent)
+    unoptimized = full.send_batch(email, RECIPIENTS, "Asunto")
+    assert stats["bytes_before"] == sum(len(params["html"].encode()) for params in unoptimized)
+
+    # Envíos no personalizados repetidos: el segundo sale de la caché de renderizado
+    for _ in range(2):
+        service.send(email, EmailAddress("ana@example.com"), "Asunto")
+    stats = service.payload_stats()
+    assert stats["messages"] == len(RECIPIENTS) + 2
+    assert service.render_cache.stats()["hits"] == 1
+    assert 0 < stats["saved_ratio"] < 1
+
+
+def test_pool_renders_are_counted():
+    service = make_service(inline_once=False, render_workers=1, render_pool_threshold=1)
+    try:
+        sent = service.send_batch(sample_emails()[0], RECIPIENTS, "Asunto")
+    finally:
+        service.close()
+    stats = service.payload_stats()
+    assert stats["messages"] == len(RECIPIENTS)
+    assert stats["documents"] == 0
+    assert stats["bytes_after"] == sum(len(params["html"].encode()) for params in sent)
+    assert stats["bytes_before"] > stats["bytes_after"]
+
+
+def test_outlook_conditional_comments_are_kept():
+    optimizer = PayloadOptimizer(EmailService(None, SENDER, testing=True).inliner)
+    html = (
+        "<html><head></head><body><!-- quitar --><!--[if mso]><table><tr><td><![endif]-->"
+        "<p>  hola  </p>\n\n<p>adiós</p><!--[if mso]></td></tr></table><![endif]--></body></html>"
+    )
+    optimized = optimizer.optimize(html)
+    assert "quitar" not in optimized
+    assert optimized.count("[if mso]") == 2
+    assert "<p>  hola  </p>" in optimized and "adiós" in optimized
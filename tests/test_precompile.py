@@ -0,0 +1,58 @@
+import pytest
+
+from benchmarks.samples import sample_emails
+from models import EmailAddress
+from precompile import compile_templates
+from service import EmailService
+
+SENDER = EmailAddress("noreply@example.com")
+RECIPIENTS = [{"email": f"usuario{i}@example.com", "name": f"Usuario {i}"} for i in range(3)]
+
+
+def make_service(**options):
+    return EmailService(None, SENDER, testing=True, render_cache_size=0, **options)
+
+
+@pytest.fixture(params=["deflated", None], ids=["zip", "directory"])
+def compiled(request, tmp_path):
+    output = str(tmp_path / ("templates.zip" if request.param else "compiled"))
+    compile_templates(make_service().template_env, output, zip=request.param)
+    return output
+
+
+def test_precompiled_templates_render_the_same_html(compiled):
+    source = make_service()
+    precompiled = make_service(compiled_templates=compiled)
+    for email in sample_emails():
+        assert (
+            precompiled.send_batch(email, RECIPIENTS, "Asunto")
+            == source.send_batch(email, RECIPIENTS, "Asunto")
+        )
+
+
+def test_precompiled_service_never_reads_template_source(compiled, monkeypatch):
+    service = make_service(compiled_templates=compiled)
+    reads = []
+    source_loader = service.template_env.loader.source_loader
+    original = source_loader.get_source
+
+    def get_source(environment, template):
+        reads.append(template)
+        return original(environment, template)
+
+    monkeypatch.setattr(source_loader, "get_source", get_source)
+    service.warm_up()
+    for email in sample_emails():
+        service.send_batch(email, RECIPIENTS, "Asunto")
+        service.send(email, EmailAddress("ana@example.com"), "Asunto")
+
+    assert reads == []
+    assert all(service.analyzer.analyze(email.template_name).precompiled for email in sample_emails())
+
+
+def test_changed_template_is_analyzed_from_source(compiled):
+    service = make_service(compiled_templates=compiled)
+    service.invalidate_templates({"base.html"})
+    analysis = service.analyzer.analyze("welcome.html")
+    assert not analysis.precompiled
+    assert analysis.skeleton is not None
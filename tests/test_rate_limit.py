@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from rate_limit import BULK, DEFAULT_LANE, TRANSACTIONAL, RateLimiter
+
+
+async def grant_order(limiter, lanes):
+    order = []
+
+    async def acquire(lane):
+        await limiter.acquire_async(lane)
+        order.append(lane)
+
+    tasks = []
+    for lane in lanes:
+        tasks.append(asyncio.create_task(acquire(lane)))
+        # Cada petición entra en su carril antes que la siguiente
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return order
+
+
+@pytest.mark.anyio
+async def test_transactional_jumps_ahead_of_waiting_bulk():
+    limiter = RateLimiter(rate=100, burst=1)
+    await limiter.acquire_async(BULK)
+
+    order = await grant_order(limiter, [BULK] * 5 + [TRANSACTIONAL])
+    assert order[0] == TRANSACTIONAL
+    assert order[1:] == [BULK] * 5
+
+
+@pytest.mark.anyio
+async def test_lanes_share_tokens_by_weight():
+    limiter = RateLimiter(rate=200, burst=1, weights={DEFAULT_LANE: 3, BULK: 1})
+    await limiter.acquire_async(BULK)
+
+    order = await grant_order(limiter, [BULK] * 4 + [DEFAULT_LANE] * 6)
+    # Mientras los dos carriles esperan, el normal recibe tres tokens por cada masivo
+    assert order[:8].count(DEFAULT_LANE) == 6
+    assert order[8:] == [BULK] * 2
+    assert sorted(order) == sorted([BULK] * 4 + [DEFAULT_LANE] * 6)
+    stats = limiter.stats()["lanes"]
+    assert (stats[DEFAULT_LANE]["granted"], stats[BULK]["granted"]) == (6, 5)
+
+
+def test_unlimited_rate_does_not_wait():
+    limiter = RateLimiter()
+    for _ in range(100):
+        limiter.acquire(TRANSACTIONAL)
+    assert limiter.stats()["lanes"][TRANSACTIONAL]["granted"] == 100
+
+
+def test_unknown_lane_is_rejected():
+    with pytest.raises(ValueError):
+        RateLimiter().acquire("urgente")
+
+
+def test_throttle_halves_the_rate_and_success_recovers_it():
+    limiter = RateLimiter(rate=10)
+    limiter.throttle(retry_after=0)
+    assert limiter.rate == 5
+    for _ in range(10):
+        limiter.success()
+    assert limiter.rate == 10
@@ -0,0 +1,131 @@
+import os
+import shutil
+import time
+from pathlib import Path
+
+import pytest
+
+from benchmarks.samples import sample_emails
+from models import EmailAddress
+from rendering import PersonalizedRenderer
+from service import EmailService
+
+SENDER = EmailAddress("noreply@example.com", "Remitente")
+
+# Nombres que obligan a escapar o que no caben en una sustitución de texto simple
+RECIPIENTS = [
+    {"email": "ana@example.com", "name": "Ana"},
+    {"email": "bob@example.com", "name": "Bob & <Alice>"},
+    {"email": "zoe@example.com", "name": 'Zoë "Q" O\'Neil'},
+    {"email": "sin-nombre@example.com"},
+    {"email": "multi@example.com", "name": "línea\nsegunda"},
+    {"email": "ana2@example.com", "name": "Ana"}
+]
+
+
+def make_service(**options):
+    return EmailService(None, SENDER, testing=True, render_cache_size=0, **options)
+
+
+def template_id(email):
+    return email.template_name
+
+
+@pytest.mark.parametrize("email", sample_emails(), ids=template_id)
+def test_batch_is_byte_identical_to_full_render(email):
+    fast = make_service().send_batch(email, RECIPIENTS, "Asunto")
+    full = make_service(inline_once=False).send_batch(email, RECIPIENTS, "Asunto")
+    assert [params["html"] for params in fast] == [params["html"] for params in full]
+    assert "Bob &amp; &lt;Alice&gt;" in fast[1]["html"]
+
+
+@pytest.mark.parametrize("email", sample_emails(), ids=template_id)
+def test_personalized_send_is_byte_identical_to_full_render(email):
+    to = [EmailAddress(r["email"], r.get("name")) for r in RECIPIENTS]
+    fast = make_service().send(email, to, "Asunto", personalize=True)
+    full = make_service(inline_once=False).send(email, to, "Asunto", personalize=True)
+    assert [params["html"] for params in fast] == [params["html"] for params in full]
+
+
+@pytest.mark.parametrize("email", sample_emails(), ids=template_id)
+def test_only_the_first_recipients_render_the_whole_template(email):
+    service = make_service()
+    calls = []
+
+    def render_full(template_name, context):
+        calls.append(context["user"]["name"])
+        return service._render_with_inline_styles(template_name, context)
+
+    context = email.get_template_data()
+    renderer = PersonalizedRenderer(
+        render_full, service._inline_styles, service.analyzer.analyze(email.template_name), context
+    )
+    users = [{"name": f"Usuario {i}", "email": f"usuario{i}@example.com"} for i in range(10)]
+    htmls = [renderer.render(user) for user in users]
+
+    # El primero no prepara el esqueleto y el segundo verifica la sustitución
+    assert calls == ["Usuario 0", "Usuario 1"]
+    assert renderer.enabled
+    for user, html in zip(users, htmls):
+        assert html == service._render_with_inline_styles(email.template_name, dict(context, user=user))
+
+
+def test_unsafe_substitution_falls_back_to_full_render():
+    email = sample_emails()[0]
+    service = make_service()
+    context = email.get_template_data()
+    renderer = PersonalizedRenderer(
+        service._render_with_inline_styles,
+        service._inline_styles,
+        service.analyzer.analyze(email.template_name),
+        context
+    )
+    users = [
+        {"name": "Ana", "email": "ana@example.com"},
+        {"name": "Bob", "email": "bob@example.com"},
+        {"name": "<b>Eve</b>\r\n", "email": "eve@example.com"}
+    ]
+    for user in users:
+        assert renderer.render(user) == service._render_with_inline_styles(
+            email.template_name, dict(context, user=user)
+        )
+
+
+@pytest.fixture
+def templates_dir(tmp_path):
+    source = Path(__file__).resolve().parent.parent / "templates"
+    target = tmp_path / "templates"
+    shutil.copytree(source, target)
+    return target
+
+
+def test_analysis_is_cached_per_template_digest(templates_dir):
+    service = make_service(templates_dir=str(templates_dir))
+    service.analyzer.check_interval = 0
+    first = service.analyzer.analyze("welcome.html")
+    assert service.analyzer.analyze("welcome.html") is first
+
+    # Una recarga sin cambios de contenido reutiliza el análisis
+    (templates_dir / "welcome.html").touch()
+    os.utime(templates_dir / "welcome.html", (time.time() + 10, time.time() + 10))
+    assert service.analyzer.analyze("welcome.html") is first
+
+    # Un cambio en la plantilla base produce un análisis nuevo
+    base = templates_dir / "base.html"
+    base.write_text(base.read_text(encoding="utf-8") + "\n<!-- cambio -->", encoding="utf-8")
+    os.utime(base, (time.time() + 20, time.time() + 20))
+    changed = service.analyzer.analyze("welcome.html")
+    assert changed is not first
+    assert changed.digest != first.digest
+
+
+def test_reload_checks_are_throttled(templates_dir, monkeypatch):
+    service = make_service(templates_dir=str(templates_dir))
+    service.analyzer.analyze("welcome.html")
+    loads = []
+    original = service.template_env.get_template
+    monkeypatch.setattr(service.template_env, "get_template", lambda name: loads.append(name) or original(name))
+
+    for _ in range(100):
+        service.analyzer.analyze("welcome.html")
+    assert loads == []
@@ -0,0 +1,132 @@
+import smtplib
+import time
+
+import httpx
+import pytest
+
+from benchmarks.samples import sample_emails
+from models import EmailAddress
+from retry import PERMANENT, RATE_LIMITED, RETRYABLE, RetryPolicy, RetryQueue, classify, is_message_error
+from service import EmailService
+from transports import MemoryTransport
+
+SENDER = EmailAddress("noreply@example.com", "Remitente")
+
+
+class ProviderError(Exception):
+    """Error del proveedor con su código HTTP, como los de resend_client."""
+
+    def __init__(self, code, retry_after=None):
+        super().__init__(f"Error {code}")
+        self.code = code
+        self.retry_after = retry_after
+
+
+@pytest.mark.parametrize("error, expected", [
+    (ProviderError(429), RATE_LIMITED),
+    (ProviderError(500), RETRYABLE),
+    (ProviderError(408), RETRYABLE),
+    (ProviderError(422), PERMANENT),
+    (ProviderError(401), PERMANENT),
+    (httpx.ConnectTimeout("timeout"), RETRYABLE),
+    (smtplib.SMTPServerDisconnected(), RETRYABLE),
+    (smtplib.SMTPDataError(451, b"Try later"), RETRYABLE),
+    (smtplib.SMTPDataError(554, b"Rejected"), PERMANENT),
+    (ValueError("sin código"), PERMANENT)
+])
+def test_classify(error, expected):
+    assert classify(error) == expected
+
+
+def test_only_content_errors_are_message_errors():
+    assert is_message_error(ProviderError(400))
+    assert is_message_error(ProviderError(422))
+    assert not is_message_error(ProviderError(401))
+    assert not is_message_error(ValueError())
+
+
+def test_backoff_is_bounded_by_max_delay():
+    policy = RetryPolicy(base_delay=1, max_delay=5)
+    for attempt in range(1, 10):
+        assert 0 <= policy.delay(ProviderError(503), attempt) <= min(5, 2 ** (attempt - 1))
+
+
+def test_retry_after_is_waited_in_full():
+    policy = RetryPolicy(max_delay=30)
+    error = ProviderError(429, retry_after=20)
+    assert policy.should_retry(error, 1)
+    assert policy.delay(error, 1) == 20
+
+
+def test_retry_after_beyond_max_delay_gives_up():
+    policy = RetryPolicy(max_delay=30)
+    assert not policy.should_retry(ProviderError(429, retry_after=31), 1)
+
+
+def test_attempts_and_permanent_errors_stop_retries():
+    policy = RetryPolicy(max_attempts=3)
+    assert policy.should_retry(ProviderError(503), 2)
+    assert not policy.should_retry(ProviderError(503), 3)
+    assert not policy.should_retry(ProviderError(422), 1)
+
+
+def test_retry_queue_runs_callbacks_by_due_time():
+    queue = RetryQueue()
+    calls = []
+    queue.schedule(0.02, calls.append, "tarde")
+    queue.schedule(0, calls.append, "ya")
+    queue.run_due()
+    assert calls == ["ya"] and len(queue) == 1
+    queue.drain()
+    assert calls == ["ya", "tarde"] and queue.next_due() is None
+
+
+class FlakyTransport(MemoryTransport):
+    """Falla con `error` los primeros `failures` envíos a `flaky`."""
+
+    def __init__(self, flaky, error, failures=1):
+        super().__init__()
+        self.flaky = flaky
+        self.error = error
+        self.failures = failures
+        self.order = []
+
+    def send(self, params):
+        self.order.append(params["to"])
+        if params["to"] == self.flaky and self.failures:
+            self.failures -= 1
+            raise self.error
+        return super().send(params)
+
+
+def personalized_send(transport, policy):
+    service = EmailService(
+        None,
+        SENDER,
+        transport=transport,
+        render_cache_size=0,
+        send_rate=0,
+        retry_policy=policy
+    )
+    to = [EmailAddress(f"usuario{i}@example.com") for i in range(3)]
+    return service.send(sample_emails()[0], to, "Asunto", personalize=True)
+
+
+def test_personalized_send_retries_without_holding_other_recipients():
+    transport = FlakyTransport("usuario0@example.com", ProviderError(503, retry_after=0.05))
+    start = time.monotonic()
+    results = personalized_send(transport, RetryPolicy(max_delay=1))
+    assert time.monotonic() - start >= 0.05
+    assert len(results) == 3 and all("id" in result for result in results)
+    assert transport.order == [
+        "usuario0@example.com", "usuario1@example.com", "usuario2@example.com", "usuario0@example.com"
+    ]
+
+
+def test_personalized_send_raises_when_retry_after_exceeds_the_budget():
+    error = ProviderError(503, retry_after=60)
+    transport = FlakyTransport("usuario1@example.com", error)
+    with pytest.raises(ProviderError) as raised:
+        personalized_send(transport, RetryPolicy(max_delay=1))
+    assert raised.value is error
+    assert len(transport.order) == 3
@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from api import format_send_at, parse_send_at
+
+
+def test_missing_send_at():
+    assert parse_send_at(None) is None
+
+
+def test_iso_date_with_timezone():
+    assert parse_send_at("2030-01-01T10:00:00+02:00") == datetime(2030, 1, 1, 8, tzinfo=timezone.utc).timestamp()
+
+
+def test_naive_date_is_utc():
+    assert parse_send_at("2030-01-01T10:00:00") == datetime(2030, 1, 1, 10, tzinfo=timezone.utc).timestamp()
+
+
+def test_datetime_objects_are_accepted():
+    # Los endpoints de emails sueltos reciben send_at ya validado por FastAPI
+    assert parse_send_at(datetime(2030, 1, 1, 10)) == datetime(2030, 1, 1, 10, tzinfo=timezone.utc).timestamp()
+
+
+def test_timestamp_in_seconds():
+    assert parse_send_at(1893492000) == 1893492000.0
+
+
+@pytest.mark.parametrize("value", ["mañana", "2030-13-01T00:00:00", [], {}])
+def test_invalid_send_at(value):
+    with pytest.raises(HTTPException) as error:
+        parse_send_at(value)
+    assert error.value.status_code == 400
+
+
+def test_format_send_at_round_trip():
+    assert format_send_at(None) is None
+    assert parse_send_at(format_send_at(1893492000.5)) == 1893492000.5
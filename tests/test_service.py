@@ -0,0 +1,213 @@
+import pytest
+
+from benchmarks.samples import sample_emails, sample_recipients
+from models import EmailAddress
+from retry import RetryPolicy
+from service import BATCH_SIZE, EmailService
+from transports import MemoryTransport
+
+SENDER = EmailAddress("noreply@example.com", "Remitente")
+
+
+class ProviderError(Exception):
+    """Error del proveedor con su código HTTP, como los de resend_client."""
+
+    def __init__(self, code, retry_after=None):
+        super().__init__(f"Error {code}")
+        self.code = code
+        self.retry_after = retry_after
+
+
+class FailingBatchTransport(MemoryTransport):
+    """
+    Transporte en memoria cuyas llamadas a la API de lotes fallan con los
+    errores de `batch_errors` (uno por llamada) y cuyos envíos sueltos a
+    las direcciones de `rejected` fallan con un 422.
+    """
+
+    def __init__(self, batch_errors=(), rejected=()):
+        super().__init__()
+        self.batch_errors = list(batch_errors)
+        self.rejected = set(rejected)
+        self.batch_calls = 0
+
+    def send(self, params):
+        if params["to"] in self.rejected:
+            raise ProviderError(422)
+        return super().send(params)
+
+    def send_batch(self, params):
+        self.batch_calls += 1
+        if self.batch_errors:
+            raise self.batch_errors.pop(0)
+        return super().send_batch(params)
+
+
+def make_service(transport, **options):
+    options.setdefault("retry_policy", RetryPolicy(max_attempts=3, base_delay=0, max_delay=0))
+    return EmailService(
+        None,
+        SENDER,
+        transport=transport,
+        render_cache_size=0,
+        send_rate=10000,
+        send_burst=10000,
+        **options
+    )
+
+
+def send_batch(service, recipients):
+    return service.send_batch(sample_emails()[0], recipients, "Asunto")
+
+
+async def send_batch_async(service, recipients):
+    return await service.send_batch_async(sample_emails()[0], recipients, "Asunto")
+
+
+@pytest.fixture(params=["sync", "async"])
+def send(request):
+    if request.param == "sync":
+        async def send_sync(service, recipients):
+            return send_batch(service, recipients)
+        return send_sync
+    return send_batch_async
+
+
+@pytest.mark.anyio
+async def test_batch_is_sent_in_chunks(send):
+    transport = FailingBatchTransport()
+    results = await send(make_service(transport), sample_recipients(BATCH_SIZE + 5))
+    assert transport.batch_calls == 2
+    assert [result["id"] for result in results] == [f"memory-{i}" for i in range(1, BATCH_SIZE + 6)]
+    assert all(result["attempts"] == 1 for result in results)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("status", [400, 422])
+async def test_rejected_chunk_is_sent_one_by_one(send, status):
+    recipients = sample_recipients(5)
+    rejected = str(EmailAddress("usuario2@example.com", "Usuario 2"))
+    transport = FailingBatchTransport([ProviderError(status)], rejected=[rejected])
+    results = await send(make_service(transport), recipients)
+    assert transport.batch_calls == 1
+    assert [result.get("email") for result in results] == [None, None, "usuario2@example.com", None, None]
+    assert results[2]["retryable"] is False
+    assert len(transport.messages) == 4
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("status", [401, 403])
+async def test_unauthorized_chunk_fails_without_single_sends(send, status):
+    recipients = sample_recipients(BATCH_SIZE + 5)
+    transport = FailingBatchTransport([ProviderError(status)] * 2)
+    results = await send(make_service(transport), recipients)
+    assert transport.batch_calls == 2
+    assert transport.messages == []
+    assert [result["email"] for result in results] == [r["email"] for r in recipients]
+    assert all(result["retryable"] is False and result["attempts"] == 1 for result in results)
+
+
+@pytest.mark.anyio
+async def test_transient_chunk_error_retries_the_whole_chunk(send):
+    transport = FailingBatchTransport([ProviderError(503)])
+    results = await send(make_service(transport), sample_recipients(5))
+    assert transport.batch_calls == 2
+    assert len(transport.messages) == 5
+    assert all(result["attempts"] == 2 for result in results)
+
+
+@pytest.mark.anyio
+async def test_chunk_fails_after_the_last_attempt(send):
+    transport = FailingBatchTransport([ProviderError(503)] * 3)
+    results = await send(make_service(transport), sample_recipients(5))
+    assert transport.batch_calls == 3
+    assert all(result["retryable"] is True and result["attempts"] == 3 for result in results)
+
+
+@pytest.mark.anyio
+async def test_single_recipient_chunk_skips_the_batch_api(send):
+    transport = FailingBatchTransport([ProviderError(422)])
+    results = await send(make_service(transport), sample_recipients(1))
+    assert transport.batch_calls == 0
+    assert results == [{"id": "memory-1", "attempts": 1}]
+
+
+@pytest.mark.anyio
+async def test_transport_without_batches_sends_one_by_one(send):
+    transport = FailingBatchTransport()
+    transport.supports_batch = False
+    results = await send(make_service(transport), sample_recipients(3))
+    assert transport.batch_calls == 0
+    assert len(results) == 3 and all("id" in result for result in results)
+
+
+class SlowFirstTransport(MemoryTransport):
+    """Falla con 503 el primer envío a `first`; `sends` anota las direcciones enviadas."""
+
+    supports_batch = False
+
+    def __init__(self, first, retry_after):
+        super().__init__()
+        self.first = first
+        self.retry_after = retry_after
+        self.sends = []
+
+    def send(self, params):
+        self.sends.append(params["to"])
+        if params["to"] == self.first and self.sends.count(self.first) == 1:
+            raise ProviderError(503, retry_after=self.retry_after)
+        return super().send(params)
+
+
+def test_iter_batch_reads_recipients_lazily():
+    read = []
+
+    def recipients():
+        for recipient in sample_recipients(3 * BATCH_SIZE):
+            read.append(recipient)
+            yield recipient
+
+    results = make_service(MemoryTransport()).iter_batch(sample_emails()[0], recipients(), "Asunto")
+    assert read == []
+    next(results)
+    assert len(read) == BATCH_SIZE
+    assert sum(1 for _ in results) == 3 * BATCH_SIZE - 1
+
+
+def test_iter_batch_keeps_order_while_a_retry_is_pending():
+    recipients = sample_recipients(5) + [{"email": "usuario1@example.com"}]
+    first = str(EmailAddress("usuario0@example.com", "Usuario 0"))
+    transport = SlowFirstTransport(first, retry_after=0.05)
+    results = list(make_service(transport, retry_policy=RetryPolicy(max_delay=1)).iter_batch(
+        sample_emails()[0], recipients, "Asunto"
+    ))
+    # El reintento sale después de los demás, pero su resultado se entrega primero
+    assert transport.sends[0] == transport.sends[-1] == first
+    assert results[0]["attempts"] == 2
+    assert [result["attempts"] for result in results[1:5]] == [1] * 4
+    assert results[5] == {"email": "usuario1@example.com", "skipped": "duplicate"}
+
+
+def test_iter_batch_bounds_sent_results_waiting_on_a_retry(monkeypatch):
+    monkeypatch.setattr("service.BATCH_LOOKAHEAD", 2 * BATCH_SIZE)
+    first = str(EmailAddress("usuario0@example.com", "Usuario 0"))
+    transport = SlowFirstTransport(first, retry_after=0.2)
+    results = make_service(transport, retry_policy=RetryPolicy(max_delay=1)).iter_batch(
+        sample_emails()[0], sample_recipients(10 * BATCH_SIZE), "Asunto"
+    )
+    assert next(results)["attempts"] == 2
+    # Mientras el primero esperaba su reintento solo se enviaron BATCH_LOOKAHEAD más
+    assert len(transport.sends) == 2 * BATCH_SIZE + 1
+    assert sum(1 for _ in results) == 10 * BATCH_SIZE - 1
+
+
+@pytest.mark.anyio
+async def test_iter_batch_async_keeps_order_and_skipped():
+    recipients = sample_recipients(BATCH_SIZE + 1) + [{"email": "usuario0@example.com"}]
+    service = make_service(FailingBatchTransport([ProviderError(503)]))
+    results = await service.iter_batch_async(sample_emails()[0], recipients, "Asunto")
+    collected = [result async for result in results]
+    assert len(collected) == BATCH_SIZE + 2
+    assert [result["attempts"] for result in collected[:BATCH_SIZE]] == [2] * BATCH_SIZE
+    assert collected[BATCH_SIZE]["attempts"] == 1
+    assert collected[-1]["skipped"] == "duplicate"
@@ -0,0 +1,107 @@
+import smtplib
+
+import pytest
+
+from benchmarks.samples import sample_emails
+from benchmarks.smtp import SinkServer
+from models import EmailAddress
+from service import EmailService
+from transports import SMTPTransport
+
+SENDER = "Remitente <noreply@example.com>"
+
+
+def message(*to):
+    return {"from": SENDER, "to": list(to), "subject": "Asunto", "html": "<p>Hola</p>"}
+
+
+def make_transport(server, **options):
+    options.setdefault("pool_size", 1)
+    return SMTPTransport("127.0.0.1", server.port, starttls=False, **options)
+
+
+def transactions(server):
+    """Paquetes del cliente con órdenes de una transacción (sin EHLO ni QUIT)."""
+    return [packet for packet in server.packets if "MAIL" in packet or "RSET" in packet]
+
+
+def test_session_is_reused_with_rset_and_pipelining():
+    with SinkServer() as server:
+        transport = make_transport(server)
+        for _ in range(3):
+            assert "id" in transport.send(message("ana@example.com", "bob@example.com"))
+        transport.close()
+
+    assert (server.sessions, server.messages) == (1, 3)
+    assert transactions(server) == [
+        ["MAIL", "RCPT", "RCPT", "DATA"],
+        ["RSET", "MAIL", "RCPT", "RCPT", "DATA"],
+        ["RSET", "MAIL", "RCPT", "RCPT", "DATA"]
+    ]
+    assert transport.stats()["messages_sent"] == 3
+
+
+@pytest.mark.parametrize("server_pipelining, client_pipelining", [(False, True), (True, False)])
+def test_commands_wait_for_each_reply_without_pipelining(server_pipelining, client_pipelining):
+    with SinkServer(pipelining=server_pipelining) as server:
+        transport = make_transport(server, pipelining=client_pipelining)
+        transport.send(message("ana@example.com"))
+        transport.send(message("ana@example.com"))
+        transport.close()
+
+    assert server.messages == 2
+    assert transactions(server) == [["MAIL"], ["RSET"], ["MAIL"]]
+
+
+def test_sessions_are_renewed_after_max_messages():
+    with SinkServer() as server:
+        transport = make_transport(server, max_messages=2)
+        for _ in range(3):
+            transport.send(message("ana@example.com"))
+        transport.close()
+
+    assert (server.sessions, server.messages) == (2, 3)
+    assert transport.stats()["connections_recycled"] == 1
+
+
+def test_partially_refused_recipients_are_reported():
+    with SinkServer(refused={"nadie@example.com"}) as server:
+        transport = make_transport(server)
+        result = transport.send(message("ana@example.com", "nadie@example.com"))
+        transport.close()
+
+    assert result["refused"] == {"nadie@example.com": {"code": 550, "message": "No such user"}}
+    assert server.messages == 1
+
+
+def test_refusing_every_recipient_keeps_the_session():
+    with SinkServer(refused={"nadie@example.com"}) as server:
+        transport = make_transport(server)
+        with pytest.raises(smtplib.SMTPRecipientsRefused):
+            transport.send(message("nadie@example.com"))
+        assert "refused" not in transport.send(message("ana@example.com"))
+        transport.close()
+
+    assert (server.sessions, server.messages) == (1, 1)
+
+
+def test_batch_results_include_refused_recipients():
+    with SinkServer(refused={"nadie@example.com"}) as server:
+        service = EmailService(
+            None,
+            EmailAddress("noreply@example.com"),
+            transport=make_transport(server),
+            render_cache_size=0,
+            send_rate=0
+        )
+        results = service.send_batch(
+            sample_emails()[0],
+            [{"email": "ana@example.com"}, {"email": "nadie@example.com"}],
+            "Asunto"
+        )
+        service.close()
+
+    assert "refused" not in results[0]
+    assert "error" in results[1]
+    assert results[1]["retryable"] is False
+    assert server.messages == 1
@@ -0,0 +1,90 @@
+import os
+
+from benchmarks.samples import sample_emails
+from models import EmailAddress
+from service import EmailService
+from suppression import SuppressionList, normalize_email
+
+
+def make_service(suppressed=()):
+    return EmailService(
+        None,
+        EmailAddress("noreply@example.com"),
+        testing=True,
+        render_cache_size=0,
+        suppression_list=SuppressionList(suppressed)
+    )
+
+
+def test_normalize_email():
+    assert normalize_email("  Ana@Example.COM \n") == "ana@example.com"
+
+
+def test_members_are_found_ignoring_case_and_spaces():
+    suppression = SuppressionList(["Rebote@example.com", " baja@example.com "])
+    assert "rebote@example.com" in suppression
+    assert " BAJA@example.com" in suppression
+    assert "otro@example.com" not in suppression
+    assert len(suppression) == 2
+
+
+def test_bloom_positives_are_checked_against_the_hashes():
+    # Con un 50 % de falsos positivos en el filtro, el array debe descartarlos todos
+    suppression = SuppressionList((f"rebote{i}@example.com" for i in range(1000)), false_positive_rate=0.5)
+    assert all(f"rebote{i}@example.com" in suppression for i in range(1000))
+    assert not any(f"cliente{i}@example.com" in suppression for i in range(10000))
+    assert suppression.stats()["suppressed"] == 1000
+
+
+def test_empty_list_suppresses_nothing():
+    suppression = SuppressionList()
+    assert "ana@example.com" not in suppression
+    assert suppression.stats()["size"] == 0
+
+
+def test_file_is_loaded_and_reloaded_when_it_changes(tmp_path):
+    path = tmp_path / "suppression.txt"
+    suppression = SuppressionList.from_file(str(path))
+    assert len(suppression) == 0
+
+    path.write_text("# rebotes\n\nrebote@example.com,hard bounce\nsin-arroba\n", encoding="utf-8")
+    assert suppression.refresh()
+    assert "rebote@example.com" in suppression
+    assert len(suppression) == 1
+    assert not suppression.refresh()
+
+    path.write_text("baja@example.com\n", encoding="utf-8")
+    os.utime(path, ns=(0, 10 ** 18))
+    assert suppression.refresh()
+    assert "rebote@example.com" not in suppression
+    assert "baja@example.com" in suppression
+
+
+def test_filter_recipients_skips_duplicates_and_suppressed():
+    service = make_service(["baja@example.com"])
+    accepted, skipped = service.filter_recipients([
+        {"email": "ana@example.com"},
+        {"email": " ANA@example.com"},
+        {"email": "Baja@example.com"},
+        {"name": "Sin email"},
+        {"email": "bob@example.com"}
+    ])
+    assert [recipient["email"] for recipient in accepted] == ["ana@example.com", "bob@example.com"]
+    assert skipped == [
+        (1, {"email": " ANA@example.com", "skipped": "duplicate"}),
+        (2, {"email": "Baja@example.com", "skipped": "suppressed"})
+    ]
+
+
+def test_batch_keeps_skipped_recipients_in_order():
+    service = make_service(["baja@example.com"])
+    results = service.send_batch(
+        sample_emails()[0],
+        [{"email": "ana@example.com"}, {"email": "baja@example.com"}, {"email": "ana@example.com"}],
+        "Asunto"
+    )
+    assert results[0]["to"] == "ana@example.com"
+    assert [result.get("skipped") for result in results] == [None, "suppressed", "duplicate"]
+    assert EmailService.count_results(results) == {
+        "total": 3, "sent": 1, "failed": 0, "duplicate": 1, "suppressed": 1
+    }
@@ -0,0 +1,101 @@
+import base64
+import email
+from email.header import decode_header, make_header
+
+import pytest
+
+from transports import FailoverTransport, MaildirTransport, MemoryTransport, envelope_recipients, render_message
+
+PARAMS = {
+    "from": "Remitente <noreply@example.com>",
+    "to": ["Zoë <zoe@example.com>", "bob@example.com"],
+    "cc": "cc@example.com",
+    "bcc": ["oculto@example.com"],
+    "subject": "Señales\nde vida",
+    "html": "<p>Hola</p>\n.línea con punto"
+}
+
+
+class ProviderError(Exception):
+    """Error del proveedor con su código HTTP, como los de resend_client."""
+
+    def __init__(self, code):
+        super().__init__(f"Error {code}")
+        self.code = code
+
+
+class BrokenTransport(MemoryTransport):
+    """Transporte que falla siempre con `error`."""
+
+    def __init__(self, error, name="broken"):
+        super().__init__()
+        self.error = error
+        self.name = name
+        self.calls = 0
+
+    def send(self, params):
+        self.calls += 1
+        raise self.error
+
+
+def test_envelope_includes_cc_and_bcc():
+    assert envelope_recipients(PARAMS) == [
+        "zoe@example.com", "bob@example.com", "cc@example.com", "oculto@example.com"
+    ]
+
+
+def test_render_message_headers_and_body():
+    message_id, content = render_message(PARAMS)
+    message = email.message_from_bytes(content)
+    assert message["Message-ID"] == message_id
+    assert message_id.endswith("@example.com>")
+    assert "Bcc" not in message
+    assert str(make_header(decode_header(message["Subject"]))) == "Señales de vida"
+    assert base64.b64decode(message.get_payload()).decode("utf-8") == PARAMS["html"]
+    assert b"\r\n" in content and b"\n" not in content.replace(b"\r\n", b"")
+
+
+def test_maildir_stores_each_message(tmp_path):
+    transport = MaildirTransport(str(tmp_path / "maildir"))
+    response = transport.send_batch([PARAMS, dict(PARAMS, subject="Otro")])
+    assert len(response["data"]) == 2
+    assert len(list((tmp_path / "maildir" / "new").iterdir())) == 2
+
+
+def test_failover_uses_the_next_transport_on_transient_errors():
+    broken = BrokenTransport(ProviderError(503))
+    backup = MemoryTransport()
+    result = FailoverTransport([broken, backup]).send(PARAMS)
+    assert result == {"id": "memory-1"}
+    assert broken.calls == 1 and len(backup.messages) == 1
+
+
+@pytest.mark.parametrize("status", [429, 422])
+def test_failover_keeps_rate_limits_and_permanent_errors(status):
+    broken = BrokenTransport(ProviderError(status))
+    backup = MemoryTransport()
+    with pytest.raises(ProviderError):
+        FailoverTransport([broken, backup]).send(PARAMS)
+    assert backup.messages == []
+
+
+def test_failover_raises_the_last_error():
+    last = ProviderError(502)
+    transport = FailoverTransport([BrokenTransport(ProviderError(503)), BrokenTransport(last)])
+    with pytest.raises(ProviderError) as raised:
+        transport.send(PARAMS)
+    assert raised.value is last
+
+
+@pytest.mark.anyio
+async def test_failover_async():
+    backup = MemoryTransport()
+    result = await FailoverTransport([BrokenTransport(ProviderError(503)), backup]).send_async(PARAMS)
+    assert result == {"id": "memory-1"}
+
+
+def test_failover_batches_only_if_every_transport_does():
+    smtp_like = MemoryTransport()
+    smtp_like.supports_batch = False
+    assert FailoverTransport([MemoryTransport(), MemoryTransport()]).supports_batch
+    assert not FailoverTransport([MemoryTransport(), smtp_like]).supports_batch
@@ -0,0 +1,557 @@
+import asyncio
+import base64
+import itertools
+import logging
+import mailbox
+import re
+import smtplib
+import threading
+import time
+import uuid
+from email.header import Header
+from email.utils import formataddr, formatdate, make_msgid, parseaddr
+from pathlib import Path
+from queue import Empty, LifoQueue
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from resend_client import AsyncResendClient, ResendClient
+from retry import PERMANENT, RATE_LIMITED, classify
+
+logger = logging.getLogger(__name__)
+
+
+def _addresses(value) -> List[str]:
+    if not value:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+def envelope_recipients(params: dict) -> List[str]:
+    """Direcciones a las que se entrega el mensaje (to, cc y bcc)."""
+    return [
+        parseaddr(address)[1]
+        for field in ("to", "cc", "bcc")
+        for address in _addresses(params.get(field))
+    ]
+
+
+def _header(value: str) -> str:
+    """Valor de una cabecera en una sola línea, codificado según RFC 2047 si no es ASCII."""
+    value = " ".join(str(value).splitlines())
+    return value if value.isascii() else Header(value, "utf-8").encode()
+
+
+def _address_header(addresses: List[str]) -> str:
+    return ", ".join(
+        _header(address) if address.isascii() else formataddr(parseaddr(address), "utf-8")
+        for address in addresses
+    )
+
+
+def _base64_part(content_type: str, text: str) -> List[bytes]:
+    body = base64.encodebytes(text.encode("utf-8")).replace(b"\n", b"\r\n")
+    return [
+        f"Content-Type: {content_type}; charset=utf-8".encode("ascii"),
+        b"Content-Transfer-Encoding: base64",
+        b"",
+        body
+    ]
+
+
+def render_message(params: dict) -> Tuple[str, bytes]:
+    """
+    Genera el mensaje RFC 5322 (con fin de línea CRLF) a partir de unos
+    parámetros con el formato de Resend y retorna su Message-ID y sus bytes.
+
+    Las cabeceras y el cuerpo (base64) se escriben directamente: el paquete
+    email tarda varios milisegundos por mensaje en analizar las cabeceras y
+    serializar, más que el propio envío por SMTP.
+    """
+    sender = params["from"]
+    # Con el dominio del remitente make_msgid no resuelve el nombre de la máquina
+    message_id = make_msgid(domain=parseaddr(sender)[1].rpartition("@")[2] or None)
+    headers = [
+        f"From: {_address_header([sender])}",
+        f"To: {_address_header(_addresses(params.get('to')))}"
+    ]
+    if params.get("cc"):
+        headers.append(f"Cc: {_address_header(_addresses(params['cc']))}")
+    if params.get("reply_to"):
+        headers.append(f"Reply-To: {_address_header(_addresses(params['reply_to']))}")
+    headers += [
+        f"Subject: {_header(params.get('subject', ''))}",
+        f"Date: {formatdate(localtime=True)}",
+        f"Message-ID: {message_id}",
+        "MIME-Version: 1.0"
+    ]
+    for name, value in (params.get("headers") or {}).items():
+        headers.append(f"{name}: {_header(value)}")
+    lines = [header.encode("ascii") for header in headers]
+
+    html = params.get("html")
+    if params.get("text") and html:
+        boundary = uuid.uuid4().hex
+        lines.append(f'Content-Type: multipart/alternative; boundary="{boundary}"'.encode("ascii"))
+        lines.append(b"")
+        for content_type, text in (("text/plain", params["text"]), ("text/html", html)):
+            lines.append(f"--{boundary}".encode("ascii"))
+            lines += _base64_part(content_type, text)
+        lines.append(f"--{boundary}--\r\n".encode("ascii"))
+    elif params.get("text"):
+        lines += _base64_part("text/plain", params["text"])
+    else:
+        lines += _base64_part("text/html", html or "")
+    return message_id, b"\r\n".join(lines)
+
+
+class Transport:
+    """
+    Interfaz de los transportes de envío de EmailService.
+
+    Reciben los parámetros de cada mensaje con el formato de la API de Resend
+    (from, to, subject, html, cc, bcc) y retornan {"id": ...}; si el
+    servidor aceptó el mensaje solo para parte de los destinatarios (SMTP),
+    el resultado incluye además "refused": {dirección: {"code", "message"}}.
+    Los que admiten envío por lotes (`supports_batch`) retornan en
+    send_batch {"data": [{"id": ...}, ...]} en el orden de los mensajes. Los
+    errores se lanzan con excepciones que retry.classify sabe clasificar.
+    """
+
+    name = "transport"
+    supports_batch = False
+
+    def send(self, params: dict) -> dict:
+        raise NotImplementedError
+
+    def send_batch(self, params: List[dict]) -> dict:
+        raise NotImplementedError(f"El transporte {self.name} no admite envíos por lotes")
+
+    async def send_async(self, params: dict) -> dict:
+        return await asyncio.to_thread(self.send, params)
+
+    async def send_batch_async(self, params: List[dict]) -> dict:
+        return await asyncio.to_thread(self.send_batch, params)
+
+    def close(self) -> None:
+        pass
+
+    async def aclose(self) -> None:
+        self.close()
+
+
+class ResendTransport(Transport):
+    """Envío con la API de Resend (mensajes sueltos y lotes de hasta 100)."""
+
+    name = "resend"
+    supports_batch = True
+
+    def __init__(self, api_key: str, max_concurrency: int = 100, timeout: float = 30):
+        self.client = ResendClient(api_key, timeout=timeout)
+        self.async_client = AsyncResendClient(api_key, max_concurrency, timeout)
+
+    def send(self, params: dict) -> dict:
+        return self.client.send(params)
+
+    def send_batch(self, params: List[dict]) -> dict:
+        return self.client.send_batch(params)
+
+    async def send_async(self, params: dict) -> dict:
+        return await self.async_client.send(params)
+
+    async def send_batch_async(self, params: List[dict]) -> dict:
+        return await self.async_client.send_batch(params)
+
+    def close(self) -> None:
+        self.client.close()
+
+    async def aclose(self) -> None:
+        await self.async_client.aclose()
+        self.close()
+
+
+class _SessionLost(Exception):
+    """La sesión se cerró antes de enviar el contenido del mensaje (se puede repetir)."""
+
+
+def _dot_stuff(content: bytes) -> bytes:
+    """Duplica los puntos a principio de línea y añade el terminador de DATA."""
+    content = re.sub(rb"(?m)^\.", b"..", content)
+    if not content.endswith(b"\r\n"):
+        content += b"\r\n"
+    return content + b".\r\n"
+
+
+def _refused_result(refused: dict) -> Dict[str, dict]:
+    """Destinatarios rechazados por el servidor, con su respuesta, en un formato serializable."""
+    return {
+        recipient: {
+            "code": code,
+            "message": response.decode("utf-8", "replace") if isinstance(response, bytes) else response
+        }
+        for recipient, (code, response) in refused.items()
+    }
+
+
+class SMTPTransport(Transport):
+    """
+    Envío por SMTP con un pool de sesiones autenticadas.
+
+    Cada sesión (conexión, STARTTLS y login) se reutiliza para muchos
+    mensajes, con un RSET antes de cada uno para partir de una transacción
+    limpia. Si el servidor anuncia PIPELINING (RFC 2920), RSET, MAIL FROM,
+    los RCPT TO y DATA salen juntos, así que cada mensaje cuesta dos idas y
+    vueltas en lugar de cuatro o más.
+
+    Como mucho hay `pool_size` sesiones abiertas; se renuevan tras
+    `max_messages` envíos o `idle_timeout` segundos sin uso, y las que
+    fallan se descartan. Si una sesión del pool resulta estar cerrada antes
+    de enviar el contenido, el mensaje se repite con una sesión nueva.
+    """
+
+    name = "smtp"
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 587,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        starttls: bool = True,
+        use_ssl: bool = False,
+        pool_size: int = 4,
+        timeout: float = 30,
+        max_messages: int = 1000,
+        idle_timeout: float = 30,
+        pipelining: bool = True
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.use_ssl = use_ssl
+        self.pool_size = max(1, pool_size)
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self.pipelining = pipelining
+        self._idle: LifoQueue = LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.connections_opened = 0
+        self.connections_recycled = 0
+        self.messages_sent = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        if self.use_ssl:
+            connection = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                connection.starttls()
+        connection.ehlo_or_helo_if_needed()
+        if self.username:
+            connection.login(self.username, self.password or "")
+        connection.transactions = 0
+        with self._lock:
+            self.connections_opened += 1
+        return connection
+
+    def _acquire(self) -> smtplib.SMTP:
+        self._slots.acquire()
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except Empty:
+                break
+            if time.monotonic() - connection.last_used < self.idle_timeout:
+                return connection
+            # El servidor probablemente ya cerró la sesión: no se espera al QUIT
+            connection.close()
+            with self._lock:
+                self.connections_recycled += 1
+        try:
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, connection: smtplib.SMTP, reusable: bool) -> None:
+        if (
+            reusable
+            and not self._closed
+            and connection.sock is not None
+            and connection.transactions < self.max_messages
+        ):
+            connection.last_used = time.monotonic()
+            self._idle.put(connection)
+        else:
+            if connection.sock is not None:
+                with self._lock:
+                    self.connections_recycled += 1
+            self._quit(connection)
+        self._slots.release()
+
+    @staticmethod
+    def _quit(connection: smtplib.SMTP) -> None:
+        try:
+            connection.quit()
+        except Exception:
+            connection.close()
+
+    def send(self, params: dict) -> dict:
+        message_id, content = render_message(params)
+        sender = parseaddr(params["from"])[1]
+        recipients = envelope_recipients(params)
+        while True:
+            connection = self._acquire()
+            reused = connection.transactions > 0
+            reusable = True
+            try:
+                if sender.isascii() and all(recipient.isascii() for recipient in recipients):
+                    refused = self._send_pipelined(connection, content, sender, recipients, reset=reused)
+                else:
+                    # Direcciones internacionales: smtplib negocia SMTPUTF8
+                    if reused:
+                        connection.rset()
+                    refused = connection.sendmail(sender, recipients, content, mail_options=["SMTPUTF8"])
+                with self._lock:
+                    self.messages_sent += 1
+                result = {"id": message_id}
+                if refused:
+                    # Como en smtplib.sendmail, el mensaje se entregó al resto de destinatarios
+                    result["refused"] = _refused_result(refused)
+                return result
+            except _SessionLost as e:
+                reusable = False
+                if not reused:
+                    raise e.__cause__
+                # La sesión caducó mientras esperaba en el pool: se repite con otra
+            except smtplib.SMTPRecipientsRefused:
+                # El servidor rechazó los destinatarios pero la sesión sigue abierta
+                raise
+            except smtplib.SMTPResponseException as e:
+                # 421: el servidor va a cerrar la conexión
+                reusable = e.smtp_code != 421
+                raise
+            except Exception:
+                reusable = False
+                raise
+            finally:
+                connection.transactions += 1
+                self._release(connection, reusable)
+
+    def _send_pipelined(
+        self,
+        connection: smtplib.SMTP,
+        content: bytes,
+        sender: str,
+        recipients: List[str],
+        reset: bool
+    ) -> Dict[str, Tuple[Optional[int], Optional[bytes]]]:
+        """
+        Envía una transacción completa. Con PIPELINING, RSET, MAIL FROM, los
+        RCPT TO y DATA van en un solo paquete y las respuestas se leen
+        después; sin él, cada orden espera su respuesta. Como
+        smtplib.sendmail, retorna los destinatarios rechazados (si se
+        rechazan todos, lanza SMTPRecipientsRefused).
+        """
+        mail_options = " BODY=8BITMIME" if connection.has_extn("8bitmime") else ""
+        commands = (["RSET"] if reset else []) + [f"MAIL FROM:<{sender}>{mail_options}"]
+        commands += [f"RCPT TO:<{recipient}>" for recipient in recipients]
+        commands.append("DATA")
+
+        try:
+            if self.pipelining and connection.has_extn("pipelining"):
+                connection.send("".join(f"{command}\r\n" for command in commands))
+                replies = [connection.getreply() for _ in commands]
+            else:
+                replies = []
+                for command in commands:
+                    # Sin destinatarios aceptados no se llega a enviar DATA
+                    if command == "DATA" and not any(
+                        code in (250, 251) for code, _ in replies[-len(recipients):]
+                    ):
+                        break
+                    connection.putcmd(command)
+                    replies.append(connection.getreply())
+                    if command.startswith(("RSET", "MAIL")) and replies[-1][0] != 250:
+                        break
+        except (smtplib.SMTPServerDisconnected, OSError) as e:
+            raise _SessionLost() from e
+
+        replies = iter(replies)
+        if reset:
+            code, response = next(replies)
+            if code != 250:
+                self._abort(connection, replies)
+                raise smtplib.SMTPResponseException(code, response)
+        code, response = next(replies)
+        if code != 250:
+            self._abort(connection, replies)
+            raise smtplib.SMTPSenderRefused(code, response, sender)
+        refused = {}
+        for recipient in recipients:
+            code, response = next(replies, (None, None))
+            if code not in (250, 251):
+                refused[recipient] = (code, response)
+        if len(refused) == len(recipients):
+            self._abort(connection, replies)
+            raise smtplib.SMTPRecipientsRefused(refused)
+        code, response = next(replies)
+        if code != 354:
+            raise smtplib.SMTPDataError(code, response)
+
+        connection.send(_dot_stuff(content))
+        code, response = connection.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, response)
+        return refused
+
+    @staticmethod
+    def _abort(connection: smtplib.SMTP, replies) -> None:
+        """
+        Si el servidor aceptó DATA tras un fallo anterior del paquete, espera
+        el contenido del mensaje: la sesión no se puede reutilizar.
+        """
+        if any(code == 354 for code, _ in replies):
+            connection.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "idle": self._idle.qsize(),
+                "connections_opened": self.connections_opened,
+                "connections_recycled": self.connections_recycled,
+                "messages_sent": self.messages_sent
+            }
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._quit(self._idle.get_nowait())
+            except Empty:
+                return
+
+
+class MaildirTransport(Transport):
+    """
+    Guarda cada mensaje en un directorio Maildir en lugar de enviarlo, para
+    revisar los emails generados o medir el rendimiento sin proveedor.
+    """
+
+    name = "maildir"
+    supports_batch = True
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        # Maildir(create=True) no crea las subcarpetas si el directorio ya existe
+        for folder in ("tmp", "new", "cur"):
+            Path(directory, folder).mkdir(parents=True, exist_ok=True)
+        self.mailbox = mailbox.Maildir(directory, create=False)
+        self._lock = threading.Lock()
+
+    def send(self, params: dict) -> dict:
+        _, content = render_message(params)
+        with self._lock:
+            # Los ficheros de un Maildir usan el fin de línea del sistema
+            key = self.mailbox.add(content.replace(b"\r\n", b"\n"))
+        return {"id": key}
+
+    def send_batch(self, params: List[dict]) -> dict:
+        return {"data": [self.send(message) for message in params]}
+
+
+class MemoryTransport(Transport):
+    """Guarda en memoria los parámetros de cada mensaje enviado (pruebas y benchmarks)."""
+
+    name = "memory"
+    supports_batch = True
+
+    def __init__(self):
+        self.messages: List[dict] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def send(self, params: dict) -> dict:
+        with self._lock:
+            self.messages.append(dict(params))
+            return {"id": f"memory-{next(self._ids)}"}
+
+    def send_batch(self, params: List[dict]) -> dict:
+        return {"data": [self.send(message) for message in params]}
+
+    async def send_async(self, params: dict) -> dict:
+        return self.send(params)
+
+    async def send_batch_async(self, params: List[dict]) -> dict:
+        return self.send_batch(params)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.messages.clear()
+
+
+class FailoverTransport(Transport):
+    """
+    Prueba los transportes en orden: si uno falla con un error transitorio
+    (caída del proveedor, timeouts, 5xx) el mensaje se envía con el
+    siguiente. Los errores permanentes no cambian de transporte, y tampoco
+    un 429: el proveedor funciona, así que el error llega al limitador y a
+    la política de reintentos, que esperan lo que indique Retry-After.
+    """
+
+    name = "failover"
+
+    def __init__(self, transports: Sequence[Transport]):
+        if not transports:
+            raise ValueError("Se requiere al menos un transporte")
+        self.transports = list(transports)
+        # Un lote solo se puede repetir en otro transporte si todos admiten lotes
+        self.supports_batch = all(transport.supports_batch for transport in self.transports)
+
+    def _failover(self, call: Callable[[Transport], dict]) -> dict:
+        error = None
+        for transport in self.transports:
+            try:
+                return call(transport)
+            except Exception as e:
+                if classify(e) in (PERMANENT, RATE_LIMITED):
+                    raise
+                logger.warning("Error en el transporte %s: %s", transport.name, e)
+                error = e
+        raise error
+
+    async def _failover_async(self, call) -> dict:
+        error = None
+        for transport in self.transports:
+            try:
+                return await call(transport)
+            except Exception as e:
+                if classify(e) in (PERMANENT, RATE_LIMITED):
+                    raise
+                logger.warning("Error en el transporte %s: %s", transport.name, e)
+                error = e
+        raise error
+
+    def send(self, params: dict) -> dict:
+        return self._failover(lambda transport: transport.send(params))
+
+    def send_batch(self, params: List[dict]) -> dict:
+        return self._failover(lambda transport: transport.send_batch(params))
+
+    async def send_async(self, params: dict) -> dict:
+        return await self._failover_async(lambda transport: transport.send_async(params))
+
+    async def send_batch_async(self, params: List[dict]) -> dict:
+        return await self._failover_async(lambda transport: transport.send_batch_async(params))
+
+    def close(self) -> None:
+        for transport in self.transports:
+            transport.close()
+
+    async def aclose(self) -> None:
+        for transport in self.transports:
+            await transport.aclose()